@@ -0,0 +1,143 @@
+"""
+Analyse des requêtes de chat en une seule passe
+
+Les heuristiques par mots-clés (demande d'explication détaillée, demande de
+code, explication pour DeepSeek) sont regroupées dans une unique expression
+régulière précompilée. Chaque message n'est parcouru qu'une fois, et le
+résultat est mémorisé par contenu : avec OpenWebUI, qui renvoie tout
+l'historique à chaque tour, seuls les nouveaux messages sont analysés.
+"""
+
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+# Classes de requêtes détectées
+EXPLAIN = 1     # Demande d'explication détaillée (max_tokens plus élevé)
+CODE = 2        # Demande de code (température plus basse)
+REASONING = 4   # Demande d'explication pour DeepSeek (température réduite)
+
+KEYWORD_CLASSES = {
+    "détail": EXPLAIN | REASONING,
+    "expliqu": EXPLAIN | REASONING,
+    "explique": EXPLAIN | REASONING,
+    "comment fonctionne": EXPLAIN,
+    "comment": REASONING,
+    "fonctionne": REASONING,
+    "code": CODE,
+    "programme": CODE,
+    "script": CODE,
+    "fonction": CODE,
+    "class": CODE,
+    "api": CODE,
+    "développe": CODE,
+}
+
+ALL_CLASSES = EXPLAIN | CODE | REASONING
+
+def _build_matcher(keyword_classes):
+    # Un mot-clé qui en contient un autre hérite de ses classes : l'alternance ne
+    # retenant qu'un motif par position, "fonctionne" doit aussi compter comme "fonction"
+    classes = {}
+    for keyword in keyword_classes:
+        classes[keyword] = 0
+        for other, other_classes in keyword_classes.items():
+            if other in keyword:
+                classes[keyword] |= other_classes
+    # Motifs les plus longs d'abord pour que l'alternance préfère la correspondance la plus riche
+    keywords = sorted(keyword_classes, key=len, reverse=True)
+    pattern = re.compile("|".join(re.escape(keyword) for keyword in keywords), re.IGNORECASE)
+    return pattern, {keyword.casefold(): value for keyword, value in classes.items()}
+
+_PATTERN, _MATCH_CLASSES = _build_matcher(KEYWORD_CLASSES)
+
+class RequestFeatures(namedtuple("RequestFeatures", ["classes", "chars", "messages", "scanned_messages"])):
+    """
+    Caractéristiques d'une requête, calculées une fois et partagées par les routes et `send_request`
+    """
+    __slots__ = ()
+
+    @property
+    def explain(self):
+        return bool(self.classes & EXPLAIN)
+
+    @property
+    def code(self):
+        return bool(self.classes & CODE)
+
+    @property
+    def reasoning(self):
+        return bool(self.classes & REASONING)
+
+    @property
+    def request_class(self):
+        if self.classes & CODE:
+            return "code"
+        if self.classes & EXPLAIN:
+            return "explain"
+        return "general"
+
+def scan_text(text):
+    """
+    Retourne le masque des classes détectées dans `text` (un seul parcours, arrêt anticipé)
+    """
+    found = 0
+    for match in _PATTERN.finditer(text):
+        found |= _MATCH_CLASSES.get(match.group(0).casefold(), 0)
+        if found == ALL_CLASSES:
+            break
+    return found
+
+class RequestAnalyzer:
+    """
+    Analyseur partagé par toutes les routes, avec un cache LRU par contenu de message
+    """
+
+    def __init__(self, cache_size=4096, min_cached_chars=256):
+        self.cache_size = cache_size
+        self.min_cached_chars = min_cached_chars
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _scan_cached(self, text):
+        # Les messages courts coûtent moins cher à analyser qu'à mettre en cache
+        if len(text) < self.min_cached_chars:
+            return scan_text(text), True
+        # La clé ne retient pas le texte lui-même pour borner la mémoire du cache
+        key = (hash(text), len(text))
+        with self._lock:
+            classes = self._cache.get(key)
+            if classes is not None:
+                self._cache.move_to_end(key)
+                return classes, False
+        classes = scan_text(text)
+        with self._lock:
+            self._cache[key] = classes
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return classes, True
+
+    def analyze_messages(self, messages):
+        """
+        Analyse un historique de messages OpenAI/Ollama
+        """
+        classes = 0
+        chars = 0
+        scanned_messages = 0
+        for message in messages or []:
+            content = message.get("content", "") if isinstance(message, dict) else ""
+            if not isinstance(content, str) or not content:
+                continue
+            chars += len(content)
+            message_classes, scanned = self._scan_cached(content)
+            classes |= message_classes
+            scanned_messages += scanned
+        return RequestFeatures(classes, chars, len(messages or []), scanned_messages)
+
+    def analyze_text(self, text):
+        """
+        Analyse un prompt simple (route /api/generate)
+        """
+        if not isinstance(text, str):
+            return RequestFeatures(0, 0, 0, 0)
+        return RequestFeatures(scan_text(text), len(text), 1, 1)
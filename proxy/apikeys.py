@@ -0,0 +1,318 @@
+"""
+Clés d'API par client, quotas et comptabilité de l'usage
+
+Sans authentification, tous les clients partagent le token OVH : un script
+qui s'emballe épuise le quota de tout le monde. Chaque client reçoit donc
+sa propre clé (`Authorization: Bearer <clé>` ou `X-API-Key`), avec trois
+limites :
+- requêtes par minute et tokens par minute, en seaux à jetons : le seau de
+  requêtes est débité à l'admission, celui de tokens après la réponse, du
+  nombre réel de tokens (prompt et génération) rapporté par OVH ; un seau
+  de tokens vide refuse les requêtes suivantes jusqu'à son remplissage ;
+- requêtes simultanées.
+
+Les clés sont conservées hachées (SHA-256) dans un fichier JSON et chargées
+en mémoire dans un dictionnaire indexé par l'empreinte : l'authentification
+et les contrôles sont en O(1), sans entrée/sortie. Les compteurs d'usage
+sont modifiés en mémoire et écrits sur disque par lots, depuis un thread
+dédié : la requête n'attend jamais le disque.
+"""
+
+import hashlib
+import json
+import math
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+
+try:
+    from proxy.middleware import request_context
+except ImportError:
+    from middleware import request_context
+
+KEY_PREFIX = "sk-proxy-"
+
+# Limites d'une clé (0 = illimité)
+LIMIT_FIELDS = ("requests_per_minute", "tokens_per_minute", "max_concurrent")
+
+USAGE_FIELDS = ("requests", "rejected", "prompt_tokens", "completion_tokens")
+
+def hash_key(key):
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+class _Bucket:
+    """
+    Seau à jetons de capacité `rate` par minute (le solde peut devenir négatif : dette)
+    """
+    __slots__ = ("rate", "level", "updated")
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.level = float(rate)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(float(self.rate), self.level + (now - self.updated) * self.rate / 60.0)
+        self.updated = now
+
+    def wait_for(self, amount):
+        """Secondes avant que le solde atteigne `amount`"""
+        return max(0.0, (amount - self.level) * 60.0 / self.rate)
+
+class ApiKey:
+    __slots__ = ("id", "key_hash", "created", "enabled", "limits", "requests", "tokens", "in_flight", "usage")
+
+    def __init__(self, key_id, key_hash, limits, created=None, enabled=True):
+        self.id = key_id
+        self.key_hash = key_hash
+        self.created = created or time.time()
+        self.enabled = enabled
+        self.limits = limits
+        self.requests = _Bucket(limits["requests_per_minute"]) if limits["requests_per_minute"] else None
+        self.tokens = _Bucket(limits["tokens_per_minute"]) if limits["tokens_per_minute"] else None
+        self.in_flight = 0
+        self.usage = dict.fromkeys(USAGE_FIELDS, 0)
+
+    def describe(self):
+        return {"id": self.id, "created": self.created, "enabled": self.enabled, **self.limits,
+                "in_flight": self.in_flight, "usage": dict(self.usage)}
+
+class ApiKeyStore:
+    """
+    Clés d'API en mémoire, adossées à un fichier JSON (clés hachées) et à un
+    fichier d'usage écrit par lots toutes les `flush_interval` secondes
+    """
+
+    def __init__(self, path, usage_path, default_limits=None, flush_interval=5.0):
+        self.path = Path(path)
+        self.usage_path = Path(usage_path)
+        self.default_limits = dict.fromkeys(LIMIT_FIELDS, 0)
+        self.default_limits.update(default_limits or {})
+        self.flush_interval = flush_interval
+        self._by_hash = {}
+        self._by_id = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def _limits(self, values):
+        limits = {}
+        for field in LIMIT_FIELDS:
+            value = values.get(field, self.default_limits[field])
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                raise ValueError(f"{field} doit être un entier positif ou nul: {value!r}")
+            limits[field] = value
+        return limits
+
+    def load(self):
+        """Charge les clés et l'usage enregistrés ; retourne le nombre de clés"""
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        keys = {}
+        for entry in data.get("keys", []):
+            key = ApiKey(entry["id"], entry["key_sha256"], self._limits(entry),
+                         created=entry.get("created"), enabled=entry.get("enabled", True))
+            keys[key.id] = key
+        try:
+            with open(self.usage_path, "r") as f:
+                usage = json.load(f).get("keys", {})
+        except FileNotFoundError:
+            usage = {}
+        except (OSError, ValueError) as e:
+            print(f"Usage des clés d'API illisible ({self.usage_path}): {str(e)}")
+            usage = {}
+        for key_id, counters in usage.items():
+            if key_id in keys:
+                keys[key_id].usage.update({field: counters.get(field, 0) for field in USAGE_FIELDS})
+        with self._lock:
+            self._by_id = keys
+            self._by_hash = {key.key_hash: key for key in keys.values()}
+        return len(keys)
+
+    def _save_keys(self):
+        entries = [
+            {"id": key.id, "key_sha256": key.key_hash, "created": key.created, "enabled": key.enabled, **key.limits}
+            for key in self._by_id.values()
+        ]
+        _atomic_write(self.path, {"keys": entries})
+
+    def create(self, key_id, **limits):
+        """Crée une clé ; retourne (clé en clair, description). La clé en clair n'est pas conservée."""
+        if not isinstance(key_id, str) or not key_id:
+            raise ValueError("L'identifiant de la clé est requis.")
+        limits = self._limits(limits)
+        secret = KEY_PREFIX + secrets.token_urlsafe(24)
+        key = ApiKey(key_id, hash_key(secret), limits)
+        with self._lock:
+            if key_id in self._by_id:
+                raise ValueError(f"La clé {key_id} existe déjà.")
+            self._by_id[key_id] = key
+            self._by_hash[key.key_hash] = key
+            self._save_keys()
+        return secret, key.describe()
+
+    def delete(self, key_id):
+        with self._lock:
+            key = self._by_id.pop(key_id, None)
+            if key is None:
+                return False
+            self._by_hash.pop(key.key_hash, None)
+            self._save_keys()
+        return True
+
+    def describe(self):
+        with self._lock:
+            return [key.describe() for key in self._by_id.values()]
+
+    def authenticate(self, secret):
+        """Clé correspondant au secret présenté, ou None"""
+        if not secret:
+            return None
+        key = self._by_hash.get(hash_key(secret))
+        return key if key is not None and key.enabled else None
+
+    def admit(self, key):
+        """
+        Contrôle les limites de la clé et réserve une place ; retourne None si la requête
+        est admise, sinon (raison, secondes avant de réessayer)
+        """
+        now = time.monotonic()
+        with self._lock:
+            refusal = None
+            max_concurrent = key.limits["max_concurrent"]
+            if max_concurrent and key.in_flight >= max_concurrent:
+                refusal = ("concurrency", 1)
+            if refusal is None and key.requests is not None:
+                key.requests.refill(now)
+                if key.requests.level < 1:
+                    refusal = ("requests_per_minute", key.requests.wait_for(1))
+            if refusal is None and key.tokens is not None:
+                key.tokens.refill(now)
+                if key.tokens.level <= 0:
+                    refusal = ("tokens_per_minute", key.tokens.wait_for(1))
+            self._dirty = True
+            if refusal is not None:
+                key.usage["rejected"] += 1
+                return refusal[0], max(1, math.ceil(refusal[1]))
+            if key.requests is not None:
+                key.requests.level -= 1
+            key.in_flight += 1
+            key.usage["requests"] += 1
+        return None
+
+    def release(self, key, prompt_tokens=0, completion_tokens=0):
+        """Libère la place de la requête et débite les tokens consommés"""
+        prompt_tokens = prompt_tokens or 0
+        completion_tokens = completion_tokens or 0
+        with self._lock:
+            key.in_flight = max(0, key.in_flight - 1)
+            key.usage["prompt_tokens"] += prompt_tokens
+            key.usage["completion_tokens"] += completion_tokens
+            if key.tokens is not None:
+                key.tokens.refill(time.monotonic())
+                key.tokens.level -= prompt_tokens + completion_tokens
+            self._dirty = True
+
+    def flush(self):
+        """Écrit les compteurs d'usage s'ils ont changé depuis la dernière écriture"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            usage = {key.id: dict(key.usage) for key in self._by_id.values()}
+        _atomic_write(self.usage_path, {"saved_at": time.time(), "keys": usage})
+
+    def start(self):
+        """Démarre l'écriture périodique de l'usage en arrière-plan"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="api-usage-flush", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erreur lors de l'écriture de l'usage des clés d'API: {str(e)}")
+
+def _atomic_write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def presented_key(scope):
+    """Clé d'API présentée dans les en-têtes (Authorization: Bearer ou X-API-Key)"""
+    for name, value in scope.get("headers") or []:
+        if name == b"x-api-key":
+            return value.decode("latin-1").strip()
+        if name == b"authorization":
+            scheme, _, credentials = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer":
+                return credentials.strip()
+    return None
+
+class ApiKeyMiddleware:
+    """
+    Middleware ASGI pur qui exige une clé d'API valide sur les routes LLM (`paths`),
+    applique ses limites (429 avec Retry-After) et comptabilise son usage. Placé
+    à l'intérieur du JournalMiddleware : l'identifiant de la clé devient le client
+    de la requête dans le journal, et les tokens rapportés par OVH y sont lus.
+    """
+
+    def __init__(self, app, store, paths):
+        self.app = app
+        self.store = store
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        key = self.store.authenticate(presented_key(scope))
+        if key is None:
+            await _reject(send, 401, "Clé d'API absente ou invalide.", [(b"www-authenticate", b"Bearer")])
+            return
+        ctx = request_context.get()
+        if ctx is not None:
+            ctx["client_id"] = key.id
+        refusal = self.store.admit(key)
+        if refusal is not None:
+            reason, retry_after = refusal
+            await _reject(send, 429, f"Limite de la clé {key.id} atteinte ({reason}).",
+                          [(b"retry-after", str(retry_after).encode("latin-1"))])
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            ctx = ctx or {}
+            self.store.release(key, ctx.get("prompt_tokens"), ctx.get("completion_tokens"))
+
+async def _reject(send, status, detail, headers):
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))] + headers,
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -1,29 +1,94 @@
-from fastapi import FastAPI, HTTPException, Body, Request
-from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi import FastAPI, HTTPException, Request, Depends, WebSocket
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
+from fastapi.responses import StreamingResponse, Response, PlainTextResponse
+from starlette.datastructures import Headers
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import requests
-import json
 import logging
 import asyncio
-import base64
-import io
-from PIL import Image
 import time
-from dotenv import load_dotenv
 import sys
 from pathlib import Path
 import re
 import random
+import hmac
+from functools import partial
 
-# Charger les variables d'environnement depuis le fichier .env à la racine
-root_env_path = Path(__file__).parent.parent / '.env'
-if root_env_path.exists():
-    print(f"Chargement des variables d'environnement depuis {root_env_path}")
-    load_dotenv(dotenv_path=root_env_path)
-else:
-    print(f"Fichier .env non trouvé à {root_env_path}, utilisation des variables d'environnement système")
-    load_dotenv()  # Charger depuis le .env dans le répertoire courant s'il existe
+try:
+    # Importer depuis le package proxy (pour Docker)
+    from proxy.middleware import RequestLoggingMiddleware, JournalMiddleware, CompressionMiddleware, DrainMiddleware, annotate_request, request_context, finish_request, get_client_id
+    from proxy import journal
+    from proxy.catalog import ModelCatalog, etag_matches
+    from proxy.routing import RoutingManager, RoutingConfigError, EndpointTarget, default_config_path
+    from proxy.upstream import UpstreamPools, set_read_timeout
+    from proxy.analyzer import RequestAnalyzer
+    from proxy.context import ContextWindowManager
+    from proxy import fastjson
+    from proxy.fastjson import FastJSONResponse, json_body
+    from proxy.passthrough import inspect_request, patch_model, extract_usage, has_generated_text
+    from proxy.capture import TrafficCapture, CaptureMiddleware
+    from proxy.profiling import ProfileStore, ProfilingMiddleware, StackSampler, PROFILE_FORMATS
+    from proxy.metrics import Metrics
+    from proxy.loopmonitor import LoopLagMonitor
+    from proxy.diagnostics import DiagnosticsCache, run_probes
+    from proxy.discovery import ModelDiscovery
+    from proxy.lifecycle import Lifecycle
+    from proxy.cancellation import CancelToken, ClientDisconnected, backoff, raise_if_cancelled, call_until_disconnect, cancellable_stream, current_token
+    from proxy.streaming import UpstreamStalled, EmptyUpstreamResponse, read_completion, iter_sse_data, CompletionAssembler
+    from proxy.completion_stats import CompletionStats
+    from proxy.fallback import ModelHealth, ModelUnavailable, FALLBACK_STATUS
+    from proxy.autoroute import DecisionLog, choose_model, estimate_prompt_tokens
+    from proxy.apikeys import ApiKeyStore, ApiKeyMiddleware, LIMIT_FIELDS, presented_key
+    from proxy.usage import UsageLedger
+    from proxy.wschat import ChatChannel, POLICY_VIOLATION
+except ImportError:
+    # Importer directement (pour le développement local)
+    from middleware import RequestLoggingMiddleware, JournalMiddleware, CompressionMiddleware, DrainMiddleware, annotate_request, request_context, finish_request, get_client_id
+    import journal
+    from catalog import ModelCatalog, etag_matches
+    from routing import RoutingManager, RoutingConfigError, EndpointTarget, default_config_path
+    from upstream import UpstreamPools, set_read_timeout
+    from analyzer import RequestAnalyzer
+    from context import ContextWindowManager
+    import fastjson
+    from fastjson import FastJSONResponse, json_body
+    from passthrough import inspect_request, patch_model, extract_usage, has_generated_text
+    from capture import TrafficCapture, CaptureMiddleware
+    from profiling import ProfileStore, ProfilingMiddleware, StackSampler, PROFILE_FORMATS
+    from metrics import Metrics
+    from loopmonitor import LoopLagMonitor
+    from diagnostics import DiagnosticsCache, run_probes
+    from discovery import ModelDiscovery
+    from lifecycle import Lifecycle
+    from cancellation import CancelToken, ClientDisconnected, backoff, raise_if_cancelled, call_until_disconnect, cancellable_stream, current_token
+    from streaming import UpstreamStalled, EmptyUpstreamResponse, read_completion, iter_sse_data, CompletionAssembler
+    from completion_stats import CompletionStats
+    from fallback import ModelHealth, ModelUnavailable, FALLBACK_STATUS
+    from autoroute import DecisionLog, choose_model, estimate_prompt_tokens
+    from apikeys import ApiKeyStore, ApiKeyMiddleware, LIMIT_FIELDS, presented_key
+    from usage import UsageLedger
+    from wschat import ChatChannel, POLICY_VIOLATION
+
+def load_environment():
+    """
+    Charge le premier fichier .env trouvé (racine du dépôt, répertoire courant, répertoire parent),
+    une seule fois, avant toute lecture de la configuration. Les variables déjà définies sont prioritaires.
+    """
+    for env_path in (Path(__file__).parent.parent / '.env', Path('.env'), Path('../.env')):
+        if env_path.exists():
+            # python-dotenv n'est importé que si un fichier .env est présent
+            from dotenv import load_dotenv
+            print(f"Chargement des variables d'environnement depuis {env_path.absolute()}")
+            load_dotenv(dotenv_path=env_path)
+            return env_path
+    print("Aucun fichier .env trouvé, utilisation des variables d'environnement système")
+    return None
+
+load_environment()
+
+# État du démarrage pour les sondes /health/live et /health/ready
+lifecycle = Lifecycle()
 
 # Configuration des logs
 logging.basicConfig(level=logging.INFO)
@@ -44,145 +109,456 @@ def debug_log(message):
     with open('/tmp/proxy_debug.log', 'a') as f:
         f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - DEBUG - {message}\n")
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # Configuration du CORS pour permettre les requêtes depuis OpenWebUI
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Pour le développement, en production, spécifiez les origines exactes
+    # "*" par défaut ; en production, listez les origines autorisées dans CORS_ALLOW_ORIGINS (séparées par des virgules)
+    allow_origins=[origin.strip() for origin in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",") if origin.strip()],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# Middleware pour logger les requêtes et réponses
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Requête entrante: {request.method} {request.url}")
-    
-    # Récupérer le corps de la requête
-    body = await request.body()
-    if body:
+# Compression des réponses selon Accept-Encoding (zstd, brotli, gzip), y compris les flux SSE/NDJSON
+if os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes"):
+    app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", 1024)))
+
+# Middleware pour logger les requêtes et réponses (ASGI pur, sans bufferiser les corps)
+app.add_middleware(
+    RequestLoggingMiddleware,
+    max_body_bytes=int(os.getenv("LOG_BODY_MAX_BYTES", 2000)),
+    logger=logger,
+)
+
+# Journal binaire des requêtes LLM (un enregistrement compact par requête)
+JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "true").lower() in ("1", "true", "yes")
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "/tmp/proxy_journal")
+request_journal = journal.RequestJournal(
+    JOURNAL_DIR,
+    segment_max_bytes=int(os.getenv("JOURNAL_SEGMENT_MAX_BYTES", 16 * 1024 * 1024)),
+    max_segments=int(os.getenv("JOURNAL_MAX_SEGMENTS", 500)),
+)
+JOURNALED_ROUTES = ("/v1/chat/completions", "/v1/completions", "/api/chat", "/api/generate")
+
+# Capture optionnelle du trafic LLM (JSONL nettoyé), rejouable avec proxy.bench.replay
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() in ("1", "true", "yes")
+traffic_capture = None
+if CAPTURE_ENABLED:
+    traffic_capture = TrafficCapture(
+        os.getenv("CAPTURE_PATH", "/tmp/proxy_capture.jsonl"),
+        sample_rate=float(os.getenv("CAPTURE_SAMPLE_RATE", 1.0)),
+        keep_content=os.getenv("CAPTURE_KEEP_CONTENT", "false").lower() in ("1", "true", "yes"),
+    )
+    app.add_middleware(CaptureMiddleware, capture=traffic_capture, paths=JOURNALED_ROUTES)
+
+# Décisions du modèle virtuel `auto` (JSONL, avec le résultat de chaque requête) pour régler sa politique hors ligne
+AUTO_ROUTING_LOG_ENABLED = os.getenv("AUTO_ROUTING_LOG_ENABLED", "true").lower() in ("1", "true", "yes")
+auto_routing_log = DecisionLog(os.getenv("AUTO_ROUTING_LOG_PATH", "/tmp/proxy_auto_routing.jsonl")) if AUTO_ROUTING_LOG_ENABLED else None
+
+# Usage en tokens et coût par modèle, endpoint et client (agrégats par tranche, un fichier par jour)
+USAGE_ENABLED = os.getenv("USAGE_ENABLED", "true").lower() in ("1", "true", "yes")
+usage_ledger = UsageLedger(
+    os.getenv("USAGE_DIR", "/tmp/proxy_usage"),
+    bucket_seconds=int(os.getenv("USAGE_BUCKET_SECONDS", 3600)),
+    flush_interval=float(os.getenv("USAGE_FLUSH_SECONDS", 30)),
+    prices_path=os.getenv("USAGE_PRICES_PATH", str(Path(__file__).parent / "prices.json")),
+) if USAGE_ENABLED else None
+
+def on_request_finished(ctx):
+    """
+    Appelée avec le contexte de chaque requête LLM terminée (flux compris)
+    """
+    if ctx.get("streaming_model"):
+        model_health.end(ctx["streaming_model"])
+    if auto_routing_log is not None and ctx.get("auto_decision") is not None:
+        auto_routing_log.record(ctx["auto_decision"], ctx)
+    if usage_ledger is not None:
+        prompt_tokens, completion_tokens = usage_ledger.record(ctx)
+        model = ctx.get("served_model") or ctx.get("model") or ""
+        if prompt_tokens:
+            metrics.inc("proxy_tokens_total", prompt_tokens, model=model, kind="prompt")
+        if completion_tokens:
+            metrics.inc("proxy_tokens_total", completion_tokens, model=model, kind="completion")
+
+# Clés d'API par client sur les routes LLM : requêtes et tokens par minute, requêtes simultanées.
+# Ajouté avant le JournalMiddleware pour s'exécuter dans le contexte de la requête
+API_KEYS_ENABLED = os.getenv("API_KEYS_ENABLED", "false").lower() in ("1", "true", "yes")
+api_keys = ApiKeyStore(
+    os.getenv("API_KEYS_PATH", str(Path(__file__).parent / "api_keys.json")),
+    os.getenv("API_USAGE_PATH", str(Path(__file__).parent / "api_usage.json")),
+    default_limits={
+        "requests_per_minute": int(os.getenv("API_KEY_DEFAULT_REQUESTS_PER_MINUTE", 60)),
+        "tokens_per_minute": int(os.getenv("API_KEY_DEFAULT_TOKENS_PER_MINUTE", 100000)),
+        "max_concurrent": int(os.getenv("API_KEY_DEFAULT_MAX_CONCURRENT", 4)),
+    },
+    flush_interval=float(os.getenv("API_USAGE_FLUSH_SECONDS", 5)),
+)
+if API_KEYS_ENABLED:
+    app.add_middleware(ApiKeyMiddleware, store=api_keys, paths=JOURNALED_ROUTES)
+
+# Le contexte par requête est toujours ouvert (tokens économisés...), le journal est optionnel
+app.add_middleware(JournalMiddleware, journal=request_journal if JOURNAL_ENABLED else None, paths=JOURNALED_ROUTES,
+                   listeners=[on_request_finished])
+
+# Arrêt progressif (SIGTERM, voir main.py) : les nouvelles requêtes reçoivent un 503 avec Retry-After,
+# les requêtes en cours se terminent jusqu'à DRAIN_TIMEOUT_SECONDS
+app.add_middleware(DrainMiddleware, lifecycle=lifecycle, exempt_paths=("/health", "/api/health"))
+
+@app.on_event("startup")
+def start_request_journal():
+    if JOURNAL_ENABLED:
+        request_journal.start()
+    if traffic_capture is not None:
+        traffic_capture.start()
+    if auto_routing_log is not None:
+        auto_routing_log.start()
+    if usage_ledger is not None:
+        usage_ledger.start()
+    # Les clés sont chargées même sans contrôle, pour pouvoir les créer avant de l'activer
+    with lifecycle.step("api_keys"):
         try:
-            # Tronquer les requêtes très longues pour éviter de remplir les logs
-            body_str = body.decode()
-            if len(body_str) > 2000:  # Augmenter la taille pour voir plus de contexte
-                logger.info(f"Corps de la requête (tronqué): {body_str[:2000]}...")
-            else:
-                logger.info(f"Corps de la requête: {body_str}")
-        except:
-            logger.info("Corps de la requête non décodable")
-    
-    # Traiter la requête
-    response = await call_next(request)
-    
-    # Si c'est une réponse JSON
-    if response.headers.get("content-type") == "application/json":
-        # On ne peut pas directement lire le corps de la réponse après l'avoir envoyé
-        # donc on ne peut pas le logger ici
-        logger.info(f"Réponse: {response.status_code}")
-    
-    return response
+            count = api_keys.load()
+            print(f"Clés d'API chargées depuis {api_keys.path} ({count} clés)")
+        except (OSError, ValueError, KeyError) as e:
+            if API_KEYS_ENABLED:
+                raise
+            print(f"Clés d'API illisibles ({api_keys.path}): {str(e)}")
+    if API_KEYS_ENABLED:
+        api_keys.start()
+
+@app.on_event("shutdown")
+def stop_request_journal():
+    if JOURNAL_ENABLED:
+        request_journal.close()
+    if traffic_capture is not None:
+        traffic_capture.close()
+    if auto_routing_log is not None:
+        auto_routing_log.close()
+    if usage_ledger is not None:
+        usage_ledger.close()
+    if API_KEYS_ENABLED:
+        api_keys.close()
+
+# Token d'administration pour les routes /admin (si absent, seules les requêtes locales sont acceptées)
+PROXY_ADMIN_TOKEN = os.getenv("PROXY_ADMIN_TOKEN")
+
+def is_admin(headers, client_host):
+    """
+    Indique si une requête (en-têtes, adresse du client) a les droits d'administration
+    """
+    if PROXY_ADMIN_TOKEN:
+        authorization = headers.get("authorization", "")
+        provided = headers.get("x-admin-token") or (
+            authorization[7:] if authorization.lower().startswith("bearer ") else ""
+        )
+        return hmac.compare_digest(provided.encode(), PROXY_ADMIN_TOKEN.encode())
+    return client_host in ("127.0.0.1", "::1", "localhost")
+
+def require_admin(request: Request):
+    """
+    Vérifie que la requête est autorisée à accéder aux routes d'administration
+    """
+    if not is_admin(request.headers, request.client.host if request.client else None):
+        if PROXY_ADMIN_TOKEN:
+            raise HTTPException(status_code=403, detail="Accès administrateur refusé.")
+        raise HTTPException(status_code=403, detail="Accès administrateur refusé: définissez PROXY_ADMIN_TOKEN.")
+
+def is_admin_scope(scope):
+    client = scope.get("client")
+    return is_admin(Headers(scope=scope), client[0] if client else None)
+
+# Profilage à la demande (en-tête X-Proxy-Profile: 1 ou /debug/profile), réservé aux administrateurs
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() in ("1", "true", "yes")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+profile_store = ProfileStore(
+    max_profiles=int(os.getenv("PROFILE_MAX_STORED", 20)),
+    directory=os.getenv("PROFILE_DIR") or None,
+)
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware, store=profile_store, authorize=is_admin_scope, interval=PROFILE_INTERVAL)
+
+# Métriques (format Prometheus, GET /metrics) et retard de la boucle d'événements
+metrics = Metrics()
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+loop_monitor = LoopLagMonitor(
+    interval=float(os.getenv("LOOP_MONITOR_INTERVAL_MS", 50)) / 1000,
+    # Mode débogage : journalise la pile du code qui bloque la boucle plus de LOOP_BLOCKING_THRESHOLD_MS
+    detect_blocking=os.getenv("LOOP_BLOCKING_DETECTOR", "false").lower() in ("1", "true", "yes"),
+    threshold=float(os.getenv("LOOP_BLOCKING_THRESHOLD_MS", 100)) / 1000,
+)
+if LOOP_MONITOR_ENABLED:
+    metrics.add_collector(loop_monitor.collect)
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    loop_monitor.stop()
+
+# Routes de diagnostic : sondes parallèles sous un budget global, résultats en cache
+# (servis périmés pendant DIAGNOSTIC_STALE_TTL secondes le temps d'un recalcul en arrière-plan)
+DIAGNOSTIC_BUDGET = float(os.getenv("DIAGNOSTIC_BUDGET_SECONDS", 8))
+DIAGNOSTIC_MAX_WORKERS = int(os.getenv("DIAGNOSTIC_MAX_WORKERS", 16))
+diagnostics_cache = DiagnosticsCache(
+    ttl=float(os.getenv("DIAGNOSTIC_TTL_SECONDS", 30)),
+    stale_ttl=float(os.getenv("DIAGNOSTIC_STALE_TTL_SECONDS", 300)),
+)
+
+async def cached_diagnostic(key, compute):
+    """
+    Résultat d'un diagnostic depuis le cache ; l'en-tête X-Proxy-Cache indique fresh, stale ou miss
+    """
+    result, state, age = await diagnostics_cache.get(key, compute)
+    return FastJSONResponse(result, headers={"x-proxy-cache": state, "age": str(int(age))})
 
 # Récupérer le token d'authentification depuis la variable d'environnement
 # Essayer d'abord OVH_TOKEN_ENDPOINT (défini dans le conteneur) puis OVH_API_TOKEN (pour compatibilité)
 OVH_API_TOKEN = os.getenv('OVH_TOKEN_ENDPOINT') or os.getenv('OVH_API_TOKEN')
 
-# Si le token n'est pas trouvé, essayer de le charger depuis le fichier .env
-if not OVH_API_TOKEN:
-    try:
-        from dotenv import load_dotenv
-        # Essayer de charger depuis le répertoire courant
-        env_path = Path('.env')
-        if env_path.exists():
-            load_dotenv(env_path)
-            print(f"Chargement des variables d'environnement depuis {env_path.absolute()}")
-            OVH_API_TOKEN = os.getenv('OVH_TOKEN_ENDPOINT') or os.getenv('OVH_API_TOKEN')
-        
-        # Si toujours pas de token, essayer de charger depuis le répertoire parent
-        if not OVH_API_TOKEN:
-            parent_env_path = Path('../.env')
-            if parent_env_path.exists():
-                load_dotenv(parent_env_path)
-                print(f"Chargement des variables d'environnement depuis {parent_env_path.absolute()}")
-                OVH_API_TOKEN = os.getenv('OVH_TOKEN_ENDPOINT') or os.getenv('OVH_API_TOKEN')
-    except Exception as e:
-        print(f"Erreur lors du chargement du fichier .env: {str(e)}")
-
 # En mode développement, on peut fonctionner sans token
 if not OVH_API_TOKEN:
     print("AVERTISSEMENT: Aucune variable d'environnement OVH_TOKEN_ENDPOINT ou OVH_API_TOKEN n'est définie.")
     print("Le serveur démarre en mode développement (les appels aux API OVH échoueront).")
     OVH_API_TOKEN = "dummy_token_for_development"
 else:
-    # Afficher les premiers caractères du token pour déboguer
-    token_prefix = OVH_API_TOKEN[:10] if len(OVH_API_TOKEN) > 10 else OVH_API_TOKEN
-    token_suffix = OVH_API_TOKEN[-5:] if len(OVH_API_TOKEN) > 5 else ""
-    print(f"Token OVH récupéré: {token_prefix}...{token_suffix} (longueur: {len(OVH_API_TOKEN)})")
-
-# Liste des endpoints OVH pour chaque modèle
-# Les noms des modèles doivent être ceux utilisés par l'API OVH
-# Note: Ces clés peuvent être différentes des noms internes utilisés par l'API
-endpoints = {
-    "mistral-7b-instruct-v0.3": "https://mistral-7b-instruct-v0-3.endpoints.kepler.ai.cloud.ovh.net",
-    "mixtral-8x7b-instruct-v0.1": "https://mixtral-8x7b-instruct-v01.endpoints.kepler.ai.cloud.ovh.net",
-    "mistral-nemo-instruct-2407": "https://mistral-nemo-instruct-2407.endpoints.kepler.ai.cloud.ovh.net",
-    "llama-3-1-8b-instruct": "https://llama-3-1-8b-instruct.endpoints.kepler.ai.cloud.ovh.net",
-    "llama-3-3-70b-instruct": "https://llama-3-3-70b-instruct.endpoints.kepler.ai.cloud.ovh.net",
-    "llama-3-1-70b-instruct": "https://llama-3-1-70b-instruct.endpoints.kepler.ai.cloud.ovh.net",
-    "deepseek-r1-distill-llama-70b": "https://deepseek-r1-distill-llama-70b.endpoints.kepler.ai.cloud.ovh.net",
-    "mamba-codestral-7b-v0-1": "https://mamba-codestral-7b-v0-1.endpoints.kepler.ai.cloud.ovh.net",
-    "stable-diffusion-xl": "https://stable-diffusion-xl.endpoints.kepler.ai.cloud.ovh.net"
-}
+    # Jamais le token lui-même dans les logs
+    print("Token OVH configuré")
 
-# Configuration des endpoints alternatifs
-# Format: {modèle: [endpoint_url1, endpoint_url2, ...]}
-alternative_endpoints = {
-    # Exemple: "mistral-7b-instruct-v0.3": [
-    #     "https://mistral-7b-instruct-v0-3.endpoints.alternative1.ai.cloud.ovh.net",
-    #     "https://mistral-7b-instruct-v0-3.endpoints.alternative2.ai.cloud.ovh.net"
-    # ]
-}
+# Table de routage des modèles (endpoints principaux et alternatifs, poids, tokens),
+# chargée au démarrage (load_configuration) puis rechargée à chaud quand endpoints_config.json change
+routing = RoutingManager(default_config_path(), default_token=OVH_API_TOKEN)
 
-# Charger la configuration des endpoints alternatifs depuis un fichier JSON si disponible
-endpoints_config_path = Path('endpoints_config.json')
-if endpoints_config_path.exists():
+# Pools de connexions HTTP vers les endpoints OVH
+upstream_pools = UpstreamPools(pool_maxsize=int(os.getenv("UPSTREAM_POOL_MAXSIZE", 20)))
+upstream_pools.sync(routing.current.urls)
+metrics.add_collector(lambda: [
+    ("proxy_http_requests_in_flight", "gauge", "Requêtes HTTP en cours de traitement", {}, lifecycle.in_flight),
+    ("proxy_drain_refused_total", "counter", "Requêtes refusées pendant la vidange (arrêt en cours)", {}, lifecycle.refused),
+])
+metrics.add_collector(lambda: [
+    (f"proxy_upstream_sessions_{name}", "gauge", "Pools de connexions vers OVH (actifs, en retrait, requêtes en cours)", {}, value)
+    for name, value in upstream_pools.stats().items()
+])
+
+# Catalogue des modèles pré-sérialisé, reconstruit uniquement quand la configuration change
+model_catalog = ModelCatalog()
+
+def rebuild_catalog(table):
+    upstream_names = {name: route.upstream_name for name, route in table.models.items()}
+    virtual_models = [table.auto_policy.name] if table.auto_policy is not None else []
+    model_catalog.rebuild(table.endpoints, table.alternative_endpoints, upstream_names, virtual_models)
+
+rebuild_catalog(routing.current)
+
+def on_routing_table_swap(old_table, new_table):
+    """
+    Appelée après chaque rechargement de la configuration des endpoints
+    """
+    rebuild_catalog(new_table)
+    upstream_pools.sync(new_table.urls)
+    # Les diagnostics en cache décrivent l'ancienne liste d'endpoints
+    diagnostics_cache.clear()
+
+routing.add_listener(on_routing_table_swap)
+
+# Découverte des modèles (noms OVH et fenêtres de contexte via /models) : l'instantané
+# est appliqué immédiatement, la découverte est rafraîchie en arrière-plan
+MODEL_DISCOVERY_ENABLED = os.getenv("MODEL_DISCOVERY_ENABLED", "true").lower() in ("1", "true", "yes")
+model_discovery = ModelDiscovery(
+    routing,
+    os.getenv("MODEL_SNAPSHOT_PATH", "/tmp/proxy_models_snapshot.json"),
+    refresh_interval=float(os.getenv("MODEL_DISCOVERY_INTERVAL_SECONDS", 3600)),
+    budget=float(os.getenv("MODEL_DISCOVERY_BUDGET_SECONDS", 10)),
+)
+
+@app.on_event("startup")
+def load_configuration():
+    """
+    Charge une seule fois, au démarrage du serveur, la configuration des endpoints puis
+    l'instantané de la découverte (rien n'est lu à l'import du module)
+    """
+    with lifecycle.step("routing"):
+        try:
+            routing.reload(force=True)
+            if routing.current.source:
+                print(f"Configuration des endpoints chargée depuis {routing.current.source}")
+        except RoutingConfigError as e:
+            print(f"Erreur lors du chargement de la configuration des endpoints: {str(e)}")
+    if MODEL_DISCOVERY_ENABLED:
+        with lifecycle.step("models_snapshot"):
+            model_discovery.load()
+
+@app.on_event("startup")
+def start_model_discovery():
+    if MODEL_DISCOVERY_ENABLED:
+        model_discovery.start()
+
+@app.on_event("shutdown")
+def stop_model_discovery():
+    model_discovery.stop()
+
+# Gestion de la fenêtre de contexte : les derniers tours sont conservés, le milieu de l'historique est retiré
+CONTEXT_TRIM_ENABLED = os.getenv("CONTEXT_TRIM_ENABLED", "true").lower() in ("1", "true", "yes")
+context_manager = ContextWindowManager(
+    keep_last_turns=int(os.getenv("CONTEXT_KEEP_LAST_TURNS", 4)),
+    max_prompt_tokens=int(os.getenv("CONTEXT_MAX_PROMPT_TOKENS", 0)) or None,
+)
+
+@app.on_event("startup")
+def start_routing_watcher():
+    routing.start_watching(float(os.getenv("ENDPOINTS_CONFIG_POLL_SECONDS", 5)))
+
+@app.on_event("shutdown")
+def stop_routing_watcher():
+    routing.stop_watching()
+    # Appelée après la vidange : les requêtes encore en cours ont atteint l'échéance et ont été annulées
+    stats = upstream_pools.stats()
+    if stats["in_flight"]:
+        print(f"Fermeture des pools de connexions avec {stats['in_flight']} appels OVH encore en cours")
+    upstream_pools.close_all()
+
+# Pré-ouverture des connexions vers OVH (TCP + TLS) avant que /health/ready ne réponde 200
+UPSTREAM_PREWARM = os.getenv("UPSTREAM_PREWARM", "false").lower() in ("1", "true", "yes")
+UPSTREAM_PREWARM_CONNECTIONS = int(os.getenv("UPSTREAM_PREWARM_CONNECTIONS", 2))
+UPSTREAM_PREWARM_BUDGET = float(os.getenv("UPSTREAM_PREWARM_BUDGET_SECONDS", 10))
+
+def prewarm_upstreams():
+    """
+    Ouvre des connexions vers chaque endpoint configuré (GET /models, qui vérifie aussi le token).
+    Retourne {endpoint: codes HTTP ou erreur}.
+    """
+    table = routing.current
+    tokens = {target.url: target.token for route in table.models.values() for target in route.targets}
+    probes = {
+        url: partial(
+            upstream_pools.prewarm, url, f"{url}/api/openai_compat/v1/models",
+            connections=UPSTREAM_PREWARM_CONNECTIONS,
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=min(5.0, UPSTREAM_PREWARM_BUDGET),
+        )
+        for url, token in tokens.items()
+    }
+    return run_probes(probes, budget=UPSTREAM_PREWARM_BUDGET, max_workers=DIAGNOSTIC_MAX_WORKERS)
+
+async def warm_up():
     try:
-        with open(endpoints_config_path, 'r') as f:
-            config = json.load(f)
-            if "alternative_endpoints" in config:
-                for model, alt_endpoints in config["alternative_endpoints"].items():
-                    if model not in alternative_endpoints:
-                        alternative_endpoints[model] = []
-                    for endpoint_data in alt_endpoints:
-                        if isinstance(endpoint_data, list) and len(endpoint_data) >= 1:
-                            # Ignorer l'index du token car nous utilisons le même token pour tous les endpoints
-                            alternative_endpoints[model].append(endpoint_data[0])
-                        elif isinstance(endpoint_data, str):
-                            alternative_endpoints[model].append(endpoint_data)
-                        else:
-                            print(f"Format incorrect pour l'endpoint alternatif: {endpoint_data}")
-            print(f"Configuration des endpoints alternatifs chargée depuis {endpoints_config_path}")
+        if UPSTREAM_PREWARM:
+            with lifecycle.step("prewarm"):
+                results = await run_in_threadpool(prewarm_upstreams)
+            failed = {url: result for url, result in results.items() if isinstance(result, dict)}
+            print(f"Connexions pré-ouvertes vers {len(results) - len(failed)}/{len(results)} endpoints")
+            for url, result in failed.items():
+                print(f"Pré-ouverture impossible vers {url}: {result.get('error')}")
     except Exception as e:
-        print(f"Erreur lors du chargement de la configuration des endpoints: {str(e)}")
-
-def send_request(endpoint: str, payload: dict, route: str):
-    # Dictionnaire de correspondance entre nos noms de modèles et ceux d'OVH
-    model_name_map = {
-        "mistral-7b-instruct-v0.3": "Mistral-7B-Instruct-v0.3",
-        "mixtral-8x7b-instruct-v0.1": "Mixtral-8x7B-Instruct-v0.1",
-        "mistral-nemo-instruct-2407": "Mistral-Nemo-Instruct-2407",
-        "llama-3-1-8b-instruct": "Llama-3.1-8B-Instruct",
-        "llama-3-3-70b-instruct": "Meta-Llama-3_3-70B-Instruct",
-        "llama-3-1-70b-instruct": "Meta-Llama-3_1-70B-Instruct",
-        "deepseek-r1-distill-llama-70b": "DeepSeek-R1-Distill-Llama-70B",
-        "mamba-codestral-7b-v0-1": "mamba-codestral-7B-v0.1"
-    }
-    
-    # Log supplémentaire pour le débogage
-    debug_log(f"OVH TOKEN - Longueur du token: {len(OVH_API_TOKEN)}")
-    debug_log(f"OVH TOKEN - 10 premiers caractères: {OVH_API_TOKEN[:10]}")
-    debug_log(f"OVH TOKEN - 10 derniers caractères: {OVH_API_TOKEN[-10:]}")
+        print(f"Erreur lors de la pré-ouverture des connexions: {str(e)}")
+    finally:
+        lifecycle.mark_ready()
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Le serveur répond déjà (vivacité) pendant la pré-ouverture ; la disponibilité suit
+    app.state.warm_up_task = asyncio.ensure_future(warm_up())
+
+# Appels OVH toujours en flux, même pour les clients qui attendent une réponse complète :
+# délai avant le premier token (TTFT) et débit mesurés pour chaque requête, bascule
+# immédiate vers l'endpoint suivant si aucun token n'arrive à temps ou si le flux se tait
+UPSTREAM_STREAMING = os.getenv("UPSTREAM_STREAMING", "true").lower() in ("1", "true", "yes")
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT_SECONDS", 10))
+UPSTREAM_TTFT_TIMEOUT = float(os.getenv("UPSTREAM_TTFT_TIMEOUT_SECONDS", 30))
+UPSTREAM_IDLE_TIMEOUT = float(os.getenv("UPSTREAM_IDLE_TIMEOUT_SECONDS", 15))
+
+metrics.describe("proxy_upstream_ttft_seconds_sum", "counter", "Somme des délais avant le premier token d'OVH, par modèle")
+metrics.describe("proxy_upstream_ttft_seconds_count", "counter", "Générations dont le premier token a été mesuré, par modèle")
+metrics.describe("proxy_upstream_generated_tokens_total", "counter",
+                 "Tokens générés après le premier, par modèle (débit = ce compteur / proxy_upstream_generation_seconds_total)")
+metrics.describe("proxy_upstream_generation_seconds_total", "counter", "Durée de génération après le premier token, par modèle")
+metrics.describe("proxy_upstream_stalls_total", "counter", "Flux OVH abandonnés faute de token (phase ttft ou idle), par endpoint")
+
+def record_generation(model_name, ttft, generation_seconds, completion_tokens, ctx=None):
+    """
+    Enregistre le délai avant le premier token (secondes, None si aucun token) et le débit
+    d'une génération, dans le contexte de la requête (journal) et dans les métriques
+    """
+    fields = {"completion_tokens": completion_tokens}
+    if ttft is not None:
+        fields["ttft_ms"] = ttft * 1000
+    if ctx is not None:
+        ctx.update(fields)
+    else:
+        annotate_request(**fields)
+    if ttft is None:
+        return
+    model_health.observe_ttft(model_name, ttft)
+    metrics.inc("proxy_upstream_ttft_seconds_sum", ttft, model=model_name)
+    metrics.inc("proxy_upstream_ttft_seconds_count", model=model_name)
+    rate = ""
+    if completion_tokens and completion_tokens > 1 and generation_seconds > 0:
+        metrics.inc("proxy_upstream_generated_tokens_total", completion_tokens - 1, model=model_name)
+        metrics.inc("proxy_upstream_generation_seconds_total", generation_seconds, model=model_name)
+        rate = f", {(completion_tokens - 1) / generation_seconds:.1f} tokens/s"
+    print(f"[DEBUG] {model_name}: premier token en {ttft * 1000:.0f} ms, {completion_tokens} tokens{rate}")
+
+def read_streamed_completion(response, route, started, ttft_timeout):
+    """
+    Assemble la réponse complète d'un flux OVH (la connexion est libérée à la fin)
+    """
+    try:
+        return read_completion(response, route, started, ttft_timeout, UPSTREAM_IDLE_TIMEOUT, set_read_timeout)
+    finally:
+        response.close()
+
+def fetch_streamed(endpoint, url, body, headers, route, model_name, ttft_timeout):
+    """
+    Appel OVH en flux pour un client non-streamé : retourne (réponse OVH, résultat assemblé ou None).
+    Lève UpstreamStalled si l'endpoint ne produit pas de token à temps, EmptyUpstreamResponse
+    s'il répond 200 sans aucun événement.
+    """
+    started = time.perf_counter()
+    try:
+        response = upstream_pools.open(endpoint, "POST", url, data=body, headers=headers,
+                                       timeout=(UPSTREAM_CONNECT_TIMEOUT, ttft_timeout))
+    except requests.exceptions.ReadTimeout as e:
+        raise UpstreamStalled("ttft", ttft_timeout) from e
+    if response.status_code != 200:
+        read_and_close(response)
+        return response, None
+    assembler = read_streamed_completion(response, route, started, ttft_timeout)
+    return response, complete_generation(assembler, started, model_name)
+
+def complete_generation(assembler, started, model_name):
+    """
+    Enregistre les mesures d'un flux entièrement assemblé et retourne la réponse complète
+    """
+    finished = time.perf_counter()
+    first_token_at = assembler.first_token_at
+    ttft = first_token_at - started if first_token_at is not None else None
+    usage = assembler.usage or {}
+    # Sans compteurs d'OVH, les tokens générés sont les événements porteurs de texte
+    annotate_request(upstream_ms=(finished - started) * 1000, prompt_tokens=usage.get("prompt_tokens"),
+                     usage_estimated=not usage)
+    record_generation(model_name, ttft, finished - first_token_at if first_token_at is not None else 0,
+                      assembler.completion_tokens())
+    return assembler.result()
+
+def describe_completion(result):
+    """
+    Résumé d'une réponse OVH pour les logs (identifiant, modèle, fin, longueur du texte),
+    sans réencoder la réponse
+    """
+    choices = result.get("choices") or [{}]
+    choice = choices[0]
+    text = (choice.get("message") or {}).get("content") if "message" in choice else choice.get("text")
+    return (f"id={result.get('id')} modèle={result.get('model')} finish_reason={choice.get('finish_reason')} "
+            f"{len(text or '')} caractères")
+
+def send_request(endpoint: str, payload: dict, route: str, table=None, features=None):
+    # Table de routage figée pour toute la durée de la requête
+    table = table or routing.current
     
     # Vérifier si c'est DeepSeek pour ajuster le timeout
     is_deepseek = payload.get("model", "").lower() == "deepseek-r1-distill-llama-70b"
@@ -193,10 +569,9 @@ def send_request(endpoint: str, payload: dict, route: str):
     
     # Vérifiez si la requête est pour une explication détaillée et réduisez la température pour DeepSeek
     if is_deepseek:
-        request_text = ""
-        if "messages" in payload:
-            request_text = " ".join([msg.get("content", "") for msg in payload["messages"] if isinstance(msg.get("content", ""), str)])
-        if any(keyword in request_text.lower() for keyword in ["détail", "expliqu", "comment", "fonctionne"]):
+        if features is None:
+            features = request_analyzer.analyze_messages(payload.get("messages"))
+        if features.reasoning:
             # Réduire la température pour les explications détaillées avec DeepSeek
             payload["temperature"] = 0.5  # Valeur plus faible pour une sortie plus déterministe
             debug_log(f"DeepSeek: Détection de requête d'explication détaillée, température réduite à {payload['temperature']}")
@@ -233,10 +608,24 @@ def send_request(endpoint: str, payload: dict, route: str):
     
     # Remplacer le nom du modèle dans le payload par le nom exact utilisé par OVH
     model_name_original = payload.get("model", "")
-    if "model" in payload and payload["model"] in model_name_map:
-        payload["model"] = model_name_map[payload["model"]]
+    model_route = table.get(model_name_original)
+    if model_route is not None and model_route.upstream_name != model_name_original:
+        payload["model"] = model_route.upstream_name
         debug_log(f"Conversion du nom de modèle: {model_name_original} -> {payload['model']}")
     
+    # Ajuster l'historique à la fenêtre de contexte du modèle (OpenWebUI renvoie toute la conversation)
+    if CONTEXT_TRIM_ENABLED and route == "chat" and isinstance(payload.get("messages"), list):
+        trim = context_manager.fit(
+            model_name_original, payload["messages"],
+            context_length=model_route.context_length if model_route is not None else None,
+            max_tokens=payload.get("max_tokens") or 0,
+        )
+        annotate_request(tokens_saved=trim.tokens_saved)
+        if trim.trimmed:
+            payload["messages"] = trim.messages
+            print(f"[DEBUG] Historique réduit pour {model_name_original}: {trim.dropped_messages} messages retirés, "
+                  f"{trim.elided_messages} élidés, ~{trim.original_tokens} -> ~{trim.final_tokens} tokens ({trim.tokens_saved} économisés)")
+    
     # Ajouter les options supplémentaires supportées par certains modèles
     # Pour éviter de les inclure si elles ne sont pas explicitement demandées
     if "stream" in payload:
@@ -263,15 +652,16 @@ def send_request(endpoint: str, payload: dict, route: str):
 
     debug_log(f"URL utilisée pour {route}: {url}")
 
-    # Préparer la liste des endpoints à essayer
-    endpoints_to_try = [(endpoint, 0)]  # Le tuple contient (endpoint_url, token_index)
-    
-    # Ajouter les endpoints alternatifs si disponibles pour ce modèle
-    if model_name_original in alternative_endpoints:
-        endpoints_to_try.extend([(alt_endpoint, 0) for alt_endpoint in alternative_endpoints[model_name_original]])
-        debug_log(f"Endpoints alternatifs disponibles pour {model_name_original}: {len(alternative_endpoints[model_name_original])}")
+    # Préparer la liste des endpoints à essayer : principal puis alternatifs (ou tirage pondéré)
+    if model_route is not None:
+        endpoints_to_try = model_route.ordered_targets()
+        debug_log(f"Endpoints alternatifs disponibles pour {model_name_original}: {len(model_route.targets) - 1}")
+    else:
+        endpoints_to_try = [EndpointTarget(endpoint, 1.0, OVH_API_TOKEN)]
     
     last_error = None
+    attempts = 0
+    annotate_request(model=model_name_original)
     
     # Variables pour le mécanisme de retry
     max_retries = 3 if is_deepseek else 2  # Plus de retries pour DeepSeek
@@ -289,12 +679,24 @@ def send_request(endpoint: str, payload: dict, route: str):
             # Réduire max_tokens pour accélérer la réponse
             if "max_tokens" in simplified_payload:
                 simplified_payload["max_tokens"] = min(simplified_payload["max_tokens"], 50)
-            debug_log(f"Payload simplifié créé pour le premier essai: {json.dumps(simplified_payload, ensure_ascii=False)}")
+            debug_log("Payload simplifié créé pour le premier essai (dernier message utilisateur seul)")
+    
+    # Encoder les corps une seule fois : ils sont réutilisés pour chaque essai et chaque endpoint
+    if UPSTREAM_STREAMING:
+        body = fastjson.dumps({**payload, "stream": True, "stream_options": {"include_usage": True}})
+        ttft_timeout = min(UPSTREAM_TTFT_TIMEOUT, request_timeout)
+    else:
+        body = fastjson.dumps(payload)
+    simplified_body = fastjson.dumps(simplified_payload) if simplified_payload is not None else None
+    # Taille du corps, pour estimer les tokens du prompt si OVH ne les rapporte pas
+    annotate_request(request_bytes=len(body))
     
     # Essayer chaque endpoint disponible
-    for current_endpoint, token_index in endpoints_to_try:
+    for target in endpoints_to_try:
+        raise_if_cancelled()
         # Sélectionner le token approprié
-        current_token = OVH_API_TOKEN
+        current_endpoint = target.url
+        current_token = target.token
         
         # Construire l'URL complète
         if route == "chat":
@@ -315,16 +717,16 @@ def send_request(endpoint: str, payload: dict, route: str):
         test_url = f"{current_endpoint}/api/openai_compat/v1/models"
         debug_log(f"Test direct avec requests à l'URL : {test_url}")
         try:
-            test_response = requests.get(test_url, headers=headers, timeout=10)
+            test_response = upstream_pools.get(current_endpoint, test_url, headers=headers, timeout=10)
             debug_log(f"Test direct: statut = {test_response.status_code}")
             debug_log(f"Test direct: réponse = {test_response.text[:500]}")  # Augmenter la taille du log
             
             # Vérifier explicitement si le token est valide
             if test_response.status_code == 401:
-                debug_log(f"ERREUR: Le token d'API OVH {token_index} semble être invalide (401 Unauthorized)")
+                debug_log(f"ERREUR: Le token d'API OVH de {current_endpoint} semble être invalide (401 Unauthorized)")
                 continue  # Essayer le prochain endpoint
             elif test_response.status_code == 403:
-                debug_log(f"ERREUR: Le token d'API OVH {token_index} n'a pas les permissions nécessaires (403 Forbidden)")
+                debug_log(f"ERREUR: Le token d'API OVH de {current_endpoint} n'a pas les permissions nécessaires (403 Forbidden)")
                 continue  # Essayer le prochain endpoint
             elif test_response.status_code >= 400:
                 debug_log(f"ERREUR: Problème avec l'API OVH (Status: {test_response.status_code})")
@@ -336,16 +738,16 @@ def send_request(endpoint: str, payload: dict, route: str):
         debug_log(f"Trying URL for {route}: {current_url}")
         
         # AJOUT: Essayer d'abord avec un payload simplifié si disponible
-        if simplified_payload is not None:
+        if simplified_body is not None:
             try:
                 debug_log(f"Essai initial avec payload simplifié à l'URL : {current_url}")
                 debug_log(f"Headers : {headers}")
-                debug_log(f"Payload simplifié : {json.dumps(simplified_payload, ensure_ascii=False)}")
+                debug_log(f"Payload simplifié : {fastjson.preview(simplified_body, 500)}")
                 
-                # Utiliser un timeout plus court pour ce test
-                test_timeout = 15
+                # Utiliser un timeout plus court pour ce test (délai du premier token en mode flux)
+                test_timeout = (UPSTREAM_CONNECT_TIMEOUT, ttft_timeout) if UPSTREAM_STREAMING else 15
                 debug_log(f"Timeout pour test simplifié: {test_timeout} secondes")
-                response = requests.post(current_url, json=simplified_payload, headers=headers, timeout=test_timeout)
+                response = upstream_pools.post(current_endpoint, current_url, data=simplified_body, headers=headers, timeout=test_timeout)
                 debug_log(f"Test simplifié - Code de statut : {response.status_code}")
                 
                 if response.status_code == 200:
@@ -357,29 +759,54 @@ def send_request(endpoint: str, payload: dict, route: str):
                         continue  # Problème d'authentification, essayer le prochain endpoint
             except Exception as e:
                 debug_log(f"Exception lors du test simplifié: {str(e)}")
+                if UPSTREAM_STREAMING and isinstance(e, requests.exceptions.ReadTimeout):
+                    # Endpoint bloqué : bascule immédiate vers l'endpoint suivant
+                    metrics.inc("proxy_upstream_stalls_total", endpoint=current_endpoint, phase="ttft")
+                    last_error = e
+                    continue
                 # Continuer avec le payload complet
         
         # Essayer avec le payload complet
         retry_count = 0
         while retry_count < max_retries:
+            # Client déconnecté pendant l'attente : pas de nouvel essai
+            raise_if_cancelled()
             try:
                 debug_log(f"Essai avec l'URL : {current_url} (tentative {retry_count+1}/{max_retries})")
                 debug_log(f"Headers : {headers}")
-                debug_log(f"Payload : {json.dumps(payload, ensure_ascii=False)}")
+                debug_log(f"Payload : {fastjson.preview(body, 500)}")
                 
                 # Ajouter un timeout pour éviter les blocages indéfinis
                 debug_log(f"Timeout configuré: {request_timeout} secondes")
-                response = requests.post(current_url, json=payload, headers=headers, timeout=request_timeout)
+                attempts += 1
+                annotate_request(endpoint=current_endpoint, attempts=attempts)
+                upstream_start = time.time()
+                if UPSTREAM_STREAMING:
+                    response, result = fetch_streamed(current_endpoint, current_url, body, headers, route,
+                                                      model_name_original, ttft_timeout)
+                    if result is not None:
+                        debug_log(f"Réponse assemblée depuis le flux : {describe_completion(result)}")
+                        return result
+                else:
+                    response = upstream_pools.post(current_endpoint, current_url, data=body, headers=headers, timeout=request_timeout)
                 debug_log(f"Code de statut : {response.status_code}")
                 
                 # AJOUT: Log plus détaillé de la réponse
-                if len(response.text) > 1000:
-                    debug_log(f"Réponse (tronquée) : {response.text[:1000]}...")
+                if len(response.content) > 1000:
+                    debug_log(f"Réponse (tronquée) : {fastjson.preview(response.content, 1000)}...")
                 else:
-                    debug_log(f"Réponse : {response.text}")
+                    debug_log(f"Réponse : {fastjson.preview(response.content)}")
                 
                 if response.status_code == 200:
-                    return response.json()
+                    result = fastjson.loads(response.content)
+                    usage = result.get("usage") or {}
+                    annotate_request(
+                        upstream_ms=(time.time() - upstream_start) * 1000,
+                        prompt_tokens=usage.get("prompt_tokens"),
+                        completion_tokens=usage.get("completion_tokens"),
+                        response_bytes=len(response.content),
+                    )
+                    return result
                 
                 # Si on a un code d'erreur 500 ou supérieur, on fait un retry
                 if response.status_code >= 500:
@@ -388,21 +815,34 @@ def send_request(endpoint: str, payload: dict, route: str):
                         # Backoff exponentiel avec jitter (aléatoire)
                         delay = (backoff_factor ** retry_count) + random.uniform(0, 1)
                         debug_log(f"Erreur serveur: {response.status_code}, retry dans {delay:.2f} secondes...")
-                        time.sleep(delay)
+                        backoff(delay)
                         continue
                 
                 # Gestion spécifique des erreurs d'authentification
                 if response.status_code == 401 or response.status_code == 403:
-                    debug_log(f"ERREUR: Token d'API OVH {token_index} invalide ({response.status_code})")
+                    debug_log(f"ERREUR: Token d'API OVH de {current_endpoint} invalide ({response.status_code})")
                     break  # Sortir de la boucle de retry et essayer le prochain endpoint
                 
                 # Gestion spécifique des erreurs de quota
                 if response.status_code == 429:
-                    debug_log(f"ERREUR: Quota d'API OVH {token_index} dépassé (429 Too Many Requests)")
+                    debug_log(f"ERREUR: Quota d'API OVH de {current_endpoint} dépassé (429 Too Many Requests)")
+                    last_error = response
                     break  # Sortir de la boucle de retry et essayer le prochain endpoint
                 
                 last_error = response
                 break  # Sortir de la boucle de retry si l'erreur n'est pas récupérable
+            except UpstreamStalled as e:
+                # Endpoint bloqué : pas de nouvel essai ici, on passe directement à l'endpoint suivant
+                debug_log(f"{str(e)} ({current_endpoint}), bascule vers l'endpoint suivant")
+                metrics.inc("proxy_upstream_stalls_total", endpoint=current_endpoint, phase=e.phase)
+                last_error = e
+                break
+            except ClientDisconnected:
+                raise
+            except EmptyUpstreamResponse as e:
+                debug_log(f"{str(e)} ({current_endpoint}), bascule vers l'endpoint suivant")
+                last_error = e
+                break
             except requests.exceptions.Timeout:
                 debug_log(f"Timeout pour l'URL {current_url} (tentative {retry_count+1}/{max_retries})")
                 retry_count += 1
@@ -410,7 +850,7 @@ def send_request(endpoint: str, payload: dict, route: str):
                     # Backoff exponentiel avec jitter pour les timeouts
                     delay = (backoff_factor ** retry_count) + random.uniform(0, 1)
                     debug_log(f"Timeout: nouvelle tentative dans {delay:.2f} secondes...")
-                    time.sleep(delay)
+                    backoff(delay)
                     continue
                 last_error = Exception(f"Timeout lors de la connexion à {current_url} après {max_retries} tentatives")
                 break
@@ -423,7 +863,7 @@ def send_request(endpoint: str, payload: dict, route: str):
                     # Backoff exponentiel pour les erreurs de connexion
                     delay = (backoff_factor ** retry_count) + random.uniform(0, 1)
                     debug_log(f"Erreur de connexion: nouvelle tentative dans {delay:.2f} secondes...")
-                    time.sleep(delay)
+                    backoff(delay)
                     continue
                 last_error = e
                 break
@@ -436,40 +876,153 @@ def send_request(endpoint: str, payload: dict, route: str):
     else:
         error_msg = f"Erreur de requête: {str(last_error) if last_error else 'Tous les endpoints ont échoué'}"
         debug_log(f"Erreur finale: {error_msg}")
-        raise HTTPException(status_code=500, detail=error_msg)
-
-def validate_json_data(data):
-    """
-    Vérifie que les données sont bien formatées en JSON et corrige les erreurs éventuelles
-    """
-    if isinstance(data, dict):
-        for key, value in list(data.items()):  # Utiliser list() pour pouvoir modifier pendant l'itération
-            if isinstance(value, (dict, list)):
-                data[key] = validate_json_data(value)
-            elif isinstance(key, str) and ":" in key:
-                # Corriger les clés problématiques
-                new_key = key.replace(":", "-")
-                logger.warning(f"Clé JSON invalide détectée: '{key}' remplacée par '{new_key}'")
-                data[new_key] = data.pop(key)
-    elif isinstance(data, list):
-        for i, item in enumerate(data):
-            data[i] = validate_json_data(item)
-    return data
+        raise HTTPException(status_code=502 if isinstance(last_error, EmptyUpstreamResponse) else 500, detail=error_msg)
+
+# Générations annulées (client déconnecté ou arrêt du serveur) et tokens épargnés à OVH
+metrics.describe("proxy_cancelled_requests_total", "counter", "Appels OVH annulés avant la fin de la génération")
+metrics.describe("proxy_cancelled_tokens_saved_total", "counter",
+                 "Tokens non générés grâce aux annulations (estimation : max_tokens moins les tokens déjà reçus)")
+
+def record_cancellation(route, reason, model_name, max_tokens, generated=0):
+    if not max_tokens:
+        max_tokens = DEFAULT_MAX_TOKENS.get(model_name, DEFAULT_MAX_TOKENS["default"])
+    saved = max(0, max_tokens - generated)
+    metrics.inc("proxy_cancelled_requests_total", route=route, reason=reason)
+    metrics.inc("proxy_cancelled_tokens_saved_total", saved, route=route)
+    annotate_request(completion_tokens=generated)
+    print(f"[DEBUG] Génération {model_name} annulée sur {route} ({reason}), ~{saved} tokens épargnés")
+
+async def send_request_until_disconnect(request: Request, endpoint: str, payload: dict, route: str, table=None, features=None):
+    """
+    Exécute send_request dans le pool de threads ; si le client se déconnecte,
+    l'appel OVH est fermé aussitôt et ClientDisconnected (499) est levée
+    """
+    token = CancelToken()
+    model_name, max_tokens = payload.get("model"), payload.get("max_tokens")
+    try:
+        return await call_until_disconnect(request.receive, token, send_request, endpoint, payload, route, table=table, features=features)
+    except ClientDisconnected:
+        record_cancellation(request.url.path, token.reason, model_name, max_tokens)
+        raise
+
+# Repli vers un modèle équivalent (groupes `model_groups` de la configuration du routage)
+# quand le modèle demandé a son disjoncteur ouvert, est limité (429) ou a une attente prévue trop longue
+MODEL_FALLBACK_ENABLED = os.getenv("MODEL_FALLBACK_ENABLED", "true").lower() in ("1", "true", "yes")
+model_health = ModelHealth(
+    failure_threshold=int(os.getenv("MODEL_BREAKER_FAILURES", 3)),
+    cooldown=float(os.getenv("MODEL_BREAKER_COOLDOWN_SECONDS", 30)),
+    rate_limit_cooldown=float(os.getenv("MODEL_RATE_LIMIT_COOLDOWN_SECONDS", 10)),
+    queue_slo=float(os.getenv("MODEL_QUEUE_SLO_SECONDS", 10)),
+)
+
+metrics.describe("proxy_model_fallbacks_total", "counter", "Requêtes servies par un modèle de repli, par modèle demandé, modèle servi et raison")
+metrics.describe("proxy_model_breaker_opened_total", "counter", "Ouvertures du disjoncteur d'un modèle")
+
+async def call_with_fallback(model_name, table, call, eligible=None):
+    """
+    Appelle `call(modèle, dernier_recours)` pour le modèle demandé puis, s'il est saturé,
+    pour ses équivalents. `call` lève ModelUnavailable (ou HTTPException avec un statut
+    de FALLBACK_STATUS) quand le modèle ne peut pas servir la requête ; le dernier
+    modèle essayé renvoie son erreur telle quelle. Retourne (résultat, modèle servi).
+    """
+    candidates = [model_name]
+    if MODEL_FALLBACK_ENABLED:
+        candidates += [m for m in table.fallbacks.get(model_name, ()) if eligible is None or eligible(m)]
+    plan = model_health.plan(candidates) if len(candidates) > 1 else [(model_name, None)]
+    # Raison du repli : le modèle demandé a été écarté (disjoncteur, 429, attente) ou a échoué
+    reason = dict(plan)[model_name]
+    for index, (candidate, excluded) in enumerate(plan):
+        last_resort = index == len(plan) - 1
+        if not model_health.claim_probe(candidate) and excluded is None and not last_resort:
+            # Requête de test du disjoncteur prise entre-temps par une autre requête
+            if candidate == model_name:
+                reason = "breaker_open"
+            continue
+        if candidate != model_name:
+            print(f"[DEBUG] Repli de {model_name} vers {candidate} ({reason})")
+            metrics.inc("proxy_model_fallbacks_total", model=model_name, fallback=candidate, reason=reason)
+        annotate_request(served_model=candidate, fallback_from=model_name if candidate != model_name else None)
+        model_health.begin(candidate)
+        streaming = False
+        try:
+            result = await call(candidate, last_resort)
+            ctx = request_context.get()
+            if isinstance(result, (StreamingResponse, requests.Response)) and ctx is not None:
+                # Le flux (réponse en flux ou flux OVH ouvert du canal WebSocket) est transmis après
+                # le retour : la requête reste en cours jusqu'à la fin de la réponse (voir on_request_finished)
+                ctx["streaming_model"] = candidate
+                streaming = True
+        except ModelUnavailable as e:
+            status, detail = e.status, e.detail
+        except HTTPException as e:
+            if e.status_code not in FALLBACK_STATUS:
+                raise
+            status, detail = e.status_code, e.detail
+            if last_resort:
+                record_model_failure(candidate, status)
+                raise
+        else:
+            status = getattr(result, "status_code", 200)
+            if status in FALLBACK_STATUS:
+                record_model_failure(candidate, status)
+            elif status != 499:
+                # 499 : le client s'est déconnecté, l'appel ne dit rien de la santé du modèle
+                model_health.record_success(candidate)
+            return result, candidate
+        finally:
+            if not streaming:
+                model_health.end(candidate)
+        record_model_failure(candidate, status)
+        debug_log(f"{candidate} indisponible ({status}): {detail}")
+        if candidate == model_name:
+            reason = "rate_limited" if status == 429 else "failed"
+
+def record_model_failure(model_name, status):
+    if model_health.record_failure(model_name, status):
+        metrics.inc("proxy_model_breaker_opened_total", model=model_name)
+        print(f"[DEBUG] Disjoncteur ouvert pour {model_name} ({model_health.cooldown:g} s)")
+
+async def send_with_fallback(request: Request, model_name: str, payload: dict, route: str, table, features=None):
+    """
+    send_request_until_disconnect avec repli vers les modèles équivalents ; retourne (résultat, modèle servi)
+    """
+    async def call(candidate, last_resort):
+        return await send_request_until_disconnect(
+            request, table.endpoints[candidate], dict(payload, model=candidate), route, table=table, features=features,
+        )
+    return await call_with_fallback(model_name, table, call)
+
+metrics.describe("proxy_auto_routing_decisions_total", "counter",
+                 "Requêtes adressées au modèle virtuel auto, par modèle choisi (default=true : aucune règle ne convenait)")
+
+def is_auto_model(table, model_name):
+    """Indique si `model_name` (avec ou sans suffixe ':latest') désigne le modèle virtuel `auto`"""
+    return table.auto_policy is not None and bool(model_name) and model_name.split(":")[0] == table.auto_policy.name
+
+def resolve_auto_model(table, features, messages=None, text=None):
+    """
+    Choisit le modèle réel derrière le modèle virtuel `auto` ; la décision est conservée
+    dans le contexte de la requête pour le journal des décisions
+    """
+    prompt_tokens = estimate_prompt_tokens(messages, text)
+    model_name, decision = choose_model(table.auto_policy, model_health, prompt_tokens, features.request_class)
+    annotate_request(auto_decision=decision)
+    metrics.inc("proxy_auto_routing_decisions_total", model=model_name, default=str(decision["default"]).lower())
+    print(f"[DEBUG] Modèle auto: {model_name} (~{prompt_tokens} tokens, classe {features.request_class})")
+    return model_name
+
+def catalog_response(request: Request, name: str):
+    """
+    Renvoie une représentation du catalogue, ou 304 si le client possède déjà la version courante
+    """
+    entry = model_catalog.get(name)
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=entry.headers)
+    return Response(content=entry.body, media_type="application/json", headers=entry.headers)
 
 @app.get("/v1/models")
-async def list_models():
-    # Créer une liste unique de modèles disponibles
-    available_models = set(endpoints.keys())
-    
-    # Ajouter les modèles des endpoints alternatifs
-    for model in alternative_endpoints.keys():
-        available_models.add(model)
-    
-    model_list = [{"id": name, "object": "model"} for name in sorted(available_models)]
-    
-    # Valider le format JSON avant de l'envoyer
-    model_list = validate_json_data(model_list)
-    return JSONResponse(content={"object": "list", "data": model_list})
+async def list_models(request: Request):
+    return catalog_response(request, "openai")
 
 # Augmenter encore les valeurs max_tokens par défaut pour tous les modèles
 DEFAULT_MAX_TOKENS = {
@@ -481,9 +1034,267 @@ DEFAULT_MAX_TOKENS = {
     "default": 500  # Valeur par défaut pour les autres modèles
 }
 
+# Analyseur de requêtes partagé par toutes les routes
+request_analyzer = RequestAnalyzer()
+
+# max_tokens par défaut appris des longueurs réellement générées, par modèle, route et classe de
+# requête : percentile MAX_TOKENS_PERCENTILE des dernières générations plus MAX_TOKENS_HEADROOM
+MAX_TOKENS_LEARNING = os.getenv("MAX_TOKENS_LEARNING", "true").lower() in ("1", "true", "yes")
+completion_stats = CompletionStats(
+    os.getenv("COMPLETION_STATS_PATH", "/tmp/proxy_completion_stats.json"),
+    percentile=float(os.getenv("MAX_TOKENS_PERCENTILE", 95)),
+    headroom=float(os.getenv("MAX_TOKENS_HEADROOM", 0.25)),
+    min_samples=int(os.getenv("MAX_TOKENS_MIN_SAMPLES", 50)),
+    window=int(os.getenv("MAX_TOKENS_WINDOW", 1000)),
+    floor=int(os.getenv("MAX_TOKENS_FLOOR", 256)),
+    ceiling=int(os.getenv("MAX_TOKENS_CEILING", 8192)),
+)
+metrics.describe("proxy_max_tokens_learned_total", "counter", "Requêtes dont max_tokens vient des longueurs observées, par route")
+metrics.describe("proxy_max_tokens_reserved_saved_total", "counter",
+                 "Tokens de budget non réservés chez OVH grâce aux max_tokens appris (valeur fixe moins valeur apprise)")
+
+@app.on_event("startup")
+def load_completion_stats():
+    with lifecycle.step("completion_stats"):
+        completion_stats.load()
+
+@app.on_event("shutdown")
+def save_completion_stats():
+    try:
+        completion_stats.save()
+    except OSError as e:
+        print(f"Impossible d'enregistrer les statistiques des générations: {str(e)}")
+
+def static_max_tokens(model_name, request_class):
+    """
+    max_tokens fixe d'un modèle, avec les minimums imposés aux explications détaillées et au modèle de code
+    """
+    max_tokens = DEFAULT_MAX_TOKENS.get(model_name, DEFAULT_MAX_TOKENS["default"])
+    if request_class == "explain":
+        max_tokens = max(max_tokens, 1500)
+    if model_name == "mamba-codestral-7b-v0-1":
+        max_tokens = max(max_tokens, 2500)
+    return max_tokens
+
+def choose_max_tokens(model_name, route, features, requested):
+    """
+    max_tokens d'une requête : celui du client, sinon la valeur apprise, sinon la valeur fixe du modèle.
+    Retourne (max_tokens, appris).
+    """
+    if requested is not None:
+        return requested, False
+    if MAX_TOKENS_LEARNING:
+        learned = completion_stats.default_max_tokens(model_name, route, features.request_class)
+        if learned is not None:
+            static = static_max_tokens(model_name, features.request_class)
+            metrics.inc("proxy_max_tokens_learned_total", route=route)
+            metrics.inc("proxy_max_tokens_reserved_saved_total", max(0, static - learned), route=route)
+            debug_log(f"max_tokens appris pour {model_name} ({route}, {features.request_class}): {learned} (valeur fixe: {static})")
+            return learned, True
+    return DEFAULT_MAX_TOKENS.get(model_name, DEFAULT_MAX_TOKENS["default"]), False
+
+def record_completion_length(model_name, route, features, result):
+    """
+    Enregistre la longueur d'une génération faite avec le max_tokens par défaut (client sans max_tokens)
+    """
+    usage = result.get("usage") or {}
+    choices = result.get("choices") or [{}]
+    completion_stats.record(
+        model_name, route, features.request_class, usage.get("completion_tokens"),
+        truncated=choices[0].get("finish_reason") == "length",
+    )
+
+def adjust_generation_params(model_name, features, max_tokens, temperature, temperature_requested, learned=False):
+    """
+    Ajuste max_tokens et la température selon les caractéristiques de la requête
+    (max_tokens n'est pas relevé s'il a été appris des longueurs observées)
+    """
+    # Forcer une valeur élevée de max_tokens pour les questions détaillées
+    if features.explain and not learned:
+        # Utiliser au moins 1500 tokens pour les demandes d'explications détaillées
+        max_tokens = max(max_tokens, 1500)
+        debug_log(f"Détection d'une demande d'explication détaillée, augmentation de max_tokens à {max_tokens}")
+    
+    # Détection des requêtes de code
+    if model_name == "mamba-codestral-7b-v0-1" or features.code:
+        # Réduire la température pour le code pour plus de précision
+        if not temperature_requested:
+            temperature = 0.2
+            debug_log(f"Détection d'une demande de code, réduction de la température à {temperature}")
+        # S'assurer d'avoir suffisamment de tokens pour le code
+        if model_name == "mamba-codestral-7b-v0-1" and not learned:
+            max_tokens = max(max_tokens, 2500)
+            debug_log(f"Utilisation du modèle de code, augmentation de max_tokens à {max_tokens}")
+    
+    return max_tokens, temperature
+
+# Relais brut (sans décodage) des requêtes OpenAI sur les modèles sans règle particulière
+PASSTHROUGH_ENABLED = os.getenv("PASSTHROUGH_ENABLED", "true").lower() in ("1", "true", "yes")
+PASSTHROUGH_EXCLUDED_MODELS = frozenset({"deepseek-r1-distill-llama-70b", "mamba-codestral-7b-v0-1"})
+# Tokens réservés à la réponse pour vérifier qu'une requête brute tient dans la fenêtre de contexte
+PASSTHROUGH_RESERVED_TOKENS = int(os.getenv("PASSTHROUGH_RESERVED_TOKENS", 4096))
+PASSTHROUGH_TIMEOUT = 60
+# Codes pour lesquels l'endpoint suivant est essayé
+PASSTHROUGH_RETRY_STATUS = frozenset({401, 403, 429, 500, 502, 503, 504})
+
+def read_and_close(response):
+    try:
+        return response.content
+    finally:
+        response.close()
+
+def relay_stream(response, ctx, upstream_start, model_name):
+    """
+    Transmet le flux SSE d'OVH morceau par morceau, sans le décoder ; le premier
+    morceau porteur de texte donne le délai avant le premier token
+    """
+    first_token_at = None
+    text_chunks = 0
+    completion_tokens = None
+    try:
+        for chunk in response.iter_content(chunk_size=None):
+            if has_generated_text(chunk):
+                text_chunks += 1
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+            if ctx is not None and b'"usage"' in chunk:
+                prompt_tokens, completion_tokens = extract_usage(chunk)
+                ctx.update(prompt_tokens=prompt_tokens)
+            yield chunk
+    finally:
+        response.close()
+        finished = time.perf_counter()
+        if ctx is not None:
+            ctx["upstream_ms"] = (finished - upstream_start) * 1000
+            if completion_tokens is None:
+                ctx["usage_estimated"] = True
+            record_generation(
+                model_name,
+                first_token_at - upstream_start if first_token_at is not None else None,
+                finished - first_token_at if first_token_at is not None else 0,
+                completion_tokens if completion_tokens is not None else text_chunks,
+                ctx=ctx,
+            )
+
+async def relay_raw_chat(request: Request, body: bytes, raw_request, model_route, last_resort=True):
+    """
+    Transmet la requête brute aux endpoints du modèle (principal puis alternatifs)
+    et renvoie la réponse d'OVH telle quelle. L'appel est fermé si le client se déconnecte.
+    Pour un client non-streamé (UPSTREAM_STREAMING), OVH est appelé en flux et la
+    réponse complète est assemblée au fil de l'eau. Si un modèle de repli peut prendre
+    la requête (`last_resort` faux), l'échec de tous les endpoints lève ModelUnavailable.
+    """
+    assemble = UPSTREAM_STREAMING and not raw_request.stream
+    upstream_body = patch_model(body, raw_request, model_route.upstream_name, stream=assemble)
+    timeout = (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_TTFT_TIMEOUT) if assemble else PASSTHROUGH_TIMEOUT
+    ctx = request_context.get()
+    annotate_request(model=model_route.name, request_bytes=len(upstream_body))
+    token = CancelToken()
+    targets = model_route.ordered_targets()
+    last_error = None
+    last_status = 502
+
+    def on_cancel(events=0):
+        record_cancellation(request.url.path, token.reason, model_route.name, None, events)
+
+    try:
+        for attempt, target in enumerate(targets, 1):
+            url = f"{target.url}/api/openai_compat/v1/chat/completions"
+            headers = {"Authorization": f"Bearer {target.token}", "Content-Type": "application/json"}
+            annotate_request(endpoint=target.url, attempts=attempt)
+            upstream_start = time.perf_counter()
+            try:
+                response = await call_until_disconnect(
+                    request.receive, token, upstream_pools.open, target.url, "POST", url,
+                    data=upstream_body, headers=headers, timeout=timeout,
+                )
+            except requests.exceptions.RequestException as e:
+                debug_log(f"Relais brut: échec de l'appel à {target.url}: {str(e)}")
+                if assemble and isinstance(e, requests.exceptions.ReadTimeout):
+                    metrics.inc("proxy_upstream_stalls_total", endpoint=target.url, phase="ttft")
+                last_error, last_status = e, 502
+                continue
+            if response.status_code in PASSTHROUGH_RETRY_STATUS and (
+                    attempt < len(targets) or (not last_resort and response.status_code in FALLBACK_STATUS)):
+                debug_log(f"Relais brut: {target.url} a répondu {response.status_code}, essai de l'endpoint suivant")
+                last_error, last_status = f"HTTP {response.status_code}", response.status_code
+                await run_in_threadpool(response.close)
+                continue
+
+            media_type = response.headers.get("Content-Type", "application/json")
+            if raw_request.stream and response.status_code == 200:
+                return StreamingResponse(
+                    cancellable_stream(request.receive, token, relay_stream(response, ctx, upstream_start, model_route.name), on_cancel),
+                    media_type=media_type,
+                    headers={"Cache-Control": "no-cache"},
+                )
+            if assemble and response.status_code == 200:
+                try:
+                    assembler = await call_until_disconnect(
+                        request.receive, token, read_streamed_completion, response, "chat", upstream_start, UPSTREAM_TTFT_TIMEOUT,
+                    )
+                except UpstreamStalled as e:
+                    debug_log(f"Relais brut: {str(e)} ({target.url}), bascule vers l'endpoint suivant")
+                    metrics.inc("proxy_upstream_stalls_total", endpoint=target.url, phase=e.phase)
+                    last_error, last_status = e, 504
+                    continue
+                except (requests.exceptions.RequestException, EmptyUpstreamResponse) as e:
+                    debug_log(f"Relais brut: flux interrompu depuis {target.url}: {str(e)}")
+                    last_error, last_status = e, 502
+                    continue
+                return FastJSONResponse(complete_generation(assembler, upstream_start, model_route.name))
+            content = await call_until_disconnect(request.receive, token, read_and_close, response)
+            prompt_tokens, completion_tokens = extract_usage(content) if response.status_code == 200 else (None, None)
+            annotate_request(
+                upstream_ms=(time.perf_counter() - upstream_start) * 1000,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                response_bytes=len(content) if response.status_code == 200 else None,
+            )
+            return Response(content=content, status_code=response.status_code, media_type=media_type)
+    except ClientDisconnected as e:
+        on_cancel()
+        return FastJSONResponse(status_code=e.status_code, content={"error": e.detail, "model": raw_request.model})
+
+    if not last_resort:
+        raise ModelUnavailable(model_route.name, last_status, str(last_error))
+    return FastJSONResponse(
+        status_code=502,
+        content={
+            "error": "Échec de l'appel API",
+            "detail": str(last_error),
+            "model": raw_request.model,
+        }
+    )
+
 @app.post("/v1/chat/completions")
-async def chat_completions(payload: dict = Body(...)):
-    print(f"[DEBUG] Requête reçue sur /v1/chat/completions avec payload: {json.dumps(payload, ensure_ascii=False)[:500]}")
+async def chat_completions(request: Request):
+    body = await request.body()
+    
+    # Relais brut : client OpenAI classique sur un modèle sans règle particulière (ni DeepSeek, ni ':latest')
+    auto_model = None
+    if PASSTHROUGH_ENABLED:
+        table = routing.current
+        raw_request = inspect_request(body)
+        model_route = table.get(raw_request.model) if raw_request is not None else None
+        if raw_request is not None and is_auto_model(table, raw_request.model):
+            # Modèle virtuel : le modèle réel est choisi avant le relais, les paramètres du client sont conservés
+            messages = fastjson.decode_body(body).get("messages")
+            auto_model = resolve_auto_model(table, request_analyzer.analyze_messages(messages), messages=messages)
+            model_route = table.get(auto_model)
+        if (model_route is not None and model_route.name not in PASSTHROUGH_EXCLUDED_MODELS
+                and context_manager.raw_fits(model_route.name, len(body), model_route.context_length, PASSTHROUGH_RESERVED_TOKENS)):
+            debug_log(f"Relais brut de la requête vers {model_route.name} ({len(body)} octets)")
+            response, _ = await call_with_fallback(
+                model_route.name, table,
+                lambda candidate, last_resort: relay_raw_chat(request, body, raw_request, table.get(candidate), last_resort),
+                eligible=lambda candidate: candidate not in PASSTHROUGH_EXCLUDED_MODELS and context_manager.raw_fits(
+                    candidate, len(body), table.get(candidate).context_length, PASSTHROUGH_RESERVED_TOKENS),
+            )
+            return response
+    
+    payload = fastjson.decode_body(body)
+    print(f"[DEBUG] Requête reçue sur /v1/chat/completions avec payload: {fastjson.preview(body, 500)}")
     try:
         # Vu00e9rifier si nous sommes en mode test
         test_mode = payload.get("test_mode", False)
@@ -517,37 +1328,22 @@ async def chat_completions(payload: dict = Body(...)):
         messages = payload.get("messages")
         
         print(f"[DEBUG] Modèle demandé: {model_name}")
-        print(f"[DEBUG] Messages: {json.dumps(messages, ensure_ascii=False)[:500]}")
         
-        # Utiliser la valeur spécifique au modèle ou la valeur par défaut
-        default_max_tokens = DEFAULT_MAX_TOKENS.get(model_name, DEFAULT_MAX_TOKENS["default"])
-        max_tokens = payload.get("max_tokens", default_max_tokens)
+        # Analyse unique de la requête (explication détaillée, code...), partagée avec send_request
+        features = request_analyzer.analyze_messages(messages)
+        clean_model_name = model_name.split(":")[0] if model_name and ":" in model_name else model_name
+        if is_auto_model(routing.current, clean_model_name):
+            clean_model_name = model_name = auto_model or resolve_auto_model(routing.current, features, messages=messages)
+
+        # max_tokens du client, sinon appris des longueurs observées, sinon la valeur fixe du modèle
+        max_tokens, learned = choose_max_tokens(clean_model_name, request.url.path, features, payload.get("max_tokens"))
         temperature = payload.get("temperature", 1.0)
 
         print(f"[DEBUG] max_tokens: {max_tokens}, temperature: {temperature}")
-        
-        # Forcer une valeur élevée de max_tokens pour les questions détaillées
-        request_text = " ".join([msg.get("content", "") for msg in messages if isinstance(msg.get("content", ""), str)])
-        
-        # Détection des requêtes d'explication détaillée
-        if any(keyword in request_text.lower() for keyword in ["détail", "expliqu", "comment fonctionne", "explique"]):
-            # Utiliser au moins 1500 tokens pour les demandes d'explications détaillées
-            max_tokens = max(max_tokens, 1500)
-            debug_log(f"Détection d'une demande d'explication détaillée, augmentation de max_tokens à {max_tokens}")
-        
-        # Détection des requêtes de code
-        if model_name == "mamba-codestral-7b-v0-1" or any(keyword in request_text.lower() for keyword in ["code", "programme", "script", "fonction", "class", "api", "développe"]):
-            # Réduire la température pour le code pour plus de précision
-            if "temperature" not in payload:
-                temperature = 0.2
-                debug_log(f"Détection d'une demande de code, réduction de la température à {temperature}")
-            # S'assurer d'avoir suffisamment de tokens pour le code
-            if model_name == "mamba-codestral-7b-v0-1":
-                max_tokens = max(max_tokens, 2500)
-                debug_log(f"Utilisation du modèle de code, augmentation de max_tokens à {max_tokens}")
+        max_tokens, temperature = adjust_generation_params(clean_model_name, features, max_tokens, temperature, "temperature" in payload, learned)
 
         if not model_name or not messages:
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=422, 
                 content={"error": "Les champs 'model' et 'messages' sont requis."}
             )
@@ -558,13 +1354,15 @@ async def chat_completions(payload: dict = Body(...)):
             model_name = model_name.split(":")[0]
             print(f"[INFO] Suffixe ':latest' supprimé du nom du modèle: {model_name}")
 
-        if model_name not in endpoints:
-            return JSONResponse(
+        table = routing.current
+        annotate_request(model=model_name)
+        if model_name not in table.endpoints:
+            return FastJSONResponse(
                 status_code=404, 
                 content={"error": f"Modèle '{model_name}' non trouvé."}
             )
 
-        endpoint = endpoints[model_name]
+        endpoint = table.endpoints[model_name]
         ovh_payload = {
             "model": model_name,
             "messages": messages,
@@ -575,20 +1373,22 @@ async def chat_completions(payload: dict = Body(...)):
         # Si c'est DeepSeek, ajoutons des logs de débogage supplémentaires
         if model_name == "deepseek-r1-distill-llama-70b":
             debug_log(f"Requête DeepSeek via API standard - Modèle: {original_model}")
-            debug_log(f"Payload pour DeepSeek: {json.dumps(ovh_payload, ensure_ascii=False)}")
+            debug_log(f"Payload pour DeepSeek: {len(messages)} messages, {len(body)} octets")
         
         # Essayer d'envoyer la requête, mais capturer toute exception
         try:
             print(f"[DEBUG] Envoi de la requête à l'endpoint {endpoint} avec route 'chat'")
-            result = send_request(endpoint, ovh_payload, route="chat")
+            result, served_model = await send_with_fallback(request, model_name, ovh_payload, "chat", table, features=features)
             print(f"[DEBUG] Requête envoyée avec succès, résultat reçu")
+            if "max_tokens" not in payload:
+                record_completion_length(served_model, request.url.path, features, result)
             
             # Si c'est DeepSeek, loggons la réponse
             if model_name == "deepseek-r1-distill-llama-70b":
-                debug_log(f"Réponse DeepSeek (API standard): {json.dumps(result, ensure_ascii=False)}")
+                debug_log(f"Réponse DeepSeek (API standard): {describe_completion(result)}")
             
             # Post-traitement spécial pour DeepSeek
-            if model_name == "deepseek-r1-distill-llama-70b" and "choices" in result:
+            if served_model == "deepseek-r1-distill-llama-70b" and "choices" in result:
                 for choice in result["choices"]:
                     if "message" in choice and "content" in choice["message"]:
                         # Nettoyer les balises <think></think> dans la réponse
@@ -600,7 +1400,7 @@ async def chat_completions(payload: dict = Body(...)):
             
             # Si c'est DeepSeek, loggons la réponse après traitement
             if model_name == "deepseek-r1-distill-llama-70b":
-                debug_log(f"Réponse DeepSeek après traitement: {json.dumps(result, ensure_ascii=False)}")
+                debug_log(f"Réponse DeepSeek après traitement: {describe_completion(result)}")
             
             return result
         except Exception as e:
@@ -613,7 +1413,7 @@ async def chat_completions(payload: dict = Body(...)):
                 status_code = 500
                 
             # Retourner un message d'erreur détaillé au lieu de lever une exception
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=status_code, 
                 content={
                     "error": "Échec de l'appel API", 
@@ -624,7 +1424,7 @@ async def chat_completions(payload: dict = Body(...)):
             )
     except Exception as outer_e:
         # Attraper les erreurs inattendues
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=500, 
             content={
                 "error": "Erreur inattendue", 
@@ -633,7 +1433,7 @@ async def chat_completions(payload: dict = Body(...)):
         )
 
 @app.post("/v1/completions")
-async def completions(payload: dict = Body(...)):
+async def completions(request: Request, payload: dict = Depends(json_body)):
     model_name = payload.get("model")
     prompt = payload.get("prompt")
     max_tokens = payload.get("max_tokens", 16)
@@ -641,202 +1441,313 @@ async def completions(payload: dict = Body(...)):
 
     if not model_name or prompt is None:
         raise HTTPException(status_code=422, detail="Les champs 'model' et 'prompt' sont requis.")
+    if is_auto_model(routing.current, model_name):
+        model_name = resolve_auto_model(routing.current, request_analyzer.analyze_text(prompt), text=prompt if isinstance(prompt, str) else None)
         
     # Supprimer le suffixe ':latest' ajouté par OpenWebUI
     if ":" in model_name:
         model_name = model_name.split(":")[0]
         print(f"[INFO] Suffixe ':latest' supprimé du nom du modèle: {model_name}")
 
-    if model_name not in endpoints:
+    table = routing.current
+    annotate_request(model=model_name)
+    if model_name not in table.endpoints:
         raise HTTPException(status_code=404, detail="Modèle non trouvé.")
 
-    endpoint = endpoints[model_name]
     ovh_payload = {
         "model": model_name,
         "prompt": prompt,
         "max_tokens": max_tokens,
         "temperature": temperature,
     }
-    return send_request(endpoint, ovh_payload, route="completions")
+    result, _ = await send_with_fallback(request, model_name, ovh_payload, "completions", table)
+    return result
+
+def probe_ovh_url(url, timeout):
+    """
+    Sonde GET authentifiée d'une URL OVH (exécutée dans le pool des diagnostics)
+    """
+    print(f"[DEBUG] Essai de connexion à {url}")
+    headers = {"Authorization": f"Bearer {OVH_API_TOKEN}"}
+    response = requests.get(url, headers=headers, timeout=timeout)
+    return {
+        "status": response.status_code,
+        "response": response.text
+    }
+
+def compute_ovh_connection():
+    endpoints = routing.current.endpoints
+    probes = {}
+    for model_name, endpoint in endpoints.items():
+        # Essayer différentes URLs pour trouver la bonne
+        for url in (
+            f"{endpoint}/v1/models",
+            f"{endpoint}/api/v1/models",
+            f"{endpoint}/api/openai_compat/v1/models",
+            f"{endpoint}/"
+        ):
+            probes[(model_name, url)] = partial(probe_ovh_url, url, min(5, DIAGNOSTIC_BUDGET))
+    outcomes = run_probes(probes, budget=DIAGNOSTIC_BUDGET, max_workers=DIAGNOSTIC_MAX_WORKERS)
+    
+    results = {}
+    answered = set()
+    for (model_name, url), outcome in outcomes.items():
+        if model_name in answered:
+            continue
+        results[f"{model_name} - {url}"] = {
+            "status": outcome["status"],
+            "response": outcome.get("response", outcome.get("error"))
+        }
+        # Si on a une réponse valide, les URLs suivantes de ce modèle ne sont pas rapportées
+        if outcome["status"] == 200:
+            answered.add(model_name)
+    return results
+
+# Canal WebSocket multiplexé (voir wschat.py) : requêtes simultanées par connexion et taille de la file de sortie
+WS_CHAT_PATH = "/v1/chat/ws"
+WS_CHAT_MAX_CONCURRENT = int(os.getenv("WS_CHAT_MAX_CONCURRENT", 8))
+WS_CHAT_SEND_QUEUE = int(os.getenv("WS_CHAT_SEND_QUEUE", 256))
+metrics.describe("proxy_ws_connections", "gauge", "Connexions WebSocket ouvertes sur le canal de chat multiplexé")
+metrics.describe("proxy_ws_chat_requests_total", "counter", "Requêtes reçues sur le canal WebSocket, par statut")
+
+def open_chat_stream(model_route, body, last_resort):
+    """
+    Ouvre le flux OVH d'une requête du canal WebSocket (endpoints du modèle dans l'ordre) ;
+    retourne la réponse en flux. Si un modèle de repli peut prendre la requête
+    (`last_resort` faux), l'échec de tous les endpoints lève ModelUnavailable.
+    """
+    upstream_body = fastjson.dumps({**body, "model": model_route.upstream_name, "stream": True,
+                                    "stream_options": {"include_usage": True}})
+    annotate_request(model=model_route.name, request_bytes=len(upstream_body))
+    token = current_token.get()
+    last_error, last_status = None, 502
+    for attempt, target in enumerate(model_route.ordered_targets(), 1):
+        url = f"{target.url}/api/openai_compat/v1/chat/completions"
+        headers = {"Authorization": f"Bearer {target.token}", "Content-Type": "application/json"}
+        annotate_request(endpoint=target.url, attempts=attempt)
+        try:
+            response = upstream_pools.open(target.url, "POST", url, data=upstream_body, headers=headers,
+                                           timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_TTFT_TIMEOUT))
+        except requests.exceptions.RequestException as e:
+            if token is not None and token.cancelled:
+                raise ClientDisconnected()
+            debug_log(f"Canal WebSocket: échec de l'appel à {target.url}: {str(e)}")
+            if isinstance(e, requests.exceptions.ReadTimeout):
+                metrics.inc("proxy_upstream_stalls_total", endpoint=target.url, phase="ttft")
+                last_error, last_status = e, 504
+            else:
+                last_error, last_status = e, 502
+            continue
+        if response.status_code == 200:
+            return response
+        content = read_and_close(response)
+        last_error, last_status = f"HTTP {response.status_code}: {content[:200].decode('utf-8', errors='replace')}", response.status_code
+        if response.status_code not in PASSTHROUGH_RETRY_STATUS:
+            break
+    if not last_resort and last_status in FALLBACK_STATUS:
+        raise ModelUnavailable(model_route.name, last_status, str(last_error))
+    raise HTTPException(status_code=last_status, detail=f"Échec de l'appel API: {str(last_error)}")
+
+async def stream_ws_chat(channel, request_id, body, token):
+    """
+    Sert une requête du canal WebSocket : choix du modèle (auto, repli), appel OVH en flux
+    et émission des fragments au fil de la génération
+    """
+    if not isinstance(body, dict) or not body.get("model") or not isinstance(body.get("messages"), list):
+        raise HTTPException(status_code=422, detail="Les champs 'model' et 'messages' sont requis.")
+    table = routing.current
+    model_name = body["model"].split(":")[0]
+    if is_auto_model(table, model_name):
+        model_name = resolve_auto_model(table, request_analyzer.analyze_messages(body["messages"]), messages=body["messages"])
+    if table.get(model_name) is None:
+        raise HTTPException(status_code=404, detail=f"Modèle '{model_name}' non trouvé.")
+    annotate_request(model=model_name)
+
+    async def open_stream(candidate, last_resort):
+        return await run_in_threadpool(open_chat_stream, table.get(candidate), body, last_resort)
+
+    current_token.set(token)
+    upstream_start = time.perf_counter()
+    response, served_model = await call_with_fallback(model_name, table, open_stream)
+    assembler = CompletionAssembler("chat")
+    try:
+        async for data in iterate_in_threadpool(iter_sse_data(response.iter_content(chunk_size=None))):
+            event = fastjson.loads(data)
+            first = assembler.first_token_at is None
+            if not assembler.feed(event):
+                continue
+            if first:
+                set_read_timeout(response, UPSTREAM_IDLE_TIMEOUT)
+            for choice in event.get("choices") or ():
+                delta = choice.get("delta") or {}
+                if delta.get("content") or delta.get("tool_calls"):
+                    await channel.emit({"type": "delta", "id": request_id, "index": choice.get("index", 0), "delta": delta})
+    except BaseException as e:
+        if token.cancelled or isinstance(e, asyncio.CancelledError):
+            token.cancel("client_disconnect")
+            record_cancellation(WS_CHAT_PATH, token.reason, served_model, body.get("max_tokens"), assembler.token_events)
+            raise
+        debug_log(f"Canal WebSocket: flux interrompu ({served_model}): {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Flux OVH interrompu: {str(e)}")
+    finally:
+        await run_in_threadpool(response.close)
+    if not assembler.choices:
+        # 200 sans aucun événement (corps non-SSE ou flux vide) : ce n'est pas une génération réussie
+        raise HTTPException(status_code=502, detail="Réponse OVH sans aucun événement de flux.")
+    result = complete_generation(assembler, upstream_start, served_model)
+    choices = result.get("choices") or [{}]
+    annotate_request(status=200)
+    await channel.emit({
+        "type": "done", "id": request_id, "model": served_model,
+        "finish_reason": choices[0].get("finish_reason"), "usage": result.get("usage"),
+    })
+
+async def serve_ws_chat_request(channel, request_id, body, token, client_id, key):
+    """
+    Contexte d'une requête du canal WebSocket : limites de la clé d'API, journal, usage
+    """
+    ctx = {"route": WS_CHAT_PATH, "client_id": client_id, "attempts": 0, "status": 0}
+    request_context.set(ctx)
+    start_time = time.time()
+    admitted = False
+    try:
+        if lifecycle.draining and lifecycle.refuse_new:
+            raise HTTPException(status_code=503, detail="Le proxy redémarre, veuillez réessayer.",
+                                headers={"Retry-After": "1"})
+        if key is not None:
+            refusal = api_keys.admit(key)
+            if refusal is not None:
+                reason, retry_after = refusal
+                raise HTTPException(status_code=429, detail=f"Limite de la clé {key.id} atteinte ({reason}).",
+                                    headers={"Retry-After": str(retry_after)})
+            admitted = True
+        await stream_ws_chat(channel, request_id, body, token)
+    except HTTPException as e:
+        ctx["status"] = 499 if token.cancelled else e.status_code
+        raise
+    except BaseException:
+        ctx["status"] = 499 if token.cancelled else 500
+        raise
+    finally:
+        if admitted:
+            api_keys.release(key, ctx.get("prompt_tokens"), ctx.get("completion_tokens"))
+        metrics.inc("proxy_ws_chat_requests_total", status=ctx["status"])
+        finish_request(ctx, start_time, request_journal if JOURNAL_ENABLED else None, (on_request_finished,))
+
+@app.websocket(WS_CHAT_PATH)
+async def chat_websocket(websocket: WebSocket):
+    """
+    Canal WebSocket multiplexé : plusieurs requêtes de chat simultanées sur une connexion,
+    réponses en fragments entrelacés (protocole décrit dans wschat.py)
+    """
+    key = None
+    if API_KEYS_ENABLED:
+        key = api_keys.authenticate(presented_key(websocket.scope))
+        if key is None:
+            await websocket.close(code=POLICY_VIOLATION)
+            return
+    await websocket.accept()
+    client_id = key.id if key is not None else get_client_id(websocket.scope)
+    channel = ChatChannel(
+        websocket,
+        lambda request_id, body, token: serve_ws_chat_request(channel, request_id, body, token, client_id, key),
+        max_concurrent=WS_CHAT_MAX_CONCURRENT,
+        queue_size=WS_CHAT_SEND_QUEUE,
+    )
+    metrics.inc("proxy_ws_connections")
+    try:
+        await channel.run()
+    finally:
+        metrics.inc("proxy_ws_connections", -1)
 
 @app.get("/test-ovh-connection")
 async def test_ovh_connection():
     """
     Test la connexion avec les endpoints OVH et récupère les informations disponibles
     """
-    results = {}
+    return await cached_diagnostic("test-ovh-connection", compute_ovh_connection)
+
+def fetch_models_from(endpoint, timeout):
+    url = f"{endpoint}/api/openai_compat/v1/models"
+    print(f"[DEBUG] Récupération des modèles depuis {url}")
     
-    # Tester chaque endpoint
-    for model_name, endpoint in endpoints.items():
-        try:
-            # Essayer différentes URLs pour trouver la bonne
-            possible_urls = [
-                f"{endpoint}/v1/models",
-                f"{endpoint}/api/v1/models",
-                f"{endpoint}/api/openai_compat/v1/models",
-                f"{endpoint}/"
-            ]
-            
-            # Essayer chaque URL
-            for url in possible_urls:
-                try:
-                    print(f"[DEBUG] Essai de connexion à {url}")
-                    headers = {"Authorization": f"Bearer {OVH_API_TOKEN}"}
-                    response = requests.get(url, headers=headers, timeout=5)
-                    status = response.status_code
-                    response_text = response.text
-                    
-                    results[f"{model_name} - {url}"] = {
-                        "status": status,
-                        "response": response_text
-                    }
-                    
-                    # Si on a une réponse valide, on arrête de tester les autres URLs
-                    if status == 200:
-                        break
-                except Exception as e:
-                    results[f"{model_name} - {url}"] = {
-                        "status": "error",
-                        "response": str(e)
-                    }
-        except Exception as e:
-            results[model_name] = {
-                "status": "error",
-                "response": str(e)
-            }
+    headers = {"Authorization": f"Bearer {OVH_API_TOKEN}"}
+    response = requests.get(url, headers=headers, timeout=timeout)
     
-    return results
+    print(f"[DEBUG] Code de statut : {response.status_code}")
+    print(f"[DEBUG] Réponse : {response.text}")
+    
+    if response.status_code == 200:
+        return response.json()
+    return {
+        "status": response.status_code,
+        "error": response.text
+    }
+
+def compute_ovh_models():
+    probes = {
+        model_name: partial(fetch_models_from, endpoint, min(5, DIAGNOSTIC_BUDGET))
+        for model_name, endpoint in routing.current.endpoints.items()
+    }
+    return run_probes(probes, budget=DIAGNOSTIC_BUDGET, max_workers=DIAGNOSTIC_MAX_WORKERS)
 
 @app.get("/fetch-ovh-models")
 async def fetch_ovh_models():
     """
     Interroge les endpoints OVH pour récupérer la liste exacte des modèles disponibles
     """
-    results = {}
-    
-    for model_name, endpoint in endpoints.items():
-        try:
-            url = f"{endpoint}/api/openai_compat/v1/models"
-            print(f"[DEBUG] Récupération des modèles depuis {url}")
-            
-            headers = {"Authorization": f"Bearer {OVH_API_TOKEN}"}
-            response = requests.get(url, headers=headers, timeout=5)
-            
-            print(f"[DEBUG] Code de statut : {response.status_code}")
-            print(f"[DEBUG] Réponse : {response.text}")
-            
-            if response.status_code == 200:
-                results[model_name] = response.json()
-            else:
-                results[model_name] = {
-                    "status": response.status_code,
-                    "error": response.text
-                }
-        except Exception as e:
-            results[model_name] = {
-                "status": "error",
-                "error": str(e)
-            }
-    
-    return results
+    return await cached_diagnostic("fetch-ovh-models", compute_ovh_models)
 
 # Endpoints pour la compatibilité avec OpenWebUI
 @app.get("/api/models")
-async def api_models():
+async def api_models(request: Request):
     """
     Endpoint spécifique pour OpenWebUI qui retourne la liste des modèles
     """
-    print("Requête pour /api/models reçue")
-    
-    models_list = []
-    for model_name in endpoints.keys():
-        # Ajouter ':latest' au nom du modèle pour OpenWebUI
-        display_name = f"{model_name}:latest"
-        model_info = {
-            "id": display_name,
-            "name": display_name,
-            "model_id": display_name,
-            "object": "model",
-            "created": 1699891200,  # Date fixe pour tous les modèles
-            "owned_by": "OVH AI",
-            "root": model_name,
-            "parent": None,
-            "permission": []
-        }
-        models_list.append(model_info)
-    
-    print(f"Retour de /api/models: {len(models_list)} modèles")
-    return JSONResponse(content={"data": models_list, "object": "list"})
+    return catalog_response(request, "openwebui")
 
 @app.get("/api/tags")
-async def list_tags():
+async def list_tags(request: Request):
     """
     Endpoint compatible avec Ollama pour lister les modèles disponibles
     """
-    # Construire une réponse au format compatible avec Ollama et OpenWebUI
-    ollama_models = []
-    for model_name in endpoints.keys():
-        # Ajouter ':latest' au nom du modèle pour OpenWebUI
-        display_name = f"{model_name}:latest"
-        model_data = {
-            "name": display_name,  # Nom avec suffixe pour l'affichage
-            "model": display_name, # Champ requis par OpenWebUI
-            "modified_at": "2023-11-04T14:56:49.277302746-07:00",  # Date fictive
-            "size": 0,  # Taille fictive
-            "digest": f"sha256:{model_name}",  # Digest fictif
-            "details": {
-                "format": "gguf",
-                "family": "llama",
-                "parameter_size": "7B",
-                "quantization_level": "Q4_0"
-            }
-        }
-        print(f"Ajout du modèle: {model_data}")
-        ollama_models.append(model_data)
-    
-    response_content = {"models": ollama_models}
-    print(f"Réponse complète: {response_content}")
-    return JSONResponse(content=response_content)
+    return catalog_response(request, "ollama")
+
+def ollama_usage(result):
+    """
+    Compteurs de tokens d'une réponse OpenAI, aux noms des champs Ollama
+    """
+    usage = result.get("usage") or {}
+    fields = {}
+    if usage.get("prompt_tokens") is not None:
+        fields["prompt_eval_count"] = usage["prompt_tokens"]
+    if usage.get("completion_tokens") is not None:
+        fields["eval_count"] = usage["completion_tokens"]
+    return fields
 
 @app.post("/api/chat")
-async def chat(payload: dict = Body(...)):
+async def chat(request: Request, payload: dict = Depends(json_body)):
     """
     Endpoint compatible avec Ollama pour le chat
     """
-    print(f"Requête de chat Ollama reçue: {payload}")
-    
     # Extraire les informations nécessaires
     model_name = payload.get("model")
     messages = payload.get("messages", [])
-    
-    # Utiliser la valeur spécifique au modèle ou la valeur par défaut
-    default_max_tokens = DEFAULT_MAX_TOKENS.get(model_name.split(":")[0] if ":" in model_name else model_name, 
-                                             DEFAULT_MAX_TOKENS["default"])
-    max_tokens = payload.get("max_tokens", default_max_tokens)
-    temperature = payload.get("temperature", 0.7)
+    request_size = len(await request.body())
+    print(f"Requête de chat Ollama reçue: modèle {model_name}, {len(messages)} messages, {request_size} octets")
     
     # Récupérer le nom du modèle sans le suffixe
     clean_model_name = model_name.split(":")[0] if ":" in model_name else model_name
     
-    # Forcer une valeur élevée de max_tokens pour les questions détaillées
-    request_text = " ".join([msg.get("content", "") for msg in messages if isinstance(msg.get("content", ""), str)])
-    
-    # Détection des requêtes d'explication détaillée
-    if any(keyword in request_text.lower() for keyword in ["détail", "expliqu", "comment fonctionne", "explique"]):
-        # Utiliser au moins 1500 tokens pour les demandes d'explications détaillées
-        max_tokens = max(max_tokens, 1500)
-        debug_log(f"Détection d'une demande d'explication détaillée, augmentation de max_tokens à {max_tokens}")
+    # Analyse unique de la requête (explication détaillée, code...), partagée avec send_request
+    features = request_analyzer.analyze_messages(messages)
+    if is_auto_model(routing.current, clean_model_name):
+        clean_model_name = model_name = resolve_auto_model(routing.current, features, messages=messages)
     
-    # Détection des requêtes de code
-    if clean_model_name == "mamba-codestral-7b-v0-1" or any(keyword in request_text.lower() for keyword in ["code", "programme", "script", "fonction", "class", "api", "développe"]):
-        # Réduire la température pour le code pour plus de précision
-        if "temperature" not in payload:
-            temperature = 0.2
-            debug_log(f"Détection d'une demande de code, réduction de la température à {temperature}")
-        # S'assurer d'avoir suffisamment de tokens pour le code
-        if clean_model_name == "mamba-codestral-7b-v0-1":
-            max_tokens = max(max_tokens, 2500)
-            debug_log(f"Utilisation du modèle de code, augmentation de max_tokens à {max_tokens}")
+    # max_tokens du client, sinon appris des longueurs observées, sinon la valeur fixe du modèle
+    max_tokens, learned = choose_max_tokens(clean_model_name, request.url.path, features, payload.get("max_tokens"))
+    temperature = payload.get("temperature", 0.7)
+    max_tokens, temperature = adjust_generation_params(clean_model_name, features, max_tokens, temperature, "temperature" in payload, learned)
 
     if not model_name or not messages:
         raise HTTPException(status_code=422, detail="Les champs 'model' et 'messages' sont requis.")
@@ -847,7 +1758,9 @@ async def chat(payload: dict = Body(...)):
         model_name = model_name.split(":")[0]
         print(f"[INFO] Suppression du suffixe ':latest': {model_name}")
     
-    if model_name not in endpoints:
+    table = routing.current
+    annotate_request(model=model_name)
+    if model_name not in table.endpoints:
         raise HTTPException(status_code=404, detail=f"Modèle '{model_name}' non trouvé.")
 
     # Convertir le format Ollama vers le format OpenAI pour notre API
@@ -858,7 +1771,7 @@ async def chat(payload: dict = Body(...)):
         openai_messages.append({"role": role, "content": content})
     
     # Utiliser l'endpoint existant de chat
-    endpoint = endpoints[model_name]
+    endpoint = table.endpoints[model_name]
     ovh_payload = {
         "model": model_name,
         "messages": openai_messages,
@@ -869,42 +1782,42 @@ async def chat(payload: dict = Body(...)):
     # Si c'est DeepSeek, ajoutons des logs de débogage supplémentaires
     if "deepseek" in model_name:
         debug_log(f"Requête DeepSeek via OpenWebUI - Modèle: {original_model}")
-        debug_log(f"Payload pour DeepSeek: {json.dumps(ovh_payload, ensure_ascii=False)}")
+        debug_log(f"Payload pour DeepSeek: {len(messages)} messages, {request_size} octets")
     
     # Envoyer la requête à OVH
     try:
         print(f"[DEBUG] Envoi de la requête à l'endpoint {endpoint} avec route 'chat'")
-        result = send_request(endpoint, ovh_payload, route="chat")
+        result, served_model = await send_with_fallback(request, model_name, ovh_payload, "chat", table, features=features)
         print(f"[DEBUG] Requête envoyée avec succès, résultat reçu")
+        if "max_tokens" not in payload:
+            record_completion_length(served_model, request.url.path, features, result)
         
         # Si c'est DeepSeek, loggons la réponse
         if "deepseek" in model_name:
-            debug_log(f"Réponse DeepSeek: {json.dumps(result, ensure_ascii=False)}")
+            debug_log(f"Réponse DeepSeek: {describe_completion(result)}")
         
         # Convertir la réponse OpenAI en format Ollama
         content = result["choices"][0]["message"]["content"]
         
         # Post-traitement spécial pour DeepSeek - nettoyer les balises <think></think>
-        if model_name == "deepseek-r1-distill-llama-70b":
+        if served_model == "deepseek-r1-distill-llama-70b":
             # Utiliser une regex pour supprimer les balises et leur contenu
             original_content = content
             content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL).strip()
             debug_log(f"DeepSeek: Nettoyage des balises <think> effectué. Longueur avant: {len(original_content)}, Longueur après: {len(content)}")
         
         ollama_response = {
-            "model": model_name,
+            "model": served_model,
             "created_at": result.get("created", ""),
             "message": {
                 "role": "assistant",
                 "content": content
             },
-            "done": True
+            "done": True,
+            **ollama_usage(result),
         }
-        if "deepseek" in model_name:
-            debug_log(f"Réponse Ollama DeepSeek: {json.dumps(ollama_response, ensure_ascii=False)}")
-        
         print(f"Réponse Ollama chat générée avec {len(content)} caractères")
-        return JSONResponse(content=ollama_response)
+        return FastJSONResponse(content=ollama_response)
     except Exception as e:
         print(f"Erreur lors de la conversion de la réponse: {str(e)}")
         if isinstance(e, HTTPException):
@@ -912,50 +1825,34 @@ async def chat(payload: dict = Body(...)):
         raise HTTPException(status_code=500, detail=f"Erreur de traitement: {str(e)}")
 
 @app.post("/api/generate")
-async def generate(payload: dict = Body(...)):
+async def generate(request: Request, payload: dict = Depends(json_body)):
     """
     Endpoint compatible avec Ollama pour générer des réponses
     """
-    print(f"Requête de génération Ollama reçue: {payload}")
-    
     # Extraire les informations nécessaires
     model_name = payload.get("model")
     prompt = payload.get("prompt")
+    request_size = len(await request.body())
+    print(f"Requête de génération Ollama reçue: modèle {model_name}, {request_size} octets")
     system_prompt = payload.get("system", "Tu es un assistant intelligent.")
     
-    # Utiliser la valeur spécifique au modèle ou la valeur par défaut
-    default_max_tokens = DEFAULT_MAX_TOKENS.get(model_name.split(":")[0] if ":" in model_name else model_name, 
-                                             DEFAULT_MAX_TOKENS["default"])
-    max_tokens = payload.get("max_tokens", default_max_tokens)
-    temperature = payload.get("temperature", 0.7)
-    
     # Récupérer le nom du modèle sans le suffixe
     clean_model_name = model_name.split(":")[0] if ":" in model_name else model_name
     
-    # Forcer une valeur élevée de max_tokens pour les questions détaillées
-    request_text = prompt if isinstance(prompt, str) else ""
+    # Analyse unique du prompt (explication détaillée, code...), partagée avec send_request
+    features = request_analyzer.analyze_text(prompt)
+    if is_auto_model(routing.current, clean_model_name):
+        clean_model_name = model_name = resolve_auto_model(routing.current, features, text=prompt)
     
-    # Détection des requêtes d'explication détaillée
-    if any(keyword in request_text.lower() for keyword in ["détail", "expliqu", "comment fonctionne", "explique"]):
-        # Utiliser au moins 1500 tokens pour les demandes d'explications détaillées
-        max_tokens = max(max_tokens, 1500)
-        debug_log(f"Détection d'une demande d'explication détaillée, augmentation de max_tokens à {max_tokens}")
+    # max_tokens du client, sinon appris des longueurs observées, sinon la valeur fixe du modèle
+    max_tokens, learned = choose_max_tokens(clean_model_name, request.url.path, features, payload.get("max_tokens"))
+    temperature = payload.get("temperature", 0.7)
+    max_tokens, temperature = adjust_generation_params(clean_model_name, features, max_tokens, temperature, "temperature" in payload, learned)
     
-    # Détection des requêtes de code
-    if clean_model_name == "mamba-codestral-7b-v0-1" or any(keyword in request_text.lower() for keyword in ["code", "programme", "script", "fonction", "class", "api", "développe"]):
-        # Réduire la température pour le code pour plus de précision
-        if "temperature" not in payload:
-            temperature = 0.2
-            debug_log(f"Détection d'une demande de code, réduction de la température à {temperature}")
-        # S'assurer d'avoir suffisamment de tokens pour le code
-        if clean_model_name == "mamba-codestral-7b-v0-1":
-            max_tokens = max(max_tokens, 2500)
-            debug_log(f"Utilisation du modèle de code, augmentation de max_tokens à {max_tokens}")
-            
-            # Ajouter un système prompt spécifique pour le code si nécessaire
-            if "system" not in payload:
-                system_prompt = "Tu es un expert en programmation. Réponds avec du code bien structuré, commenté et optimisé."
-                debug_log(f"Ajout d'un system prompt spécifique pour le modèle de code")
+    # Ajouter un système prompt spécifique pour le modèle de code si nécessaire
+    if clean_model_name == "mamba-codestral-7b-v0-1" and "system" not in payload:
+        system_prompt = "Tu es un expert en programmation. Réponds avec du code bien structuré, commenté et optimisé."
+        debug_log(f"Ajout d'un system prompt spécifique pour le modèle de code")
     
     if not model_name or not prompt:
         raise HTTPException(status_code=422, detail="Les champs 'model' et 'prompt' sont requis.")
@@ -966,7 +1863,9 @@ async def generate(payload: dict = Body(...)):
         model_name = model_name.split(":")[0]
         print(f"[INFO] Suppression du suffixe ':latest': {model_name}")
     
-    if model_name not in endpoints:
+    table = routing.current
+    annotate_request(model=model_name)
+    if model_name not in table.endpoints:
         raise HTTPException(status_code=404, detail=f"Modèle '{model_name}' non trouvé.")
 
     # Convertir le format Ollama vers le format OpenAI pour notre API
@@ -976,7 +1875,7 @@ async def generate(payload: dict = Body(...)):
     ]
     
     # Utiliser l'endpoint existant de chat
-    endpoint = endpoints[model_name]
+    endpoint = table.endpoints[model_name]
     ovh_payload = {
         "model": model_name,
         "messages": messages,
@@ -987,38 +1886,38 @@ async def generate(payload: dict = Body(...)):
     # Si c'est DeepSeek, ajoutons des logs de débogage supplémentaires
     if "deepseek" in model_name:
         debug_log(f"Requête DeepSeek via OpenWebUI (generate) - Modèle: {original_model}")
-        debug_log(f"Payload pour DeepSeek: {json.dumps(ovh_payload, ensure_ascii=False)}")
+        debug_log(f"Payload pour DeepSeek: {len(messages)} messages, {request_size} octets")
     
     try:
         # Envoyer la requête à OVH
-        response_data = send_request(endpoint, ovh_payload, route="chat")
+        response_data, served_model = await send_with_fallback(request, model_name, ovh_payload, "chat", table, features=features)
+        if "max_tokens" not in payload:
+            record_completion_length(served_model, request.url.path, features, response_data)
         
         # Si c'est DeepSeek, loggons la réponse
         if "deepseek" in model_name:
-            debug_log(f"Réponse DeepSeek (generate): {json.dumps(response_data, ensure_ascii=False)}")
+            debug_log(f"Réponse DeepSeek (generate): {describe_completion(response_data)}")
         
         # Convertir la réponse OpenAI en format Ollama
         content = response_data["choices"][0]["message"]["content"]
         
         # Post-traitement spécial pour DeepSeek - nettoyer les balises <think></think>
-        if model_name == "deepseek-r1-distill-llama-70b":
+        if served_model == "deepseek-r1-distill-llama-70b":
             # Utiliser une regex pour supprimer les balises et leur contenu
             original_content = content
             content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL).strip()
             debug_log(f"DeepSeek (api/generate): Nettoyage des balises <think> effectué. Longueur avant: {len(original_content)}, Longueur après: {len(content)}")
         
         ollama_response = {
-            "model": model_name,
+            "model": served_model,
             "created_at": response_data.get("created", ""),
             "response": content,
-            "done": True
+            "done": True,
+            **ollama_usage(response_data),
         }
         
-        if "deepseek" in model_name:
-            debug_log(f"Réponse Ollama DeepSeek (generate): {json.dumps(ollama_response, ensure_ascii=False)}")
-        
         print(f"Réponse Ollama generate générée avec {len(content)} caractères")
-        return JSONResponse(content=ollama_response)
+        return FastJSONResponse(content=ollama_response)
     except Exception as e:
         print(f"Erreur lors de la génération: {str(e)}")
         if isinstance(e, HTTPException):
@@ -1031,8 +1930,26 @@ async def health_check():
     Endpoint de vérification de santé pour les healthchecks de Docker
     """
     print("Vérification de santé via /health")
+    # Vivacité : le processus répond ; la disponibilité est rapportée à part
+    return {"status": "ok", "live": True, **lifecycle.snapshot()}
+
+@app.get("/health/live")
+async def health_live():
+    """
+    Sonde de vivacité : 200 dès que le serveur répond
+    """
     return {"status": "ok"}
 
+@app.get("/health/ready")
+async def health_ready():
+    """
+    Sonde de disponibilité : 503 tant que la configuration n'est pas chargée
+    et les connexions vers OVH pré-ouvertes (UPSTREAM_PREWARM)
+    """
+    state = lifecycle.snapshot()
+    return FastJSONResponse({"status": "ok" if state["ready"] else state["state"], **state},
+                            status_code=200 if state["ready"] else 503)
+
 @app.get("/api/health")
 async def api_health_check():
     """
@@ -1041,12 +1958,80 @@ async def api_health_check():
     print("Vérification de santé via /api/health")
     return {"status": "ok"}
 
-@app.get("/diagnostic")
-async def diagnostic():
+def probe_models_endpoint(endpoint_url, timeout):
     """
-    Route de diagnostic qui teste explicitement la connexion à l'API OVH
-    et retourne les résultats détaillés pour comprendre le problème.
+    Sonde la liste des modèles d'un endpoint (résultat au format de /diagnostic)
     """
+    test_url = f"{endpoint_url}/api/openai_compat/v1/models"
+    headers = {
+        "Authorization": f"Bearer {OVH_API_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    try:
+        response = requests.get(test_url, headers=headers, timeout=timeout)
+    except requests.exceptions.Timeout:
+        return {
+            "url": endpoint_url,
+            "status": "timeout",
+            "error": f"La requête a expiré après {timeout:g} secondes"
+        }
+    result = {
+        "url": endpoint_url,
+        "status_code": response.status_code,
+        "status": "ok" if response.status_code == 200 else "error",
+        "response_preview": response.text[:200] + "..." if len(response.text) > 200 else response.text
+    }
+    # Si la réponse est OK, essayer de parser les modèles disponibles
+    if response.status_code == 200:
+        try:
+            data = response.json()
+            result["models"] = [model.get("id") for model in data.get("data", [])]
+        except Exception as e:
+            result["parse_error"] = str(e)
+    return result
+
+def probe_authentication(test_model, endpoint_url, timeout):
+    """
+    Test simple de chat avec un modèle de base, pour vérifier l'authentification
+    """
+    test_url = f"{endpoint_url}/api/openai_compat/v1/chat/completions"
+    payload = {
+        "model": "Mistral-7B-Instruct-v0.3",
+        "messages": [
+            {"role": "user", "content": "Bonjour"}
+        ],
+        "max_tokens": 10,
+        "temperature": 0.5
+    }
+    headers = {
+        "Authorization": f"Bearer {OVH_API_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    try:
+        response = requests.post(test_url, json=payload, headers=headers, timeout=timeout)
+    except requests.exceptions.Timeout:
+        return {
+            "model": test_model,
+            "status": "timeout",
+            "error": f"La requête a expiré après {timeout:g} secondes"
+        }
+    result = {
+        "model": test_model,
+        "status_code": response.status_code,
+        "status": "ok" if response.status_code == 200 else "error",
+        "response_preview": response.text[:200] + "..." if len(response.text) > 200 else response.text
+    }
+    if response.status_code == 200:
+        try:
+            data = response.json()
+            if "choices" in data and len(data["choices"]) > 0:
+                result["response_content"] = data["choices"][0].get("message", {}).get("content", "")
+        except Exception as e:
+            result["parse_error"] = str(e)
+    return result
+
+def compute_diagnostic():
+    table = routing.current
     results = {
         "status": "ok",
         "timestamp": time.time(),
@@ -1055,109 +2040,36 @@ async def diagnostic():
             "platform": sys.platform,
             "api_token_length": len(OVH_API_TOKEN) if OVH_API_TOKEN else 0,
             "api_token_prefix": OVH_API_TOKEN[:5] + "..." if OVH_API_TOKEN and len(OVH_API_TOKEN) > 10 else "Non défini",
-            "endpoints_count": len(endpoints),
-            "alternative_endpoints_count": sum(len(endpoints) for endpoints in alternative_endpoints.values())
+            "endpoints_count": len(table.endpoints),
+            "alternative_endpoints_count": sum(len(urls) for urls in table.alternative_endpoints.values()),
+            "routing_table_version": table.version
         },
         "endpoints_status": {},
         "models_available": []
     }
     
-    # Tester chaque endpoint principal
-    for model_name, endpoint_url in endpoints.items():
-        # Construire l'URL de test
-        test_url = f"{endpoint_url}/api/openai_compat/v1/models"
-        
-        # Préparer les headers
-        headers = {
-            "Authorization": f"Bearer {OVH_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        # Tester la connexion
-        try:
-            response = requests.get(test_url, headers=headers, timeout=10)
-            
-            # Enregistrer le résultat
-            results["endpoints_status"][model_name] = {
-                "url": endpoint_url,
-                "status_code": response.status_code,
-                "status": "ok" if response.status_code == 200 else "error",
-                "response_preview": response.text[:200] + "..." if len(response.text) > 200 else response.text
-            }
-            
-            # Si la réponse est OK, essayer de parser les modèles disponibles
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    if "data" in data:
-                        for model in data["data"]:
-                            if model.get("id") not in results["models_available"]:
-                                results["models_available"].append(model.get("id"))
-                except Exception as e:
-                    results["endpoints_status"][model_name]["parse_error"] = str(e)
-        except requests.exceptions.Timeout:
-            results["endpoints_status"][model_name] = {
-                "url": endpoint_url,
-                "status": "timeout",
-                "error": "La requête a expiré après 10 secondes"
-            }
-        except Exception as e:
-            results["endpoints_status"][model_name] = {
-                "url": endpoint_url,
-                "status": "error",
-                "error": str(e)
-            }
-    
-    # Effectuer un test simple avec un modèle de base pour vérifier l'authentification
+    # Tous les endpoints principaux et le test d'authentification sont sondés en parallèle
+    probes = {
+        ("endpoint", model_name): partial(probe_models_endpoint, endpoint_url, min(10, DIAGNOSTIC_BUDGET))
+        for model_name, endpoint_url in table.endpoints.items()
+    }
     test_model = "mistral-7b-instruct-v0.3"  # Modèle de base pour le test
-    if test_model in endpoints:
-        endpoint_url = endpoints[test_model]
-        test_url = f"{endpoint_url}/api/openai_compat/v1/chat/completions"
-        
-        payload = {
-            "model": "Mistral-7B-Instruct-v0.3",
-            "messages": [
-                {"role": "user", "content": "Bonjour"}
-            ],
-            "max_tokens": 10,
-            "temperature": 0.5
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {OVH_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        try:
-            response = requests.post(test_url, json=payload, headers=headers, timeout=15)
-            
-            results["authentication_test"] = {
-                "model": test_model,
-                "status_code": response.status_code,
-                "status": "ok" if response.status_code == 200 else "error",
-                "response_preview": response.text[:200] + "..." if len(response.text) > 200 else response.text
-            }
-            
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    if "choices" in data and len(data["choices"]) > 0:
-                        content = data["choices"][0].get("message", {}).get("content", "")
-                        results["authentication_test"]["response_content"] = content
-                except Exception as e:
-                    results["authentication_test"]["parse_error"] = str(e)
-        except requests.exceptions.Timeout:
-            results["authentication_test"] = {
-                "model": test_model,
-                "status": "timeout",
-                "error": "La requête a expiré après 15 secondes"
-            }
-        except Exception as e:
-            results["authentication_test"] = {
-                "model": test_model,
-                "status": "error",
-                "error": str(e)
-            }
+    if test_model in table.endpoints:
+        probes[("authentication", test_model)] = partial(
+            probe_authentication, test_model, table.endpoints[test_model], min(15, DIAGNOSTIC_BUDGET)
+        )
+    outcomes = run_probes(probes, budget=DIAGNOSTIC_BUDGET, max_workers=DIAGNOSTIC_MAX_WORKERS)
+    
+    for (kind, model_name), outcome in outcomes.items():
+        if kind == "authentication":
+            outcome.setdefault("model", model_name)
+            results["authentication_test"] = outcome
+            continue
+        outcome.setdefault("url", table.endpoints[model_name])
+        for model_id in outcome.pop("models", []):
+            if model_id not in results["models_available"]:
+                results["models_available"].append(model_id)
+        results["endpoints_status"][model_name] = outcome
     
     # Vérifier l'état global
     if all(status["status"] == "ok" for status in results["endpoints_status"].values() if "status" in status):
@@ -1167,63 +2079,51 @@ async def diagnostic():
         
     return results
 
-@app.get("/api/endpoints/status")
-def endpoints_status():
+@app.get("/diagnostic")
+async def diagnostic():
     """
-    Endpoint qui vérifie l'état de tous les endpoints OVH en temps réel
-    et retourne un résumé de leur disponibilité.
+    Route de diagnostic qui teste explicitement la connexion à l'API OVH
+    et retourne les résultats détaillés pour comprendre le problème.
     """
+    return await cached_diagnostic("diagnostic", compute_diagnostic)
+
+def check_endpoint(endpoint_url, timeout):
+    """
+    Vérifie la disponibilité d'un endpoint et mesure son temps de réponse
+    """
+    test_url = f"{endpoint_url}/api/openai_compat/v1/models"
+    headers = {
+        "Authorization": f"Bearer {OVH_API_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    start_time = time.time()
+    response = requests.get(test_url, headers=headers, timeout=timeout)
+    elapsed_time = time.time() - start_time
+    return {
+        "url": endpoint_url,
+        "status_code": response.status_code,
+        "status": "ok" if response.status_code == 200 else "error",
+        "response_time_ms": round(elapsed_time * 1000)
+    }
+
+def compute_endpoints_status():
+    table = routing.current
     results = {
         "status": "ok",
         "timestamp": time.time(),
         "endpoints": {}
     }
     
-    # Fonction pour vérifier un endpoint
-    def check_endpoint(model_name, endpoint_url):
-        # Construire l'URL de test
-        test_url = f"{endpoint_url}/api/openai_compat/v1/models"
-        
-        # Préparer les headers
-        headers = {
-            "Authorization": f"Bearer {OVH_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        try:
-            # Utiliser requests pour les requêtes synchrones
-            start_time = time.time()
-            response = requests.get(test_url, headers=headers, timeout=5.0)
-            elapsed_time = time.time() - start_time
-            
-            return {
-                "model": model_name,
-                "url": endpoint_url,
-                "status_code": response.status_code,
-                "status": "ok" if response.status_code == 200 else "error",
-                "response_time_ms": round(elapsed_time * 1000)
-            }
-        except Exception as e:
-            return {
-                "model": model_name,
-                "url": endpoint_url,
-                "status": "error",
-                "error": str(e)
-            }
-    
-    # Vérifier chaque endpoint
-    for model_name, endpoint_url in endpoints.items():
-        try:
-            result = check_endpoint(model_name, endpoint_url)
-            model_name = result.pop("model", "unknown")
-            results["endpoints"][model_name] = result
-        except Exception as e:
-            logger.error(f"Erreur lors de la vérification de l'endpoint {model_name}: {str(e)}")
-            results["endpoints"][model_name] = {
-                "url": endpoint_url,
-                "status": "error",
-                "error": str(e)
-            }
+    probes = {
+        model_name: partial(check_endpoint, endpoint_url, min(5, DIAGNOSTIC_BUDGET))
+        for model_name, endpoint_url in table.endpoints.items()
+    }
+    for model_name, outcome in run_probes(probes, budget=DIAGNOSTIC_BUDGET, max_workers=DIAGNOSTIC_MAX_WORKERS).items():
+        if outcome["status"] != "ok":
+            logger.error(f"Erreur lors de la vérification de l'endpoint {model_name}: {outcome.get('error', outcome.get('status_code'))}")
+        outcome.setdefault("url", table.endpoints[model_name])
+        outcome["status"] = "ok" if outcome["status"] == "ok" else "error"
+        results["endpoints"][model_name] = outcome
     
     # Vérifier l'état global
     if not results["endpoints"]:
@@ -1235,4 +2135,225 @@ def endpoints_status():
         results["status"] = "partial"
         results["message"] = "Certains endpoints sont indisponibles"
     
-    return results
\ No newline at end of file
+    return results
+
+@app.get("/api/endpoints/status")
+async def endpoints_status():
+    """
+    Endpoint qui vérifie l'état de tous les endpoints OVH
+    et retourne un résumé de leur disponibilité.
+    """
+    return await cached_diagnostic("endpoints-status", compute_endpoints_status)
+
+@app.get("/admin/journal", dependencies=[Depends(require_admin)])
+async def admin_journal(
+    since: str = "24h",
+    until: str = None,
+    model: str = None,
+    endpoint: str = None,
+    route: str = None,
+    client_id: str = None,
+    status: str = None,
+    group_by: str = None,
+    limit: int = None,
+):
+    """
+    Interroge le journal des requêtes : agrégats par groupe, ou les `limit` derniers enregistrements
+    """
+    def run_query():
+        request_journal.flush()
+        return journal.query(
+            JOURNAL_DIR, since=since, until=until, group_by=group_by, limit=limit,
+            model=model, endpoint=endpoint, route=route, client_id=client_id, status=status,
+        )
+    
+    try:
+        return await run_in_threadpool(run_query)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+metrics.describe("proxy_tokens_total", "counter", "Tokens consommés par modèle servi (kind=prompt|completion, estimés si OVH ne les rapporte pas)")
+
+@app.get("/admin/usage", dependencies=[Depends(require_admin)])
+async def admin_usage(
+    since: str = "7d",
+    until: str = None,
+    group_by: str = "model",
+    granularity: str = None,
+    model: str = None,
+    endpoint: str = None,
+    client_id: str = None,
+):
+    """
+    Usage en tokens et coût estimé entre deux bornes, par combinaison de `group_by`
+    (model, endpoint, client_id, séparés par des virgules) et par heure ou jour si demandé
+    """
+    if usage_ledger is None:
+        raise HTTPException(status_code=404, detail="La comptabilité de l'usage est désactivée (USAGE_ENABLED).")
+    try:
+        return await run_in_threadpool(
+            usage_ledger.query, since=since, until=until, group_by=group_by, granularity=granularity,
+            model=model, endpoint=endpoint, client_id=client_id,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.get("/admin/routing", dependencies=[Depends(require_admin)])
+async def admin_routing():
+    """
+    Décrit la table de routage courante, l'état des pools de connexions et la santé des modèles
+    """
+    table = routing.current
+    return {
+        "version": table.version,
+        "source": table.source,
+        "last_error": routing.last_error,
+        "pools": upstream_pools.stats(),
+        "models": {
+            name: {
+                "upstream_name": route.upstream_name,
+                "context_length": route.context_length,
+                "weighted": route.weighted,
+                "endpoints": [{"url": target.url, "weight": target.weight} for target in route.targets],
+                "fallbacks": list(table.fallbacks.get(name, ())),
+            }
+            for name, route in table.models.items()
+        },
+        "model_groups": [list(group) for group in table.groups],
+        "auto_routing": {
+            "name": table.auto_policy.name,
+            "rules": [dict(rule._asdict(), classes=sorted(rule.classes) if rule.classes else None)
+                      for rule in table.auto_policy.rules],
+        } if table.auto_policy is not None else None,
+        "model_health": model_health.snapshot(),
+    }
+
+@app.get("/admin/models/discovery", dependencies=[Depends(require_admin)])
+async def admin_model_discovery():
+    """
+    État de la découverte des modèles : modèles découverts, erreurs du dernier rafraîchissement
+    """
+    return {"enabled": MODEL_DISCOVERY_ENABLED, **model_discovery.status()}
+
+@app.get("/admin/completion-stats", dependencies=[Depends(require_admin)])
+async def admin_completion_stats():
+    """
+    Distribution des longueurs générées par modèle, route et classe de requête, max_tokens appris
+    face à la valeur fixe, et durée de génération évitée dans le pire cas (au débit observé du modèle)
+    """
+    series = completion_stats.snapshot(static_max_tokens)
+    for entry in series:
+        tokens = metrics.get("proxy_upstream_generated_tokens_total", model=entry["model"])
+        seconds = metrics.get("proxy_upstream_generation_seconds_total", model=entry["model"])
+        rate = tokens / seconds if seconds else None
+        entry["tokens_per_second"] = round(rate, 1) if rate else None
+        learned = entry["learned_max_tokens"]
+        if learned is not None and rate:
+            entry["worst_case_seconds_saved"] = round(max(0, entry["static_max_tokens"] - learned) / rate, 1)
+    return {
+        "enabled": MAX_TOKENS_LEARNING,
+        "percentile": completion_stats.percentile,
+        "headroom": completion_stats.headroom,
+        "min_samples": completion_stats.min_samples,
+        "window": completion_stats.window,
+        "series": series,
+    }
+
+@app.get("/admin/api-keys", dependencies=[Depends(require_admin)])
+async def admin_list_api_keys():
+    """
+    Clés d'API (sans les secrets) avec leurs limites, requêtes en cours et usage cumulé
+    """
+    return {"enabled": API_KEYS_ENABLED, "keys": api_keys.describe()}
+
+@app.post("/admin/api-keys", dependencies=[Depends(require_admin)])
+async def admin_create_api_key(payload: dict = Depends(json_body)):
+    """
+    Crée une clé ({"id", "requests_per_minute", "tokens_per_minute", "max_concurrent"}) ;
+    la clé en clair n'est renvoyée qu'une seule fois
+    """
+    limits = {field: payload[field] for field in LIMIT_FIELDS if field in payload}
+    try:
+        secret, key = await run_in_threadpool(api_keys.create, payload.get("id"), **limits)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"key": secret, **key}
+
+@app.delete("/admin/api-keys/{key_id}", dependencies=[Depends(require_admin)])
+async def admin_delete_api_key(key_id: str):
+    if not await run_in_threadpool(api_keys.delete, key_id):
+        raise HTTPException(status_code=404, detail=f"Clé {key_id} introuvable.")
+    return {"deleted": key_id}
+
+@app.post("/admin/models/refresh", dependencies=[Depends(require_admin)])
+async def admin_refresh_models():
+    """
+    Relance immédiatement la découverte des modèles
+    """
+    updated = await run_in_threadpool(model_discovery.refresh)
+    return {"updated": updated, "version": routing.current.version, **model_discovery.status()}
+
+@app.get("/metrics", dependencies=[Depends(require_admin)])
+async def metrics_endpoint():
+    """
+    Métriques du proxy au format texte Prometheus
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/admin/routing/reload", dependencies=[Depends(require_admin)])
+async def admin_reload_routing():
+    """
+    Force le rechargement de endpoints_config.json ; l'ancienne table est conservée si la configuration est invalide
+    """
+    try:
+        await run_in_threadpool(routing.reload, True)
+    except RoutingConfigError as e:
+        raise HTTPException(status_code=422, detail=f"Configuration invalide: {str(e)}")
+    table = routing.current
+    return {"status": "ok", "version": table.version, "models": len(table.models)}
+
+def render_profile(profile, format):
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=422, detail=f"Format inconnu: {format} (attendu: {', '.join(PROFILE_FORMATS)})")
+    if format == "collapsed":
+        return PlainTextResponse(profile.collapsed(), headers={"x-proxy-profile-id": profile.id})
+    return FastJSONResponse(profile.speedscope(), headers={"x-proxy-profile-id": profile.id})
+
+@app.get("/debug/profile", dependencies=[Depends(require_admin)])
+async def debug_profile(seconds: float = 30, format: str = "speedscope", include_idle: bool = False):
+    """
+    Profile tout le processus pendant `seconds` secondes (échantillonnage des piles de tous les threads)
+    """
+    if not 0 < seconds <= 300:
+        raise HTTPException(status_code=422, detail="`seconds` doit être compris entre 0 et 300.")
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=422, detail=f"Format inconnu: {format} (attendu: {', '.join(PROFILE_FORMATS)})")
+    if not profile_store.acquire():
+        raise HTTPException(status_code=429, detail="Trop de profils en cours, réessayez plus tard.")
+    try:
+        sampler = StackSampler(f"processus {seconds:g} s", interval=PROFILE_INTERVAL, include_idle=include_idle).start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile = sampler.stop()
+    finally:
+        profile_store.release()
+    await run_in_threadpool(profile_store.add, profile)
+    return render_profile(profile, format)
+
+@app.get("/debug/profiles", dependencies=[Depends(require_admin)])
+async def debug_profiles():
+    """
+    Liste les derniers profils conservés (requêtes profilées et profils du processus)
+    """
+    return {"profiles": profile_store.list()}
+
+@app.get("/debug/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def debug_profile_result(profile_id: str, format: str = "speedscope"):
+    """
+    Retourne un profil conservé, au format speedscope ou en piles repliées
+    """
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profil {profile_id} introuvable.")
+    return render_profile(profile, format)
@@ -0,0 +1,153 @@
+"""
+Modèle virtuel `auto` : choix du modèle réel selon la requête et la charge
+
+Les utilisateurs choisissent un modèle 70B pour tout, y compris pour des
+questions d'une ligne qu'un modèle 7B/8B traite plus vite. Le modèle virtuel
+(`auto`, `auto:latest` dans OpenWebUI) est résolu à chaque requête par la
+politique `auto_routing` de la configuration du routage : les règles sont
+parcourues dans l'ordre et la première dont les conditions sont remplies
+choisit le modèle.
+
+Une règle peut exiger :
+- une classe de requête (`general`, `explain`, `code`, d'après les mots-clés
+  de l'analyseur) ;
+- une taille de prompt maximale (tokens estimés, sans tokenizer) ;
+- une charge maximale du modèle : requêtes en cours et p95 du délai avant le
+  premier token. Un modèle dont le disjoncteur est ouvert ou qui est limité
+  (429) est aussi écarté.
+
+Si aucune règle ne convient, la dernière règle de la politique est retenue.
+Chaque décision (caractéristiques de la requête, charge et verdict de chaque
+règle) est écrite avec le résultat de la requête dans un fichier JSONL, pour
+régler la politique hors ligne à partir du trafic réel.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    from proxy.context import estimator_for
+except ImportError:
+    from context import estimator_for
+
+# Champs du contexte de la requête ajoutés à la décision une fois la réponse envoyée
+OUTCOME_FIELDS = ("served_model", "status", "latency_ms", "upstream_ms", "ttft_ms", "prompt_tokens", "completion_tokens")
+
+def estimate_prompt_tokens(messages=None, text=None):
+    """
+    Taille estimée du prompt (messages de chat ou texte seul), avec l'estimateur générique :
+    le modèle qui traitera la requête n'est pas encore connu
+    """
+    estimator = estimator_for(None)
+    tokens = estimator.count(text) if isinstance(text, str) else 0
+    for message in messages or ():
+        tokens += estimator.count_message(message)
+    return tokens
+
+def choose_model(policy, health, prompt_tokens, request_class):
+    """
+    Applique la politique : retourne (modèle choisi, décision) où la décision décrit
+    le verdict de chaque règle examinée
+    """
+    steps = []
+    chosen = None
+    for rule in policy.rules:
+        in_flight, ttft_p95 = health.load(rule.model)
+        step = {"model": rule.model, "in_flight": in_flight, "ttft_p95": ttft_p95}
+        if rule.classes is not None and request_class not in rule.classes:
+            step["rejected"] = "class"
+        elif rule.max_prompt_tokens is not None and prompt_tokens > rule.max_prompt_tokens:
+            step["rejected"] = "prompt_size"
+        elif rule.max_in_flight is not None and in_flight >= rule.max_in_flight:
+            step["rejected"] = "in_flight"
+        elif rule.max_p95_seconds is not None and ttft_p95 is not None and ttft_p95 > rule.max_p95_seconds:
+            step["rejected"] = "p95_latency"
+        else:
+            step["rejected"] = health.unavailable(rule.model)
+        steps.append(step)
+        if step["rejected"] is None:
+            chosen = rule.model
+            break
+    decision = {
+        "estimated_prompt_tokens": prompt_tokens,
+        "request_class": request_class,
+        "rules": steps,
+        "chosen": chosen or policy.rules[-1].model,
+        "default": chosen is None,
+    }
+    return decision["chosen"], decision
+
+class DecisionLog:
+    """
+    Écrit les décisions du modèle `auto` dans un fichier JSONL, par lots, depuis un thread
+    dédié. Le fichier est renommé en `.1` lorsqu'il dépasse `max_bytes`.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, flush_interval=1.0, max_pending=10000):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        """Démarre le thread d'écriture en arrière-plan"""
+        if self._thread is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="auto-routing-log", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Arrête le thread d'écriture et vide la file"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def record(self, decision, ctx):
+        """Ajoute une décision et le résultat de la requête (contexte du journal) à la file"""
+        entry = dict(decision, timestamp=ctx.get("timestamp") or time.time(), route=ctx.get("route"))
+        for field in OUTCOME_FIELDS:
+            if ctx.get(field) is not None:
+                entry[field] = ctx[field]
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(entry)
+
+    def flush(self):
+        """Écrit immédiatement les décisions en attente"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        data = ("\n".join(json.dumps(entry, ensure_ascii=False) for entry in batch) + "\n").encode("utf-8")
+        try:
+            if self.path.stat().st_size + len(data) > self.max_bytes:
+                os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+        except FileNotFoundError:
+            pass
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erreur lors de l'écriture des décisions du modèle auto: {str(e)}")
@@ -0,0 +1,97 @@
+"""
+Banc d'essai de l'encodage JSON sur le chemin critique
+
+Compare, pour un historique OpenWebUI réaliste (~100 Ko), le coût JSON d'une
+requête de chat avant et après l'encodeur rapide :
+- avant : décodage par `json`, 4 `json.dumps` pour les logs, réencodage par
+  `requests` à chaque essai, rendu de la réponse par JSONResponse ;
+- après : décodage par `fastjson`, un seul encodage du corps réutilisé pour
+  tous les essais, rendu de la réponse par FastJSONResponse.
+
+Usage : python -m proxy.bench.json_codec [--size-kb 100] [--attempts 2] [--iterations 200]
+"""
+
+import argparse
+import json
+import random
+import time
+
+try:
+    from proxy import fastjson
+except ImportError:
+    import fastjson
+
+WORDS = ("le", "modèle", "réponse", "fonction", "données", "serveur", "requête", "contexte",
+         "déployer", "configuration", "très", "également", "paramètre", "résultat", "été")
+
+def build_history(size_kb, seed=42):
+    """
+    Construit une conversation d'environ `size_kb` Ko (texte français avec accents, tours alternés)
+    """
+    rng = random.Random(seed)
+    messages = [{"role": "system", "content": "Tu es un assistant intelligent."}]
+    size = 0
+    turn = 0
+    while size < size_kb * 1024:
+        role = "user" if turn % 2 == 0 else "assistant"
+        content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 400)))
+        messages.append({"role": role, "content": content})
+        size += len(content.encode("utf-8")) + 30
+        turn += 1
+    if messages[-1]["role"] != "user":
+        messages.append({"role": "user", "content": "Peux-tu résumer ?"})
+    return {"model": "mistral-7b-instruct-v0.3:latest", "messages": messages, "max_tokens": 500, "temperature": 0.7}
+
+def build_response(size_kb):
+    content = " ".join(WORDS[i % len(WORDS)] for i in range(size_kb * 100))
+    return {
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 1, "model": "Mistral-7B-Instruct-v0.3",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 25000, "completion_tokens": 500, "total_tokens": 25500},
+    }
+
+def legacy_path(raw_request, raw_response, attempts):
+    payload = json.loads(raw_request)
+    json.dumps(payload, ensure_ascii=False)[:500]
+    json.dumps(payload["messages"], ensure_ascii=False)[:500]
+    for _ in range(attempts):
+        json.dumps(payload, ensure_ascii=False)  # debug_log du payload
+        json.dumps(payload).encode("utf-8")      # requests(json=payload)
+    result = json.loads(raw_response)
+    json.dumps(result, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def fast_path(raw_request, raw_response, attempts):
+    payload = fastjson.loads(raw_request)
+    fastjson.preview(raw_request, 500)
+    body = fastjson.dumps(payload)
+    for _ in range(attempts):
+        fastjson.preview(body, 500)
+    result = fastjson.loads(raw_response)
+    fastjson.dumps(result)
+
+def measure(function, iterations, *args):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(*args)
+    return (time.perf_counter() - start) / iterations * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai de l'encodage JSON du proxy")
+    parser.add_argument("--size-kb", type=int, default=100, help="Taille de l'historique (Ko)")
+    parser.add_argument("--attempts", type=int, default=2, help="Nombre d'essais vers OVH par requête")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    raw_request = json.dumps(build_history(args.size_kb), ensure_ascii=False).encode("utf-8")
+    raw_response = json.dumps(build_response(8), ensure_ascii=False).encode("utf-8")
+    print(f"Requête: {len(raw_request) / 1024:.1f} Ko, réponse: {len(raw_response) / 1024:.1f} Ko, "
+          f"essais: {args.attempts}, backend: {fastjson.BACKEND}")
+
+    legacy_ms = measure(legacy_path, args.iterations, raw_request, raw_response, args.attempts)
+    fast_ms = measure(fast_path, args.iterations, raw_request, raw_response, args.attempts)
+    print(f"json standard : {legacy_ms:.3f} ms/requête")
+    print(f"fastjson      : {fast_ms:.3f} ms/requête")
+    print(f"gain          : x{legacy_ms / fast_ms:.1f}")
+
+if __name__ == "__main__":
+    main()
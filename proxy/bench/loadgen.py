@@ -0,0 +1,315 @@
+"""
+Générateur de charge pour le proxy
+
+Envoie des requêtes de chat à débit fixe (`--rps`, boucle ouverte : la
+latence est mesurée depuis l'instant prévu d'envoi, sans omission
+coordonnée) ou à concurrence fixe (`--concurrency`, boucle fermée), sur
+`/v1/chat/completions`, `/api/chat` ou `/api/generate`.
+
+Avec `--mock-url`, la même charge est d'abord envoyée directement au
+simulateur OVH : la différence de percentiles donne la latence ajoutée par
+le proxy. Avec `--proxy-pid`, le CPU et la mémoire (RSS) du proxy sont
+relevés pendant la mesure (Linux, /proc).
+
+Usage :
+    python -m proxy.bench.loadgen --url http://127.0.0.1:8000 --route chat-completions \\
+        --concurrency 32 --duration 30 --mock-url http://127.0.0.1:9100 --proxy-pid 12345
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from proxy.bench.json_codec import build_history
+except ImportError:
+    from json_codec import build_history
+
+ROUTES = {
+    "chat-completions": "/v1/chat/completions",
+    "api-chat": "/api/chat",
+    "api-generate": "/api/generate",
+}
+
+MOCK_CHAT_PATH = "/api/openai_compat/v1/chat/completions"
+
+def build_payload(route, model, history_kb=0, stream=False, max_tokens=64):
+    """
+    Corps de requête pour la route donnée (historique de `history_kb` Ko, ou une seule question)
+    """
+    if history_kb:
+        messages = build_history(history_kb)["messages"]
+    else:
+        messages = [
+            {"role": "system", "content": "Tu es un assistant intelligent."},
+            {"role": "user", "content": "Quelle est la capitale de la France ?"},
+        ]
+    if route == "api-generate":
+        prompt = "\n".join(message["content"] for message in messages if message["role"] == "user")
+        return {"model": model, "prompt": prompt, "max_tokens": max_tokens, "stream": stream}
+    payload = {"model": model, "messages": messages, "max_tokens": max_tokens}
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+class ProcessSampler:
+    """
+    Relève périodiquement le temps CPU et la mémoire résidente d'un processus (/proc)
+    """
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.rss_samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime et stime (champs 14 et 15 de /proc/<pid>/stat)
+        return (int(fields[11]) + int(fields[12])) / self.clock_ticks
+
+    def _rss_bytes(self):
+        with open(f"/proc/{self.pid}/statm") as f:
+            return int(f.read().split()[1]) * self.page_size
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.rss_samples.append(self._rss_bytes())
+            except OSError:
+                return
+
+    def __enter__(self):
+        self._start_wall = time.perf_counter()
+        self._start_cpu = self._cpu_seconds()
+        self.rss_samples.append(self._rss_bytes())
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.wall_seconds = time.perf_counter() - self._start_wall
+        self.cpu_seconds = self._cpu_seconds() - self._start_cpu
+        self.rss_samples.append(self._rss_bytes())
+
+    def summary(self):
+        return {
+            "cpu_percent": round(100 * self.cpu_seconds / self.wall_seconds, 1) if self.wall_seconds else None,
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "rss_mb_end": round(self.rss_samples[-1] / 1024 / 1024, 1),
+            "rss_mb_peak": round(max(self.rss_samples) / 1024 / 1024, 1),
+        }
+
+class LoadRun:
+    """
+    Une mesure : envoie la charge vers `url` pendant `duration` secondes et collecte les latences
+    """
+
+    def __init__(self, url, payload, duration=10.0, rps=None, concurrency=None, stream=False, timeout=120.0):
+        self.url = url
+        self.body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.duration = duration
+        self.rps = rps
+        self.concurrency = concurrency or (None if rps else 8)
+        self.stream = stream
+        self.timeout = timeout
+        self.latencies = []
+        self.ttfbs = []
+        self.statuses = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._local.session = session
+        return session
+
+    def _one(self, scheduled):
+        ttfb = None
+        try:
+            response = self._session().post(
+                self.url, data=self.body, headers={"Content-Type": "application/json"},
+                timeout=self.timeout, stream=self.stream,
+            )
+            if self.stream:
+                for _ in response.iter_content(chunk_size=None):
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - scheduled
+            else:
+                response.content
+            status = response.status_code
+            response.close()
+        except requests.exceptions.RequestException:
+            status = None
+        latency = time.perf_counter() - scheduled
+        with self._lock:
+            if status is None:
+                self.errors += 1
+                return
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 200:
+                self.latencies.append(latency)
+                if ttfb is not None:
+                    self.ttfbs.append(ttfb)
+
+    def run(self):
+        start = time.perf_counter()
+        deadline = start + self.duration
+        if self.rps:
+            # Boucle ouverte : les envois suivent le calendrier, même si le proxy ralentit
+            interval = 1.0 / self.rps
+            with ThreadPoolExecutor(max_workers=max(64, int(self.rps * 4))) as executor:
+                scheduled = start
+                while scheduled < deadline:
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    executor.submit(self._one, scheduled)
+                    scheduled += interval
+        else:
+            def worker():
+                while time.perf_counter() < deadline:
+                    self._one(time.perf_counter())
+            threads = [threading.Thread(target=worker, daemon=True) for _ in range(self.concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.elapsed = time.perf_counter() - start
+        return self
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        ttfbs = sorted(self.ttfbs)
+        result = {
+            "requests": sum(self.statuses.values()) + self.errors,
+            "ok": len(latencies),
+            "statuses": {str(code): count for code, count in sorted(self.statuses.items())},
+            "connection_errors": self.errors,
+            "throughput_rps": round(len(latencies) / self.elapsed, 2) if self.elapsed else None,
+        }
+        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            value = percentile(latencies, fraction)
+            result[f"latency_{name}_ms"] = round(value * 1000, 2) if value is not None else None
+            if ttfbs:
+                result[f"ttfb_{name}_ms"] = round(percentile(ttfbs, fraction) * 1000, 2)
+        return result
+
+def mock_payload(payload):
+    """
+    Traduit la requête envoyée au proxy en requête OpenAI directe vers le simulateur
+    """
+    if "prompt" in payload:
+        messages = [{"role": "user", "content": payload["prompt"]}]
+    else:
+        messages = payload["messages"]
+    direct = {"model": payload["model"], "messages": messages, "max_tokens": payload.get("max_tokens")}
+    if payload.get("stream"):
+        direct["stream"] = True
+    return direct
+
+def run_benchmark(url, route="chat-completions", model="mistral-7b-instruct-v0.3", duration=10.0,
+                  rps=None, concurrency=None, stream=False, history_kb=0, mock_url=None,
+                  proxy_pid=None, baseline_duration=None):
+    """
+    Mesure une route du proxy, avec la référence directe sur le simulateur si `mock_url` est fourni
+    """
+    payload = build_payload(route, model, history_kb=history_kb, stream=stream)
+    report = {
+        "route": ROUTES[route], "model": model, "stream": stream, "history_kb": history_kb,
+        "mode": f"{rps} req/s" if rps else f"concurrence {concurrency or 8}",
+    }
+
+    if mock_url:
+        baseline = LoadRun(
+            mock_url.rstrip("/") + MOCK_CHAT_PATH, mock_payload(payload),
+            duration=baseline_duration or duration, rps=rps, concurrency=concurrency, stream=stream,
+        ).run().summary()
+        report["baseline"] = baseline
+
+    load = LoadRun(url.rstrip("/") + ROUTES[route], payload, duration=duration, rps=rps, concurrency=concurrency, stream=stream)
+    if proxy_pid:
+        with ProcessSampler(proxy_pid) as sampler:
+            load.run()
+        report["process"] = sampler.summary()
+    else:
+        load.run()
+    report["proxy"] = load.summary()
+
+    if mock_url:
+        report["added_latency_ms"] = {
+            name: round(report["proxy"][f"latency_{name}_ms"] - report["baseline"][f"latency_{name}_ms"], 2)
+            for name in ("p50", "p95", "p99")
+            if report["proxy"][f"latency_{name}_ms"] is not None and report["baseline"][f"latency_{name}_ms"] is not None
+        }
+    return report
+
+def format_report(report):
+    proxy = report["proxy"]
+    lines = [
+        f"{report['route']} ({report['mode']}, stream={report['stream']}, historique={report['history_kb']} Ko)",
+        f"  requêtes: {proxy['requests']}, succès: {proxy['ok']}, statuts: {proxy['statuses']}, "
+        f"erreurs de connexion: {proxy['connection_errors']}",
+        f"  débit: {proxy['throughput_rps']} req/s",
+        f"  latence p50/p95/p99: {proxy['latency_p50_ms']} / {proxy['latency_p95_ms']} / {proxy['latency_p99_ms']} ms",
+    ]
+    if "ttfb_p50_ms" in proxy:
+        lines.append(f"  premier octet p50/p95/p99: {proxy['ttfb_p50_ms']} / {proxy['ttfb_p95_ms']} / {proxy['ttfb_p99_ms']} ms")
+    if "added_latency_ms" in report:
+        added = report["added_latency_ms"]
+        lines.append(f"  latence ajoutée p50/p95/p99: {added.get('p50')} / {added.get('p95')} / {added.get('p99')} ms")
+    if "process" in report:
+        process = report["process"]
+        lines.append(f"  proxy: CPU {process['cpu_percent']} %, RSS {process['rss_mb_end']} Mo (pic {process['rss_mb_peak']} Mo)")
+    return "\n".join(lines)
+
+def add_arguments(parser):
+    parser.add_argument("--route", choices=sorted(ROUTES), default="chat-completions")
+    parser.add_argument("--model", default="mistral-7b-instruct-v0.3")
+    parser.add_argument("--duration", type=float, default=10.0, help="Durée de la mesure (secondes)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--rps", type=float, help="Débit fixe (boucle ouverte)")
+    mode.add_argument("--concurrency", type=int, help="Nombre de clients simultanés (boucle fermée, 8 par défaut)")
+    parser.add_argument("--stream", action="store_true", help="Demander une réponse en flux")
+    parser.add_argument("--history-kb", type=int, default=0, help="Taille de l'historique envoyé (Ko)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Générateur de charge pour le proxy OVH LLM")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="URL du proxy")
+    parser.add_argument("--mock-url", help="URL du simulateur OVH, pour mesurer la latence ajoutée")
+    parser.add_argument("--proxy-pid", type=int, help="PID du proxy, pour relever CPU et RSS")
+    parser.add_argument("--json", action="store_true", help="Sortie JSON")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        args.url, route=args.route, model=args.model, duration=args.duration, rps=args.rps,
+        concurrency=args.concurrency, stream=args.stream, history_kb=args.history_kb,
+        mock_url=args.mock_url, proxy_pid=args.proxy_pid,
+    )
+    print(json.dumps(report, indent=2, ensure_ascii=False) if args.json else format_report(report))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Simulateur local de l'API OVH `openai_compat`
+
+Sert les routes utilisées par le proxy, sans réseau externe :
+- GET  /api/openai_compat/v1/models
+- POST /api/openai_compat/v1/chat/completions (JSON ou flux SSE)
+- POST /api/openai_compat/v1/completions
+
+Le comportement est configurable : distribution de la latence avant le
+premier octet, débit de génération des tokens, injection d'erreurs 429/5xx
+et requêtes à premier octet lent.
+
+Usage :
+    python -m proxy.bench.mock_ovh --port 9100 --latency-ms 200 --latency-dist lognormal \\
+        --tokens-per-second 80 --error-rate-429 0.01 --write-config /tmp/bench_endpoints.json
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from proxy.routing import DEFAULT_ENDPOINTS, DEFAULT_MODEL_NAME_MAP
+except ImportError:
+    from routing import DEFAULT_ENDPOINTS, DEFAULT_MODEL_NAME_MAP
+
+WORDS = ("le", "modèle", "répond", "avec", "des", "tokens", "simulés", "pour", "mesurer", "le", "proxy")
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+class MockSettings:
+    """
+    Paramètres du simulateur (partagés par tous les threads du serveur)
+    """
+
+    def __init__(self, latency_ms=100.0, latency_dist="fixed", latency_jitter_ms=0.0,
+                 tokens_per_second=0.0, completion_tokens=64, error_rate_429=0.0,
+                 error_rate_5xx=0.0, slow_ttfb_rate=0.0, slow_ttfb_ms=5000.0, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.latency_jitter_ms = latency_jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.slow_ttfb_rate = slow_ttfb_rate
+        self.slow_ttfb_ms = slow_ttfb_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "429": 0, "5xx": 0, "slow_ttfb": 0, "stream": 0}
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def draw(self):
+        """
+        Tire le sort d'une requête : (délai avant le premier octet en secondes, code d'erreur éventuel)
+        """
+        with self._lock:
+            rng = self._random
+            base = self.latency_ms
+            jitter = self.latency_jitter_ms
+            if self.latency_dist == "uniform":
+                latency = rng.uniform(base - jitter, base + jitter)
+            elif self.latency_dist == "normal":
+                latency = rng.gauss(base, jitter)
+            elif self.latency_dist == "lognormal":
+                # `latency_ms` est la médiane, `latency_jitter_ms` règle l'étalement de la queue
+                sigma = jitter / base if base > 0 else 0.0
+                latency = base * rng.lognormvariate(0.0, sigma)
+            elif self.latency_dist == "exponential":
+                latency = rng.expovariate(1.0 / base) if base > 0 else 0.0
+            else:
+                latency = base
+            slow = rng.random() < self.slow_ttfb_rate
+            draw = rng.random()
+        if slow:
+            latency += self.slow_ttfb_ms
+            self.count("slow_ttfb")
+        error = None
+        if draw < self.error_rate_429:
+            error = 429
+        elif draw < self.error_rate_429 + self.error_rate_5xx:
+            error = 503
+        return max(latency, 0.0) / 1000, error
+
+def completion_text(count):
+    return " ".join(WORDS[i % len(WORDS)] for i in range(count))
+
+class MockOVHHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockOVH/1.0"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, content, headers=None):
+        body = json.dumps(content, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/v1/models"):
+            models = [{"id": name, "object": "model", "max_model_len": 32768} for name in DEFAULT_MODEL_NAME_MAP.values()]
+            self._send_json(200, {"object": "list", "data": models})
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok", "counters": self.server.settings.counters})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        settings = self.server.settings
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+        if not self.path.endswith(("/chat/completions", "/completions")):
+            self._send_json(404, {"error": "not found"})
+            return
+        settings.count("requests")
+
+        ttfb, error = settings.draw()
+        time.sleep(ttfb)
+        if error == 429:
+            settings.count("429")
+            self._send_json(429, {"error": "Too Many Requests"}, headers={"Retry-After": "1"})
+            return
+        if error:
+            settings.count("5xx")
+            self._send_json(error, {"error": "Service Unavailable"})
+            return
+
+        model = request.get("model", "mock")
+        max_tokens = request.get("max_tokens") or settings.completion_tokens
+        tokens = max(1, min(settings.completion_tokens, int(max_tokens)))
+        prompt_tokens = length // 4
+        interval = 1.0 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+        is_chat = self.path.endswith("/chat/completions")
+
+        if request.get("stream"):
+            settings.count("stream")
+            self._stream(model, tokens, prompt_tokens, interval, is_chat)
+            return
+
+        time.sleep(interval * tokens)
+        text = completion_text(tokens)
+        choice = {"index": 0, "finish_reason": "stop"}
+        if is_chat:
+            choice["message"] = {"role": "assistant", "content": text}
+        else:
+            choice["text"] = text
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{int(time.time() * 1000)}",
+            "object": "chat.completion" if is_chat else "text_completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [choice],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens},
+        })
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _stream(self, model, tokens, prompt_tokens, interval, is_chat):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        created = int(time.time())
+        for i in range(tokens):
+            if interval:
+                time.sleep(interval)
+            word = WORDS[i % len(WORDS)] + " "
+            delta = {"index": 0, "finish_reason": None}
+            if is_chat:
+                delta["delta"] = {"content": word}
+            else:
+                delta["text"] = word
+            event = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model, "choices": [delta]}
+            self._write_chunk(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        final = {
+            "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens},
+        }
+        self._write_chunk(b"data: " + json.dumps(final).encode("utf-8") + b"\n\n")
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+class MockOVHServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, settings):
+        super().__init__(address, MockOVHHandler)
+        self.settings = settings
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def start_mock(host="127.0.0.1", port=0, settings=None):
+    """
+    Démarre le simulateur dans un thread et retourne le serveur (`server.url`, `server.shutdown()`)
+    """
+    server = MockOVHServer((host, port), settings or MockSettings())
+    threading.Thread(target=server.serve_forever, name="mock-ovh", daemon=True).start()
+    return server
+
+def write_endpoints_config(path, url):
+    """
+    Écrit un endpoints_config.json qui dirige tous les modèles par défaut vers le simulateur
+    (à utiliser avec ENDPOINTS_CONFIG_PATH)
+    """
+    config = {"endpoints": {name: url for name in DEFAULT_ENDPOINTS}}
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2)
+    return path
+
+def add_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Latence avant le premier octet (médiane pour lognormal)")
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="fixed")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0, help="Écart (uniform), écart-type (normal) ou étalement (lognormal)")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Débit de génération (0 = instantané)")
+    parser.add_argument("--completion-tokens", type=int, default=64, help="Nombre maximal de tokens générés par réponse")
+    parser.add_argument("--error-rate-429", type=float, default=0.0, help="Proportion de réponses 429")
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0, help="Proportion de réponses 503")
+    parser.add_argument("--slow-ttfb-rate", type=float, default=0.0, help="Proportion de requêtes à premier octet lent")
+    parser.add_argument("--slow-ttfb-ms", type=float, default=5000.0, help="Délai supplémentaire des requêtes lentes")
+    parser.add_argument("--seed", type=int, default=None)
+
+def settings_from_args(args):
+    return MockSettings(
+        latency_ms=args.latency_ms, latency_dist=args.latency_dist, latency_jitter_ms=args.latency_jitter_ms,
+        tokens_per_second=args.tokens_per_second, completion_tokens=args.completion_tokens,
+        error_rate_429=args.error_rate_429, error_rate_5xx=args.error_rate_5xx,
+        slow_ttfb_rate=args.slow_ttfb_rate, slow_ttfb_ms=args.slow_ttfb_ms, seed=args.seed,
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulateur local de l'API OVH openai_compat")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--write-config", help="Écrit un endpoints_config.json pointant vers le simulateur")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = MockOVHServer((args.host, args.port), settings_from_args(args))
+    if args.write_config:
+        write_endpoints_config(args.write_config, server.url)
+        print(f"Configuration des endpoints écrite dans {args.write_config}")
+    print(f"Simulateur OVH en écoute sur {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Compteurs: {json.dumps(server.settings.counters)}")
+
+if __name__ == "__main__":
+    main()
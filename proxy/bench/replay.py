@@ -0,0 +1,279 @@
+"""
+Rejeu d'une capture de trafic, en respectant les intervalles d'arrivée d'origine
+
+Lit un fichier produit par la capture du proxy (CAPTURE_ENABLED=true) et
+renvoie chaque requête à l'instant où elle était arrivée, divisé par
+`--speed`. Le rejeu se fait en boucle ouverte : la latence est mesurée
+depuis l'instant prévu d'envoi, même si le proxy prend du retard.
+
+Avec `--build`, chaque copie du dépôt indiquée est démarrée à tour de rôle
+devant le simulateur OVH local (mêmes paramètres, même graine), puis les
+profils de latence et d'erreurs des deux premières sont comparés.
+
+Usage :
+    python -m proxy.bench.replay --capture /tmp/proxy_capture.jsonl --proxy http://127.0.0.1:8000
+    python -m proxy.bench.replay --capture prod.jsonl --speed 4 --build /src/proxy-main --build /src/proxy-branche \\
+        --latency-dist lognormal --latency-ms 300 --latency-jitter-ms 150 --seed 1
+"""
+
+import argparse
+import json
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from proxy.bench import mock_ovh, run
+    from proxy.bench.loadgen import percentile
+    from proxy.capture import read_capture
+except ImportError:
+    import mock_ovh
+    import run
+    from loadgen import percentile
+    from capture import read_capture
+
+def load_capture(path, routes=None, limit=None):
+    """
+    Charge les requêtes capturées, triées par horodatage, avec leur décalage depuis la première
+    """
+    records = [
+        record for record in read_capture(path)
+        if isinstance(record.get("payload"), dict) and record.get("route")
+        and (not routes or record["route"] in routes)
+    ]
+    records.sort(key=lambda record: record["timestamp"])
+    if limit:
+        records = records[:limit]
+    if records:
+        first = records[0]["timestamp"]
+        for record in records:
+            record["offset"] = record["timestamp"] - first
+    return records
+
+def error_rate(statuses, connection_errors, total):
+    if not total:
+        return None
+    failed = connection_errors + sum(count for status, count in statuses.items() if int(status) >= 400)
+    return round(failed / total, 4)
+
+def latency_profile(latencies_ms):
+    values = sorted(latency for latency in latencies_ms if latency is not None)
+    return {f"{name}_ms": (round(percentile(values, fraction), 2) if values else None)
+            for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+
+def capture_profile(records):
+    """
+    Profil d'origine (vu en production) de chaque route de la capture
+    """
+    by_route = {}
+    for record in records:
+        by_route.setdefault(record["route"], []).append(record)
+    profile = {}
+    for route, items in sorted(by_route.items()):
+        statuses = {}
+        for record in items:
+            key = str(record.get("status"))
+            statuses[key] = statuses.get(key, 0) + 1
+        profile[route] = {
+            "requests": len(items),
+            "statuses": statuses,
+            "error_rate": error_rate({s: c for s, c in statuses.items() if s.isdigit()}, 0, len(items)),
+            "latency": latency_profile(record.get("client_ms") for record in items),
+            "upstream": latency_profile(record.get("upstream_ms") for record in items),
+        }
+    return profile
+
+class Replay:
+    """
+    Un rejeu de la capture vers le proxy `url`
+    """
+
+    def __init__(self, url, records, speed=1.0, timeout=120.0, max_workers=256):
+        self.url = url.rstrip("/")
+        self.records = records
+        self.speed = speed
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.results = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._local.session = session
+        return session
+
+    def _one(self, record, scheduled):
+        payload = record["payload"]
+        stream = bool(payload.get("stream"))
+        try:
+            response = self._session().request(
+                record.get("method") or "POST", self.url + record["route"],
+                data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                headers={"Content-Type": "application/json"}, timeout=self.timeout, stream=stream,
+            )
+            if stream:
+                for _ in response.iter_content(chunk_size=None):
+                    pass
+            else:
+                response.content
+            status = response.status_code
+            response.close()
+        except requests.exceptions.RequestException:
+            status = None
+        latency_ms = (time.perf_counter() - scheduled) * 1000
+        with self._lock:
+            result = self.results.setdefault(record["route"], {"latencies": [], "statuses": {}, "errors": 0})
+            if status is None:
+                result["errors"] += 1
+                return
+            result["statuses"][status] = result["statuses"].get(status, 0) + 1
+            if status < 400:
+                result["latencies"].append(latency_ms)
+
+    def run(self):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for record in self.records:
+                scheduled = start + record["offset"] / self.speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self._one, record, scheduled)
+        self.elapsed = time.perf_counter() - start
+        return self
+
+    def summary(self):
+        routes = {}
+        for route, result in sorted(self.results.items()):
+            total = sum(result["statuses"].values()) + result["errors"]
+            statuses = {str(code): count for code, count in sorted(result["statuses"].items())}
+            routes[route] = {
+                "requests": total,
+                "statuses": statuses,
+                "connection_errors": result["errors"],
+                "error_rate": error_rate(statuses, result["errors"], total),
+                "latency": latency_profile(result["latencies"]),
+            }
+        return {"url": self.url, "speed": self.speed, "elapsed_s": round(self.elapsed, 2), "routes": routes}
+
+def diff_reports(before, after):
+    """
+    Écarts de latence (ms) et de taux d'erreur, route par route, entre deux rejeux
+    """
+    diff = {}
+    for route in sorted(set(before["routes"]) | set(after["routes"])):
+        a = before["routes"].get(route)
+        b = after["routes"].get(route)
+        if a is None or b is None:
+            diff[route] = {"missing_in": "before" if a is None else "after"}
+            continue
+        entry = {
+            name: round(b["latency"][name] - a["latency"][name], 2)
+            for name in ("p50_ms", "p95_ms", "p99_ms")
+            if a["latency"][name] is not None and b["latency"][name] is not None
+        }
+        if a["error_rate"] is not None and b["error_rate"] is not None:
+            entry["error_rate"] = round(b["error_rate"] - a["error_rate"], 4)
+        diff[route] = entry
+    return diff
+
+def format_summary(label, summary):
+    lines = [f"{label} ({summary['url']}, vitesse x{summary['speed']}, {summary['elapsed_s']} s)"]
+    for route, result in summary["routes"].items():
+        latency = result["latency"]
+        lines.append(
+            f"  {route}: {result['requests']} requêtes, statuts: {result['statuses']}, "
+            f"erreurs de connexion: {result['connection_errors']}, taux d'erreur: {result['error_rate']}"
+        )
+        lines.append(f"    latence p50/p95/p99: {latency['p50_ms']} / {latency['p95_ms']} / {latency['p99_ms']} ms")
+    return "\n".join(lines)
+
+def format_diff(diff):
+    lines = ["Écarts (après - avant)"]
+    for route, entry in diff.items():
+        if "missing_in" in entry:
+            lines.append(f"  {route}: absente du rejeu '{entry['missing_in']}'")
+            continue
+        lines.append(
+            f"  {route}: p50 {entry.get('p50_ms')} ms, p95 {entry.get('p95_ms')} ms, p99 {entry.get('p99_ms')} ms, "
+            f"taux d'erreur {entry.get('error_rate')}"
+        )
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rejeu d'une capture de trafic vers le proxy OVH LLM")
+    parser.add_argument("--capture", required=True, help="Fichier JSONL produit par la capture du proxy")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--proxy", action="append", help="URL d'un proxy déjà démarré (répétable)")
+    target.add_argument("--build", action="append", help="Copie du dépôt à démarrer devant le simulateur (répétable)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Facteur d'accélération des intervalles d'arrivée")
+    parser.add_argument("--routes", help="Routes à rejouer, séparées par des virgules (toutes par défaut)")
+    parser.add_argument("--limit", type=int, help="Nombre maximal de requêtes rejouées")
+    parser.add_argument("--mock-port", type=int, default=0)
+    parser.add_argument("--json", help="Écrit le rapport complet dans ce fichier JSON")
+    mock_ovh.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.speed <= 0:
+        parser.error("--speed doit être strictement positif")
+
+    routes = {route.strip() for route in args.routes.split(",") if route.strip()} if args.routes else None
+    records = load_capture(args.capture, routes=routes, limit=args.limit)
+    if not records:
+        parser.error(f"Aucune requête exploitable dans {args.capture}")
+    span = records[-1]["offset"]
+    print(f"{len(records)} requêtes capturées sur {span:.1f} s, rejouées en {span / args.speed:.1f} s")
+
+    report = {"capture": args.capture, "original": capture_profile(records), "runs": []}
+    if args.proxy:
+        for url in args.proxy:
+            summary = Replay(url, records, speed=args.speed).run().summary()
+            report["runs"].append(summary)
+            print(format_summary(url, summary))
+    else:
+        mock = mock_ovh.start_mock(port=args.mock_port, settings=mock_ovh.settings_from_args(args))
+        workdir = Path(tempfile.mkdtemp(prefix="proxy_replay_"))
+        config_path = mock_ovh.write_endpoints_config(workdir / "endpoints_config.json", mock.url)
+        print(f"Simulateur OVH: {mock.url} (configuration: {config_path})")
+        try:
+            for index, build in enumerate(args.build):
+                # Chaque version voit le même simulateur, avec la même suite de tirages
+                mock.settings = mock_ovh.settings_from_args(args)
+                build_dir = workdir / f"build{index}"
+                build_dir.mkdir()
+                process, url = run.start_proxy(config_path, run.free_port(), build_dir,
+                                               repo_root=Path(build).resolve())
+                try:
+                    summary = Replay(url, records, speed=args.speed).run().summary()
+                finally:
+                    process.terminate()
+                    try:
+                        process.wait(timeout=10)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                summary["build"] = build
+                summary["mock_counters"] = dict(mock.settings.counters)
+                report["runs"].append(summary)
+                print(format_summary(build, summary))
+        finally:
+            mock.shutdown()
+
+    if len(report["runs"]) >= 2:
+        report["diff"] = diff_reports(report["runs"][0], report["runs"][1])
+        print(format_diff(report["diff"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Rapport écrit dans {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Suite de bancs d'essai hors ligne : simulateur OVH + proxy + générateur de charge
+
+Démarre le simulateur OVH dans ce processus, lance le proxy (uvicorn) dans
+un sous-processus configuré pour n'utiliser que le simulateur
+(ENDPOINTS_CONFIG_PATH), puis mesure chaque route demandée. Tout tourne en
+local, sans accès à OVH.
+
+Usage :
+    python -m proxy.bench.run --duration 20 --concurrency 16
+    python -m proxy.bench.run --routes chat-completions --stream --tokens-per-second 50 --rps 20
+    python -m proxy.bench.run --latency-dist lognormal --latency-ms 300 --latency-jitter-ms 150 --error-rate-429 0.02
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+try:
+    from proxy.bench import loadgen, mock_ovh
+except ImportError:
+    import loadgen
+    import mock_ovh
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def proxy_environment(config_path, workdir, extra_env=None):
+    """
+    Variables d'environnement d'un proxy de banc d'essai (endpoints vers le simulateur)
+    """
+    env = dict(os.environ)
+    env.update({
+        "ENDPOINTS_CONFIG_PATH": str(config_path),
+        "OVH_TOKEN_ENDPOINT": env.get("OVH_TOKEN_ENDPOINT", "bench-token"),
+        "JOURNAL_DIR": str(Path(workdir) / "journal"),
+        "PYTHONUNBUFFERED": "1",
+    })
+    env.update(extra_env or {})
+    return env
+
+def start_proxy(config_path, port, workdir, extra_env=None, repo_root=REPO_ROOT):
+    """
+    Lance le proxy (celui du dépôt `repo_root`) dans un sous-processus et attend qu'il réponde sur /health
+    """
+    env = proxy_environment(config_path, workdir, extra_env)
+    log = open(Path(workdir) / "proxy.log", "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "proxy.app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=repo_root, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Le proxy s'est arrêté au démarrage (voir {log.name})")
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return process, url
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Le proxy n'a pas démarré en 30 secondes (voir {log.name})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bancs d'essai hors ligne du proxy OVH LLM")
+    parser.add_argument("--routes", default="chat-completions,api-chat,api-generate",
+                        help="Routes à mesurer, séparées par des virgules")
+    parser.add_argument("--proxy-url", help="Mesurer un proxy déjà démarré (doit pointer vers le simulateur)")
+    parser.add_argument("--mock-port", type=int, default=0)
+    parser.add_argument("--warmup", type=float, default=2.0, help="Durée de chauffe avant chaque mesure (secondes)")
+    parser.add_argument("--json", help="Écrit le rapport complet dans ce fichier JSON")
+    loadgen.add_arguments(parser)
+    mock_ovh.add_arguments(parser)
+    parser.set_defaults(route=None)
+    args = parser.parse_args(argv)
+
+    routes = [route.strip() for route in args.routes.split(",") if route.strip()]
+    unknown = [route for route in routes if route not in loadgen.ROUTES]
+    if unknown:
+        parser.error(f"Routes inconnues: {', '.join(unknown)}")
+
+    mock = mock_ovh.start_mock(port=args.mock_port, settings=mock_ovh.settings_from_args(args))
+    workdir = tempfile.mkdtemp(prefix="proxy_bench_")
+    config_path = mock_ovh.write_endpoints_config(Path(workdir) / "endpoints_config.json", mock.url)
+    print(f"Simulateur OVH: {mock.url} (configuration: {config_path})")
+
+    process = None
+    try:
+        if args.proxy_url:
+            proxy_url, proxy_pid = args.proxy_url, None
+        else:
+            process, proxy_url = start_proxy(config_path, free_port(), workdir)
+            proxy_pid = process.pid
+            print(f"Proxy: {proxy_url} (PID {proxy_pid}, logs: {workdir}/proxy.log)")
+
+        reports = []
+        for route in routes:
+            if args.warmup:
+                loadgen.run_benchmark(proxy_url, route=route, model=args.model, duration=args.warmup,
+                                      concurrency=2, stream=args.stream, history_kb=args.history_kb)
+            report = loadgen.run_benchmark(
+                proxy_url, route=route, model=args.model, duration=args.duration, rps=args.rps,
+                concurrency=args.concurrency, stream=args.stream, history_kb=args.history_kb,
+                mock_url=mock.url, proxy_pid=proxy_pid,
+            )
+            reports.append(report)
+            print(loadgen.format_report(report))
+        print(f"Compteurs du simulateur: {json.dumps(mock.settings.counters)}")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"mock": vars(args), "reports": reports}, f, indent=2, ensure_ascii=False)
+            print(f"Rapport écrit dans {args.json}")
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        mock.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Banc d'essai du démarrage à froid du proxy
+
+Démarre le simulateur OVH, puis lance plusieurs fois le proxy (uvicorn) dans
+un sous-processus et mesure, depuis le lancement du processus :
+
+- le temps avant que /health/live réponde (processus vivant),
+- le temps avant que /health/ready réponde 200 (configuration chargée,
+  connexions pré-ouvertes si UPSTREAM_PREWARM),
+- le temps avant la première requête de chat réussie.
+
+Le temps d'import de `proxy.app` est mesuré à part, dans un processus neuf.
+
+Usage :
+    python -m proxy.bench.startup --runs 5
+    python -m proxy.bench.startup --runs 5 --prewarm --latency-ms 50 --json startup.json
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+try:
+    from proxy.bench import loadgen, mock_ovh
+    from proxy.bench.run import REPO_ROOT, free_port, proxy_environment
+except ImportError:
+    import loadgen
+    import mock_ovh
+    from run import REPO_ROOT, free_port, proxy_environment
+
+METRICS = ("import_seconds", "live_seconds", "ready_seconds", "first_request_seconds")
+
+def measure_import(env, repo_root=REPO_ROOT):
+    """Temps d'import de proxy.app (secondes), dans un processus Python neuf"""
+    code = "import time; t = time.perf_counter(); import proxy.app; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=repo_root, env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+def measure_start(env, route="chat-completions", model="mistral-7b-instruct-v0.3", timeout=60.0,
+                  poll_interval=0.005, log_path=None, repo_root=REPO_ROOT):
+    """
+    Lance le proxy et mesure le temps jusqu'à la vivacité, la disponibilité et la première requête réussie
+    """
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    payload = loadgen.build_payload(route, model)
+    log = open(log_path, "w") if log_path else subprocess.DEVNULL
+    session = requests.Session()
+    result = {name: None for name in METRICS if name != "import_seconds"}
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "proxy.app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=repo_root, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        while None in result.values():
+            elapsed = time.perf_counter() - start
+            if elapsed > timeout:
+                raise RuntimeError(f"Démarrage incomplet après {timeout:g} secondes: {result}")
+            if process.poll() is not None:
+                raise RuntimeError("Le proxy s'est arrêté au démarrage")
+            try:
+                if result["live_seconds"] is None:
+                    if session.get(f"{url}/health/live", timeout=1).status_code == 200:
+                        result["live_seconds"] = time.perf_counter() - start
+                    else:
+                        time.sleep(poll_interval)
+                    continue
+                if result["first_request_seconds"] is None:
+                    response = session.post(f"{url}{loadgen.ROUTES[route]}", json=payload, timeout=timeout)
+                    if response.status_code == 200:
+                        result["first_request_seconds"] = time.perf_counter() - start
+                if result["ready_seconds"] is None:
+                    if session.get(f"{url}/health/ready", timeout=1).status_code == 200:
+                        result["ready_seconds"] = time.perf_counter() - start
+                    else:
+                        time.sleep(poll_interval)
+            except requests.exceptions.RequestException:
+                time.sleep(poll_interval)
+        return result
+    finally:
+        session.close()
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if log_path:
+            log.close()
+
+def summarize(runs):
+    """Médiane, minimum et maximum de chaque mesure (secondes)"""
+    summary = {}
+    for name in METRICS:
+        values = [run[name] for run in runs if run.get(name) is not None]
+        if values:
+            summary[name] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+    return summary
+
+def format_summary(summary, runs):
+    labels = {
+        "import_seconds": "Import de proxy.app",
+        "live_seconds": "Vivant (/health/live)",
+        "ready_seconds": "Prêt (/health/ready)",
+        "first_request_seconds": "Première requête réussie",
+    }
+    lines = [f"Démarrage à froid ({runs} lancements), en millisecondes :"]
+    for name in METRICS:
+        if name in summary:
+            values = summary[name]
+            lines.append(f"  {labels[name]:<26} médiane {values['median'] * 1000:8.1f}   "
+                         f"min {values['min'] * 1000:8.1f}   max {values['max'] * 1000:8.1f}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Temps de démarrage à froid du proxy OVH LLM")
+    parser.add_argument("--runs", type=int, default=5, help="Nombre de lancements du proxy")
+    parser.add_argument("--route", choices=sorted(loadgen.ROUTES), default="chat-completions")
+    parser.add_argument("--model", default="mistral-7b-instruct-v0.3")
+    parser.add_argument("--prewarm", action="store_true", help="Active UPSTREAM_PREWARM dans le proxy")
+    parser.add_argument("--mock-port", type=int, default=0)
+    parser.add_argument("--json", help="Écrit les mesures brutes et le résumé dans ce fichier JSON")
+    mock_ovh.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    mock = mock_ovh.start_mock(port=args.mock_port, settings=mock_ovh.settings_from_args(args))
+    workdir = tempfile.mkdtemp(prefix="proxy_startup_")
+    config_path = mock_ovh.write_endpoints_config(Path(workdir) / "endpoints_config.json", mock.url)
+    print(f"Simulateur OVH: {mock.url} (configuration: {config_path})")
+    env = proxy_environment(config_path, workdir, {
+        "UPSTREAM_PREWARM": "true" if args.prewarm else "false",
+        # Chaque lancement repart sans instantané de la découverte des modèles
+        "MODEL_SNAPSHOT_PATH": str(Path(workdir) / "models_snapshot.json"),
+        "MODEL_DISCOVERY_ENABLED": "false",
+    })
+
+    runs = []
+    try:
+        for index in range(args.runs):
+            run = {"import_seconds": measure_import(env)}
+            run.update(measure_start(env, route=args.route, model=args.model,
+                                     log_path=Path(workdir) / f"proxy_{index}.log"))
+            runs.append(run)
+            print(f"Lancement {index + 1}: " + ", ".join(f"{name}={value * 1000:.1f} ms" for name, value in run.items()))
+    finally:
+        mock.shutdown()
+
+    summary = summarize(runs)
+    print(format_summary(summary, len(runs)))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "runs": runs, "summary": summary}, f, indent=2, ensure_ascii=False)
+        print(f"Rapport écrit dans {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Annulation des appels OVH quand le client se déconnecte
+
+Un utilisateur qui arrête une génération dans OpenWebUI (ou ferme l'onglet)
+coupe sa connexion : la réponse d'OVH ne servira plus à personne. Chaque
+requête reçoit un `CancelToken`, visible des threads du pool via une
+ContextVar. Les connexions HTTP vers OVH ouvertes sous ce jeton y sont
+rattachées le temps de l'appel : annuler le jeton ferme leur socket, ce qui
+débloque immédiatement le thread en attente et interrompt la génération
+côté OVH. La connexion fermée n'est pas remise dans le pool.
+"""
+
+import asyncio
+import contextvars
+import socket
+import threading
+import time
+
+from fastapi import HTTPException
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Jeton de la requête en cours (copié dans les threads par run_in_threadpool)
+current_token = contextvars.ContextVar("cancel_token", default=None)
+
+class ClientDisconnected(HTTPException):
+    """Le client s'est déconnecté avant la fin de la réponse (499, convention nginx)"""
+
+    def __init__(self):
+        super().__init__(status_code=499, detail="Requête annulée: le client s'est déconnecté.")
+
+class CancelToken:
+    """
+    Jeton d'annulation d'une requête : ferme les sockets OVH qui y sont rattachés
+    """
+
+    def __init__(self):
+        self.reason = None
+        self._sockets = set()
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def cancel(self, reason="client_disconnect"):
+        """Annule la requête ; retourne False si elle l'était déjà"""
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            sockets, self._sockets = self._sockets, set()
+        self._cancelled.set()
+        for sock in sockets:
+            _shutdown(sock)
+        return True
+
+    def wait(self, timeout):
+        """Attend `timeout` secondes ou l'annulation ; retourne True si la requête est annulée"""
+        return self._cancelled.wait(timeout)
+
+    def attach(self, sock):
+        with self._lock:
+            if self.reason is None:
+                self._sockets.add(sock)
+                return
+        # Annulé avant même l'envoi de la réponse par OVH
+        _shutdown(sock)
+
+    def detach_all(self):
+        """Appelé à la fin d'un appel : la connexion retourne au pool, elle ne doit plus être fermée"""
+        with self._lock:
+            self._sockets.clear()
+
+def raise_if_cancelled():
+    """Lève ClientDisconnected si le jeton courant est annulé (avant un nouvel essai)"""
+    token = current_token.get()
+    if token is not None and token.cancelled:
+        raise ClientDisconnected()
+
+def backoff(seconds):
+    """
+    Attente entre deux essais dans un thread du pool : interrompue dès l'annulation
+    du jeton courant, auquel cas ClientDisconnected est levée
+    """
+    token = current_token.get()
+    if token is None:
+        time.sleep(seconds)
+    elif token.wait(seconds):
+        raise ClientDisconnected()
+
+def _shutdown(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+def _attach_current(connection):
+    token = current_token.get()
+    if token is not None and connection.sock is not None:
+        token.attach(connection.sock)
+
+class _CancellableHTTPConnection(HTTPConnection):
+    def getresponse(self, *args, **kwargs):
+        _attach_current(self)
+        return super().getresponse(*args, **kwargs)
+
+class _CancellableHTTPSConnection(HTTPSConnection):
+    def getresponse(self, *args, **kwargs):
+        _attach_current(self)
+        return super().getresponse(*args, **kwargs)
+
+class _CancellableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CancellableHTTPConnection
+
+class _CancellableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CancellableHTTPSConnection
+
+class CancellableAdapter(HTTPAdapter):
+    """
+    Adaptateur `requests` dont les connexions se rattachent au jeton d'annulation courant
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CancellableHTTPConnectionPool,
+            "https": _CancellableHTTPSConnectionPool,
+        }
+
+async def wait_for_disconnect(receive):
+    """Attend le message ASGI `http.disconnect` (le corps de la requête doit déjà être lu)"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def call_until_disconnect(receive, token, func, *args, **kwargs):
+    """
+    Exécute `func` dans le pool de threads sous le jeton `token`. Si le client se
+    déconnecte avant la fin, le jeton est annulé (les sockets OVH sont fermés), on
+    attend que le thread se libère puis `ClientDisconnected` est levée.
+    """
+    reset = current_token.set(token)
+    try:
+        work = asyncio.ensure_future(run_in_threadpool(func, *args, **kwargs))
+    finally:
+        current_token.reset(reset)
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        # Arrêt du serveur (échéance de vidange) : l'appel OVH est interrompu lui aussi
+        token.cancel("shutdown")
+        raise
+    finally:
+        watcher.cancel()
+    if not work.done():
+        token.cancel("client_disconnect")
+        try:
+            await work
+        except Exception:
+            pass
+        raise ClientDisconnected()
+    return work.result()
+
+async def _cancel_on_disconnect(receive, token):
+    await wait_for_disconnect(receive)
+    token.cancel("client_disconnect")
+
+async def cancellable_stream(receive, token, iterator, on_cancel=None):
+    """
+    Transmet un flux SSE synchrone (lu dans le pool de threads). Dès que le client se
+    déconnecte, le jeton est annulé : le socket OVH est fermé sans attendre le morceau
+    suivant. `on_cancel(events)` reçoit le nombre d'événements `data:` déjà transmis.
+    """
+    watcher = asyncio.ensure_future(_cancel_on_disconnect(receive, token))
+    events = 0
+    try:
+        async for chunk in iterate_in_threadpool(iterator):
+            events += chunk.count(b"data:")
+            yield chunk
+    except asyncio.CancelledError:
+        token.cancel("shutdown" if not watcher.done() else "client_disconnect")
+        raise
+    except Exception:
+        # Erreur de lecture provoquée par la fermeture du socket : fin normale du flux annulé
+        if not token.cancelled:
+            raise
+    finally:
+        watcher.cancel()
+        if token.cancelled and on_cancel is not None:
+            on_cancel(events)
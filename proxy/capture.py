@@ -0,0 +1,221 @@
+"""
+Capture optionnelle du trafic LLM au format JSONL
+
+Chaque requête capturée produit une ligne JSON : horodatage, route, statut,
+corps de la requête nettoyé, durée vue par le client et latence amont. Le
+fichier sert d'entrée à l'outil de rejeu (`python -m proxy.bench.replay`).
+
+Le nettoyage a lieu dans le thread d'écriture, jamais pendant la requête :
+le contenu des messages est remplacé par un texte de même longueur (sauf
+avec `keep_content`), et les champs d'identification sont retirés.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+try:
+    from proxy import fastjson
+    from proxy.middleware import request_context
+except ImportError:
+    import fastjson
+    from middleware import request_context
+
+# Champs retirés du corps capturé (identifiants et secrets éventuels)
+SENSITIVE_FIELDS = frozenset({"user", "api_key", "authorization", "token", "metadata"})
+
+_FILLER = "lorem ipsum dolor sit amet "
+
+def _filler(text):
+    # Même longueur (en caractères) et même découpage en mots que le texte d'origine
+    if not text:
+        return text
+    repeated = _FILLER * (len(text) // len(_FILLER) + 1)
+    return repeated[:len(text)]
+
+def sanitize_payload(payload, keep_content=False):
+    """
+    Retire les champs sensibles et masque le contenu des messages en conservant leur taille
+    """
+    if not isinstance(payload, dict):
+        return payload
+    clean = {key: value for key, value in payload.items() if key.lower() not in SENSITIVE_FIELDS}
+    if keep_content:
+        return clean
+    if isinstance(clean.get("messages"), list):
+        messages = []
+        for message in clean["messages"]:
+            if not isinstance(message, dict):
+                continue
+            message = dict(message)
+            content = message.get("content")
+            if isinstance(content, str):
+                message["content"] = _filler(content)
+            elif isinstance(content, list):
+                message["content"] = [
+                    dict(part, text=_filler(part["text"])) if isinstance(part, dict) and isinstance(part.get("text"), str)
+                    else {"type": part.get("type")} if isinstance(part, dict) else part
+                    for part in content
+                ]
+            message.pop("name", None)
+            messages.append(message)
+        clean["messages"] = messages
+    for field in ("prompt", "system"):
+        if isinstance(clean.get(field), str):
+            clean[field] = _filler(clean[field])
+    return clean
+
+class TrafficCapture:
+    """
+    Écrit les requêtes capturées dans un fichier JSONL, par lots, depuis un thread dédié.
+    Le fichier est renommé en `.1` lorsqu'il dépasse `max_bytes`.
+    """
+
+    def __init__(self, path, sample_rate=1.0, keep_content=False, max_bytes=256 * 1024 * 1024,
+                 flush_interval=1.0, max_pending=10000):
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.keep_content = keep_content
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        """Démarre le thread d'écriture en arrière-plan"""
+        if self._thread is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Arrête le thread d'écriture et vide la file"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def sampled(self):
+        """Indique si la requête courante doit être capturée"""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, body, **fields):
+        """Ajoute une requête à la file (corps brut, décodé et nettoyé plus tard)"""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                # Le disque ne suit pas : mieux vaut perdre des captures que de la mémoire
+                self.dropped += 1
+                return
+            self._pending.append((body, fields))
+
+    def flush(self):
+        """Écrit immédiatement les captures en attente"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        lines = []
+        for body, fields in batch:
+            try:
+                payload = fastjson.loads(body) if body else None
+            except ValueError:
+                payload = None
+            fields["payload"] = sanitize_payload(payload, keep_content=self.keep_content)
+            lines.append(json.dumps(fields, ensure_ascii=False))
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        try:
+            if self.path.stat().st_size + len(data) > self.max_bytes:
+                os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+        except FileNotFoundError:
+            pass
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erreur lors de l'écriture de la capture du trafic: {str(e)}")
+
+def read_capture(path):
+    """
+    Lit un fichier de capture, ligne par ligne (les lignes invalides sont ignorées)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+def capture_fields(scope, ctx, status, start_time, end_time):
+    """
+    Champs d'une ligne de capture, à partir du contexte de la requête
+    """
+    ctx = ctx or {}
+    return {
+        "timestamp": round(start_time, 6),
+        "method": scope.get("method"),
+        "route": scope.get("path"),
+        "status": status,
+        "client_ms": round((end_time - start_time) * 1000, 2),
+        "upstream_ms": round(ctx["upstream_ms"], 2) if ctx.get("upstream_ms") else None,
+        "model": ctx.get("model"),
+        "attempts": ctx.get("attempts"),
+    }
+
+class CaptureMiddleware:
+    """
+    Middleware ASGI pur qui copie le corps des requêtes LLM et les confie à `TrafficCapture`
+    une fois la réponse envoyée
+    """
+
+    def __init__(self, app, capture, paths):
+        self.app = app
+        self.capture = capture
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths or not self.capture.sampled():
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.time()
+        chunks = []
+        state = {"status": 0}
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            # Le contexte (modèle, latence amont...) est ouvert par JournalMiddleware, placé avant
+            fields = capture_fields(scope, request_context.get(), state["status"], start_time, time.time())
+            self.capture.record(b"".join(chunks), **fields)
@@ -0,0 +1,148 @@
+"""
+Catalogue des modèles pré-calculé pour les routes de listing
+
+Les représentations OpenAI (/v1/models), OpenWebUI (/api/models) et Ollama
+(/api/tags) sont construites une seule fois, sérialisées en octets et associées
+à un ETag fort. Elles ne sont reconstruites que lorsque la configuration des
+endpoints change.
+"""
+
+import hashlib
+import json
+import re
+import time
+from collections import namedtuple
+
+CatalogEntry = namedtuple("CatalogEntry", ["body", "etag", "headers"])
+
+# Date fixe utilisée pour tous les modèles
+MODEL_CREATED = 1699891200
+
+# Familles reconnues dans le nom des modèles, de la plus spécifique à la plus générale
+MODEL_FAMILIES = ("deepseek", "codestral", "mixtral", "mistral", "llama")
+
+_MOE_SIZE = re.compile(r"(?<![a-z0-9])(\d+)x(\d+(?:\.\d+)?)b(?![a-z0-9])", re.IGNORECASE)
+_PARAMETER_SIZE = re.compile(r"(?<![a-z0-9.])(\d+(?:\.\d+)?)b(?![a-z0-9])", re.IGNORECASE)
+
+def _serialize(content):
+    # Même sérialisation que JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def _entry(content):
+    body = _serialize(content)
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return CatalogEntry(body, etag, {"ETag": etag, "Cache-Control": "no-cache"})
+
+def build_openai_models(model_names):
+    """
+    Liste des modèles au format OpenAI (/v1/models)
+    """
+    return {"object": "list", "data": [{"id": name, "object": "model"} for name in sorted(model_names)]}
+
+def build_openwebui_models(model_names):
+    """
+    Liste des modèles pour OpenWebUI (/api/models), avec le suffixe ':latest'
+    """
+    models_list = []
+    for model_name in model_names:
+        display_name = f"{model_name}:latest"
+        models_list.append({
+            "id": display_name,
+            "name": display_name,
+            "model_id": display_name,
+            "object": "model",
+            "created": MODEL_CREATED,
+            "owned_by": "OVH AI",
+            "root": model_name,
+            "parent": None,
+            "permission": []
+        })
+    return {"data": models_list, "object": "list"}
+
+def model_details(model_name, upstream_name=None):
+    """
+    Famille et nombre de paramètres déduits du nom du modèle (OVH, puis interne) ; chaînes vides si inconnus
+    """
+    names = [name for name in (upstream_name, model_name) if name]
+    family = next((family for name in names for family in MODEL_FAMILIES if family in name.lower()), "")
+    parameter_size = ""
+    for name in names:
+        moe = _MOE_SIZE.search(name)
+        if moe:
+            parameter_size = f"{moe.group(1)}x{moe.group(2)}B"
+            break
+        size = _PARAMETER_SIZE.search(name)
+        if size:
+            parameter_size = f"{size.group(1)}B"
+            break
+    return family, parameter_size
+
+def build_ollama_tags(model_names, upstream_names=None):
+    """
+    Liste des modèles au format Ollama (/api/tags)
+    """
+    upstream_names = upstream_names or {}
+    modified_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(MODEL_CREATED))
+    ollama_models = []
+    for model_name in model_names:
+        display_name = f"{model_name}:latest"
+        upstream_name = upstream_names.get(model_name)
+        family, parameter_size = model_details(model_name, upstream_name)
+        ollama_models.append({
+            "name": display_name,  # Nom avec suffixe pour l'affichage
+            "model": display_name, # Champ requis par OpenWebUI
+            "modified_at": modified_at,
+            "size": 0,  # Poids servis par OVH, taille inconnue
+            "digest": hashlib.sha256(f"{model_name}:{upstream_name or model_name}".encode("utf-8")).hexdigest(),
+            "details": {
+                "format": "openai_compat",
+                "family": family,
+                "families": [family] if family else None,
+                "parameter_size": parameter_size,
+                "quantization_level": ""
+            }
+        })
+    return {"models": ollama_models}
+
+class ModelCatalog:
+    """
+    Représentations pré-sérialisées du catalogue, remplacées d'un bloc à chaque reconstruction
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def rebuild(self, endpoints, alternative_endpoints, upstream_names=None, virtual_models=()):
+        """
+        Reconstruit toutes les représentations à partir de la configuration des endpoints
+        (et des noms OVH des modèles, pour les métadonnées Ollama). Les modèles virtuels
+        (`auto`) sont listés avec les autres.
+        """
+        primary_models = list(endpoints.keys()) + list(virtual_models)
+        all_models = set(primary_models) | set(alternative_endpoints.keys())
+        entries = {
+            "openai": _entry(build_openai_models(all_models)),
+            "openwebui": _entry(build_openwebui_models(primary_models)),
+            "ollama": _entry(build_ollama_tags(primary_models, upstream_names)),
+        }
+        # Remplacement atomique : une requête en cours garde l'ancienne représentation
+        self._entries = entries
+
+    def get(self, name):
+        return self._entries[name]
+
+def etag_matches(if_none_match, etag):
+    """
+    Vérifie si l'en-tête If-None-Match correspond à l'ETag (comparaison faible, RFC 9110)
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,164 @@
+"""
+Statistiques des longueurs de génération et valeurs par défaut de max_tokens
+
+Les valeurs fixes de DEFAULT_MAX_TOKENS (et les minimums imposés aux demandes
+d'explication ou de code) sont très au-dessus des longueurs réellement
+générées : OVH réserve de la capacité pour ces budgets, et une génération qui
+s'emballe peut durer plusieurs minutes. Les `completion_tokens` rapportés
+par OVH sont donc conservés par modèle, route et classe de requête (fenêtre
+glissante des dernières générations) ; quand le client ne fixe pas
+`max_tokens`, la valeur par défaut devient un percentile de ces longueurs
+plus une marge.
+
+Une génération tronquée (`finish_reason` = "length") compte pour la limite
+qu'elle a atteinte : si les limites apprises deviennent trop basses, le
+percentile remonte jusqu'à elles et la marge les relève.
+
+Les statistiques sont enregistrées dans un fichier JSON à l'arrêt et
+rechargées au démarrage.
+"""
+
+import collections
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+SNAPSHOT_VERSION = 1
+
+def percentile(values, pct):
+    """Percentile (méthode du rang le plus proche) d'une liste triée"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(len(values) * pct / 100) - 1)]
+
+class _Series:
+    __slots__ = ("lengths", "truncated", "total")
+
+    def __init__(self, window):
+        self.lengths = collections.deque(maxlen=window)
+        # 1 si la génération correspondante a été tronquée par max_tokens
+        self.truncated = collections.deque(maxlen=window)
+        self.total = 0
+
+class CompletionStats:
+    """
+    Longueurs des générations par (modèle, route, classe de requête), et max_tokens appris
+    """
+
+    def __init__(self, path=None, percentile=95, headroom=0.25, min_samples=50, window=1000,
+                 floor=256, ceiling=8192):
+        self.path = Path(path) if path else None
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.window = window
+        self.floor = floor
+        self.ceiling = ceiling
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, route, request_class, completion_tokens, truncated=False):
+        """Ajoute la longueur d'une génération terminée"""
+        if completion_tokens is None or completion_tokens < 0:
+            return
+        key = (model, route, request_class)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(self.window)
+            series.lengths.append(int(completion_tokens))
+            series.truncated.append(1 if truncated else 0)
+            series.total += 1
+
+    def default_max_tokens(self, model, route, request_class):
+        """
+        max_tokens appris pour une requête sans max_tokens explicite, ou None tant que
+        les échantillons sont insuffisants
+        """
+        with self._lock:
+            series = self._series.get((model, route, request_class))
+            if series is None or len(series.lengths) < self.min_samples:
+                return None
+            lengths = sorted(series.lengths)
+        return self._learned(lengths)
+
+    def _learned(self, sorted_lengths):
+        value = math.ceil(percentile(sorted_lengths, self.percentile) * (1 + self.headroom))
+        return max(self.floor, min(self.ceiling, value))
+
+    def snapshot(self, static_default=None):
+        """
+        Distributions par série, pour la vue d'administration ; `static_default(modèle, classe)`
+        donne la valeur fixe qui serait utilisée sans apprentissage
+        """
+        with self._lock:
+            items = [(key, sorted(series.lengths), sum(series.truncated), series.total)
+                     for key, series in self._series.items()]
+        result = []
+        for (model, route, request_class), lengths, truncated, total in sorted(items):
+            entry = {
+                "model": model,
+                "route": route,
+                "request_class": request_class,
+                "samples": len(lengths),
+                "total": total,
+                "truncated_rate": round(truncated / len(lengths), 4) if lengths else 0.0,
+                "completion_tokens": {
+                    "p50": percentile(lengths, 50),
+                    "p90": percentile(lengths, 90),
+                    "p95": percentile(lengths, 95),
+                    "p99": percentile(lengths, 99),
+                    "max": lengths[-1] if lengths else None,
+                },
+                "learned_max_tokens": self._learned(lengths) if len(lengths) >= self.min_samples else None,
+            }
+            if static_default is not None:
+                entry["static_max_tokens"] = static_default(model, request_class)
+            result.append(entry)
+        return result
+
+    def load(self):
+        """Recharge les statistiques enregistrées ; retourne le nombre de séries"""
+        if self.path is None:
+            return 0
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            print(f"Statistiques des générations illisibles ({self.path}): {str(e)}")
+            return 0
+        if not isinstance(data, dict) or data.get("version") != SNAPSHOT_VERSION:
+            return 0
+        with self._lock:
+            for entry in data.get("series", []):
+                series = _Series(self.window)
+                series.lengths.extend(entry["lengths"])
+                series.truncated.extend(entry.get("truncated") or [0] * len(entry["lengths"]))
+                series.total = entry.get("total", len(entry["lengths"]))
+                self._series[(entry["model"], entry["route"], entry["request_class"])] = series
+            count = len(self._series)
+        print(f"Statistiques des générations chargées depuis {self.path} ({count} séries)")
+        return count
+
+    def save(self):
+        """Enregistre les statistiques de manière atomique (fichier temporaire puis renommage)"""
+        if self.path is None:
+            return
+        with self._lock:
+            series = [
+                {
+                    "model": model, "route": route, "request_class": request_class,
+                    "lengths": list(s.lengths), "truncated": list(s.truncated), "total": s.total,
+                }
+                for (model, route, request_class), s in self._series.items()
+            ]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "saved_at": time.time(), "series": series}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,217 @@
+"""
+Gestion de la fenêtre de contexte des modèles
+
+OpenWebUI renvoie toute la conversation à chaque tour. Avant l'envoi à OVH,
+l'historique est mesuré avec un estimateur local (heuristique octets/mots
+calibrée par famille de modèles) puis, s'il dépasse le budget du modèle,
+réduit : les messages système et les derniers tours sont conservés, les
+tours intermédiaires sont retirés et, en dernier recours, le contenu des
+messages trop longs est élidé en son milieu.
+"""
+
+import math
+from collections import namedtuple
+
+# Taille de la fenêtre de contexte (en tokens) des modèles OVH par défaut
+DEFAULT_CONTEXT_LENGTHS = {
+    "mistral-7b-instruct-v0.3": 32768,
+    "mixtral-8x7b-instruct-v0.1": 32768,
+    "mistral-nemo-instruct-2407": 65536,
+    "llama-3-1-8b-instruct": 131072,
+    "llama-3-3-70b-instruct": 131072,
+    "llama-3-1-70b-instruct": 131072,
+    "deepseek-r1-distill-llama-70b": 131072,
+    "mamba-codestral-7b-v0-1": 131072,
+}
+
+DEFAULT_CONTEXT_LENGTH = 32768
+
+# Heuristique par famille : (octets UTF-8 par token, tokens par mot).
+# L'estimation retient le maximum des deux, ce qui couvre aussi bien le
+# français que le code ou les textes sans espaces.
+FAMILY_RATIOS = {
+    "codestral": (3.0, 1.7),
+    "mistral": (3.4, 1.5),
+    "mixtral": (3.4, 1.5),
+    "llama": (3.9, 1.35),
+    "deepseek": (3.9, 1.35),
+}
+
+DEFAULT_RATIOS = (3.5, 1.5)
+
+# Surcoût du gabarit de chat par message (rôle, balises de début et de fin)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+ELISION_MARKER = "\n[...]\n"
+
+class TokenEstimator:
+    """
+    Estimateur rapide du nombre de tokens, sans tokenizer
+    """
+
+    def __init__(self, bytes_per_token, tokens_per_word):
+        self.bytes_per_token = bytes_per_token
+        self.tokens_per_word = tokens_per_word
+
+    def count(self, text):
+        if not text:
+            return 0
+        by_bytes = len(text.encode("utf-8")) / self.bytes_per_token
+        by_words = len(text.split()) * self.tokens_per_word
+        return int(math.ceil(max(by_bytes, by_words)))
+
+    def count_message(self, message):
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, str):
+            return MESSAGE_OVERHEAD_TOKENS + self.count(content)
+        if isinstance(content, list):
+            # Contenu multimodal : seules les parties texte sont comptées
+            tokens = MESSAGE_OVERHEAD_TOKENS
+            for part in content:
+                if isinstance(part, dict) and isinstance(part.get("text"), str):
+                    tokens += self.count(part["text"])
+            return tokens
+        return MESSAGE_OVERHEAD_TOKENS
+
+    def max_tokens_for_bytes(self, size):
+        """
+        Majorant de l'estimation pour un texte de `size` octets (un mot occupe au moins 2 octets avec son séparateur)
+        """
+        return int(math.ceil(size * max(1 / self.bytes_per_token, self.tokens_per_word / 2)))
+
+    def truncate(self, text, max_tokens):
+        """
+        Réduit `text` à environ `max_tokens` en gardant le début et la fin
+        """
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text
+        keep_chars = max(0, int(len(text) * max_tokens / tokens) - len(ELISION_MARKER))
+        head = keep_chars // 2
+        tail = keep_chars - head
+        return text[:head] + ELISION_MARKER + (text[-tail:] if tail else "")
+
+_ESTIMATORS = {family: TokenEstimator(*ratios) for family, ratios in FAMILY_RATIOS.items()}
+_DEFAULT_ESTIMATOR = TokenEstimator(*DEFAULT_RATIOS)
+
+def _role(message):
+    return message.get("role") if isinstance(message, dict) else None
+
+def estimator_for(model_name):
+    """
+    Retourne l'estimateur de la famille du modèle (première famille trouvée dans le nom)
+    """
+    name = (model_name or "").lower()
+    for family, estimator in _ESTIMATORS.items():
+        if family in name:
+            return estimator
+    return _DEFAULT_ESTIMATOR
+
+class TrimResult(namedtuple("TrimResult", ["messages", "original_tokens", "final_tokens", "dropped_messages", "elided_messages"])):
+    """
+    Résultat de l'ajustement d'un historique à la fenêtre de contexte
+    """
+    __slots__ = ()
+
+    @property
+    def tokens_saved(self):
+        return max(0, self.original_tokens - self.final_tokens)
+
+    @property
+    def trimmed(self):
+        return bool(self.dropped_messages or self.elided_messages)
+
+class ContextWindowManager:
+    """
+    Ajuste l'historique envoyé à OVH au budget de tokens du modèle
+
+    - `keep_last_turns` : nombre de derniers tours (message utilisateur et réponses) toujours conservés
+    - `max_prompt_tokens` : plafond global optionnel du prompt, même sous la taille du contexte
+    - `safety_ratio` : part du contexte gardée en réserve pour compenser l'imprécision de l'estimation
+    """
+
+    def __init__(self, keep_last_turns=4, max_prompt_tokens=None, safety_ratio=0.05, min_elided_tokens=64):
+        self.keep_last_turns = keep_last_turns
+        self.max_prompt_tokens = max_prompt_tokens
+        self.safety_ratio = safety_ratio
+        self.min_elided_tokens = min_elided_tokens
+
+    def prompt_budget(self, context_length, max_tokens):
+        """
+        Nombre de tokens disponibles pour le prompt une fois la réponse réservée
+        """
+        budget = int(context_length * (1 - self.safety_ratio)) - int(max_tokens or 0)
+        if self.max_prompt_tokens:
+            budget = min(budget, self.max_prompt_tokens)
+        return max(budget, 0)
+
+    def raw_fits(self, model_name, size, context_length=None, max_tokens=0):
+        """
+        Vérifie, sans décoder le corps, qu'une requête de `size` octets tient forcément dans le budget
+        """
+        context_length = context_length or DEFAULT_CONTEXT_LENGTHS.get(model_name, DEFAULT_CONTEXT_LENGTH)
+        return estimator_for(model_name).max_tokens_for_bytes(size) <= self.prompt_budget(context_length, max_tokens)
+
+    def fit(self, model_name, messages, context_length=None, max_tokens=0):
+        """
+        Retourne un `TrimResult` dont les messages tiennent dans le budget du modèle.
+        La liste d'origine n'est jamais modifiée.
+        """
+        if not isinstance(messages, list):
+            return TrimResult(messages, 0, 0, 0, 0)
+        estimator = estimator_for(model_name)
+        counts = [estimator.count_message(message) for message in messages]
+        original_tokens = sum(counts)
+        context_length = context_length or DEFAULT_CONTEXT_LENGTHS.get(model_name, DEFAULT_CONTEXT_LENGTH)
+        budget = self.prompt_budget(context_length, max_tokens)
+        if original_tokens <= budget:
+            return TrimResult(messages, original_tokens, original_tokens, 0, 0)
+
+        is_system = [_role(message) == "system" for message in messages]
+        system_tokens = sum(count for count, system in zip(counts, is_system) if system)
+
+        # Début de chaque tour : un message utilisateur qui ne suit pas directement un autre message utilisateur
+        turn_starts = [
+            i for i, message in enumerate(messages)
+            if _role(message) == "user" and (i == 0 or _role(messages[i - 1]) != "user")
+        ]
+        if not turn_starts:
+            turn_starts = [next((i for i, system in enumerate(is_system) if not system), len(messages))]
+
+        # Les derniers tours sont toujours gardés ; les plus anciens sont repris tant que le budget le permet
+        kept_turns = min(max(self.keep_last_turns, 1), len(turn_starts))
+        cut = turn_starts[-kept_turns]
+        remaining = budget - system_tokens - sum(c for i, c in enumerate(counts) if i >= cut and not is_system[i])
+        for start in reversed(turn_starts[:-kept_turns]):
+            turn_tokens = sum(c for i, c in enumerate(counts[start:cut], start) if not is_system[i])
+            if turn_tokens > remaining:
+                break
+            remaining -= turn_tokens
+            cut = start
+
+        kept = [i for i in range(len(messages)) if is_system[i] or i >= cut]
+        dropped = len(messages) - len(kept)
+        result = [messages[i] for i in kept]
+        result_counts = [counts[i] for i in kept]
+
+        # Dernier recours : élider le milieu des messages les plus longs, du plus ancien au plus récent,
+        # en épargnant le dernier message (la question en cours)
+        elided = 0
+        excess = sum(result_counts) - budget
+        for position in range(len(result) - 1):
+            if excess <= 0:
+                break
+            message = result[position]
+            content = message.get("content") if isinstance(message, dict) else None
+            if not isinstance(content, str) or result_counts[position] <= self.min_elided_tokens + MESSAGE_OVERHEAD_TOKENS:
+                continue
+            target = max(self.min_elided_tokens, result_counts[position] - MESSAGE_OVERHEAD_TOKENS - excess)
+            new_content = estimator.truncate(content, target)
+            new_count = estimator.count_message({"content": new_content})
+            if new_count < result_counts[position]:
+                result[position] = dict(message, content=new_content)
+                excess -= result_counts[position] - new_count
+                result_counts[position] = new_count
+                elided += 1
+
+        return TrimResult(result, original_tokens, sum(result_counts), dropped, elided)
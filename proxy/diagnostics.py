@@ -0,0 +1,97 @@
+"""
+Sondes de diagnostic concurrentes et cache des résultats
+
+Les routes de diagnostic interrogent tous les endpoints OVH. Les sondes
+sont lancées en parallèle dans un pool de threads, sous un budget de temps
+global : une sonde qui n'a pas répondu à l'échéance est rapportée en
+`timeout` sans retarder les autres.
+
+Les résultats sont mis en cache `ttl` secondes. Au-delà, et pendant
+`stale_ttl` secondes, l'ancien résultat est servi immédiatement pendant
+qu'un seul recalcul tourne en arrière-plan (stale-while-revalidate).
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from starlette.concurrency import run_in_threadpool
+
+def run_probes(probes, budget=8.0, max_workers=16):
+    """
+    Exécute les sondes `{clé: fonction}` en parallèle et retourne `{clé: résultat}`.
+    Les sondes encore en cours après `budget` secondes sont rapportées en `timeout`.
+    """
+    if not probes:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(probes)), thread_name_prefix="diagnostic")
+    try:
+        futures = {key: executor.submit(probe) for key, probe in probes.items()}
+        wait(futures.values(), timeout=budget)
+        results = {}
+        for key, future in futures.items():
+            if not future.done():
+                future.cancel()
+                results[key] = {"status": "timeout", "error": f"Pas de réponse dans le budget de {budget:g} secondes"}
+            elif future.exception() is not None:
+                results[key] = {"status": "error", "error": str(future.exception())}
+            else:
+                results[key] = future.result()
+        return results
+    finally:
+        # Les sondes en retard se terminent seules (leur propre timeout), sans bloquer la réponse
+        executor.shutdown(wait=False, cancel_futures=True)
+
+class _Entry:
+    __slots__ = ("value", "computed_at", "refreshing")
+
+    def __init__(self):
+        self.value = None
+        self.computed_at = None
+        self.refreshing = None
+
+class DiagnosticsCache:
+    """
+    Cache des résultats de diagnostic avec stale-while-revalidate et un seul calcul à la fois par clé
+    """
+
+    def __init__(self, ttl=30.0, stale_ttl=300.0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+
+    def _refresh(self, entry, compute):
+        if entry.refreshing is None:
+            async def run():
+                try:
+                    entry.value = await run_in_threadpool(compute)
+                    entry.computed_at = time.monotonic()
+                except Exception as e:
+                    print(f"Erreur lors du calcul d'un diagnostic: {str(e)}")
+                    raise
+                finally:
+                    entry.refreshing = None
+            entry.refreshing = asyncio.ensure_future(run())
+            # Un échec du recalcul en arrière-plan est déjà journalisé
+            entry.refreshing.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return entry.refreshing
+
+    async def get(self, key, compute):
+        """
+        Retourne `(résultat, état, âge en secondes)` ; `compute` est une fonction synchrone,
+        exécutée dans le pool de threads. L'état vaut `fresh`, `stale` ou `miss`.
+        """
+        entry = self._entries.setdefault(key, _Entry())
+        if entry.computed_at is not None and self.ttl > 0:
+            age = time.monotonic() - entry.computed_at
+            if age < self.ttl:
+                return entry.value, "fresh", age
+            if age < self.ttl + self.stale_ttl:
+                self._refresh(entry, compute)
+                return entry.value, "stale", age
+        # Pas de résultat exploitable : les appels simultanés attendent le même calcul
+        await asyncio.shield(self._refresh(entry, compute))
+        return entry.value, "miss", 0.0
+
+    def clear(self):
+        self._entries.clear()
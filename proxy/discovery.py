@@ -0,0 +1,210 @@
+"""
+Découverte automatique des modèles servis par les endpoints OVH
+
+Chaque endpoint configuré est interrogé sur `/api/openai_compat/v1/models` :
+le nom exact du modèle côté OVH et sa fenêtre de contexte (`max_model_len`)
+alimentent la table de routage. Le résultat est enregistré dans un fichier
+d'instantané, rechargé instantanément au démarrage suivant ; la découverte
+elle-même tourne ensuite en arrière-plan, à intervalle régulier.
+
+En cas d'échec sur un endpoint, les informations déjà connues pour ses
+modèles sont conservées.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from functools import partial
+from pathlib import Path
+
+import requests
+
+try:
+    from proxy.diagnostics import run_probes
+except ImportError:
+    from diagnostics import run_probes
+
+SNAPSHOT_VERSION = 1
+
+# Champs de /models qui portent la fenêtre de contexte, selon le serveur d'inférence
+CONTEXT_LENGTH_FIELDS = ("max_model_len", "context_length", "max_context_length")
+
+def _normalize(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+def fetch_models(endpoint_url, token, timeout=5.0):
+    """
+    Liste des modèles d'un endpoint : [{"id", "context_length"}]
+    """
+    url = f"{endpoint_url}/api/openai_compat/v1/models"
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    response = requests.get(url, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    models = []
+    for entry in response.json().get("data", []):
+        if not isinstance(entry, dict) or not isinstance(entry.get("id"), str):
+            continue
+        context_length = next((entry[field] for field in CONTEXT_LENGTH_FIELDS if field in entry), None)
+        if isinstance(context_length, bool) or not isinstance(context_length, int) or context_length <= 0:
+            context_length = None
+        models.append({"id": entry["id"], "context_length": context_length})
+    return models
+
+def match_upstream_model(model_name, known_upstream_name, listed):
+    """
+    Choisit, parmi les modèles listés par l'endpoint, celui qui correspond au modèle interne
+    """
+    if len(listed) == 1:
+        return listed[0]
+    by_name = {_normalize(entry["id"]): entry for entry in listed}
+    for candidate in (known_upstream_name, model_name):
+        if candidate and _normalize(candidate) in by_name:
+            return by_name[_normalize(candidate)]
+    return None
+
+def discover_models(table, budget=10.0, max_workers=16, timeout=5.0):
+    """
+    Interroge l'endpoint principal de chaque modèle de la table.
+    Retourne ({modèle: {"upstream_name", "context_length", "endpoint"}}, {modèle: erreur})
+    """
+    probes = {}
+    for route in table.models.values():
+        target = route.primary
+        probes.setdefault(target.url, partial(fetch_models, target.url, target.token, min(timeout, budget)))
+    outcomes = run_probes(probes, budget=budget, max_workers=max_workers)
+
+    discovered = {}
+    errors = {}
+    for name, route in table.models.items():
+        outcome = outcomes.get(route.primary.url)
+        if isinstance(outcome, dict):
+            errors[name] = outcome.get("error", outcome.get("status"))
+            continue
+        entry = match_upstream_model(name, route.upstream_name, outcome or [])
+        if entry is None:
+            errors[name] = f"Aucun modèle correspondant parmi {[item['id'] for item in outcome or []]}"
+            continue
+        discovered[name] = {
+            "upstream_name": entry["id"],
+            "context_length": entry["context_length"],
+            "endpoint": route.primary.url,
+        }
+    return discovered, errors
+
+def load_snapshot(path):
+    """
+    Lit un instantané de la découverte ; retourne None s'il est absent ou illisible
+    """
+    try:
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Instantané des modèles illisible ({path}): {str(e)}")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION or not isinstance(snapshot.get("models"), dict):
+        return None
+    return snapshot
+
+def save_snapshot(path, models, discovered_at):
+    """
+    Écrit l'instantané de manière atomique (fichier temporaire puis renommage)
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"version": SNAPSHOT_VERSION, "discovered_at": discovered_at, "models": models}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+class ModelDiscovery:
+    """
+    Charge l'instantané au démarrage, puis rafraîchit la découverte en arrière-plan
+    et applique le résultat à la table de routage
+    """
+
+    def __init__(self, routing, snapshot_path, refresh_interval=3600.0, budget=10.0, max_workers=16):
+        self.routing = routing
+        self.snapshot_path = Path(snapshot_path)
+        self.refresh_interval = refresh_interval
+        self.budget = budget
+        self.max_workers = max_workers
+        self.models = {}
+        self.discovered_at = None
+        self.last_refresh = None
+        self.last_errors = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """Applique l'instantané enregistré, s'il existe (aucun appel réseau)"""
+        snapshot = load_snapshot(self.snapshot_path)
+        if snapshot is None:
+            return False
+        with self._lock:
+            self.models = snapshot["models"]
+            self.discovered_at = snapshot.get("discovered_at")
+        self.routing.set_discovered(self.models)
+        print(f"Instantané des modèles chargé depuis {self.snapshot_path} ({len(self.models)} modèles)")
+        return True
+
+    def refresh(self):
+        """
+        Interroge les endpoints et publie une nouvelle table si quelque chose a changé.
+        Retourne True si la table a été mise à jour.
+        """
+        discovered, errors = discover_models(self.routing.current, budget=self.budget, max_workers=self.max_workers)
+        with self._lock:
+            self.last_refresh = time.time()
+            self.last_errors = errors
+            # Les modèles dont l'endpoint n'a pas répondu gardent leurs informations précédentes
+            models = {name: info for name, info in self.models.items() if name in errors}
+            models.update(discovered)
+            if models == self.models:
+                return False
+            self.models = models
+            self.discovered_at = self.last_refresh
+        self.routing.set_discovered(models)
+        try:
+            save_snapshot(self.snapshot_path, models, self.discovered_at)
+        except OSError as e:
+            print(f"Impossible d'enregistrer l'instantané des modèles ({self.snapshot_path}): {str(e)}")
+        print(f"Découverte des modèles: {len(discovered)} modèles découverts, {len(errors)} en échec")
+        return True
+
+    def start(self):
+        """Lance la découverte en arrière-plan (immédiatement, puis toutes les `refresh_interval` secondes)"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-discovery", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Erreur lors de la découverte des modèles: {str(e)}")
+            if self.refresh_interval <= 0 or self._stop.wait(self.refresh_interval):
+                return
+
+    def status(self):
+        with self._lock:
+            return {
+                "snapshot_path": str(self.snapshot_path),
+                "discovered_at": self.discovered_at,
+                "last_refresh": self.last_refresh,
+                "models": dict(self.models),
+                "errors": dict(self.last_errors),
+            }
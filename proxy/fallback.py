@@ -0,0 +1,197 @@
+"""
+État de santé des modèles et repli vers un modèle équivalent
+
+Quand tous les endpoints d'un modèle échouent ou sont limités (429), la
+requête échouait alors qu'un modèle équivalent (même famille, même taille)
+pouvait être disponible. Chaque modèle a donc un disjoncteur : après
+`failure_threshold` échecs consécutifs, il est ouvert pendant `cooldown`
+secondes et les requêtes passent directement aux modèles de repli de son
+groupe (voir `model_groups` dans la configuration du routage). À la fin du
+délai, une seule requête de test est autorisée : son succès referme le
+disjoncteur, son échec le rouvre.
+
+Deux autres signaux écartent un modèle sans attendre un échec :
+- une réponse 429 le marque limité pendant `rate_limit_cooldown` secondes ;
+- l'attente prévue dépasse l'objectif `queue_slo` : OVH met les requêtes en
+  file avant de générer, le délai avant le premier token (moyenne mobile des
+  dernières générations) donne donc l'attente qu'aura la requête suivante.
+  Une mesure plus vieille que `estimate_ttl` secondes n'est plus prise en
+  compte, pour que le modèle soit de nouveau essayé et la mesure rafraîchie.
+
+Un modèle écarté n'est pas abandonné : il reste essayé en dernier recours,
+après les modèles disponibles.
+
+Le nombre de requêtes en cours et le p95 du délai avant le premier token sur
+les `latency_window` dernières secondes décrivent aussi la charge de chaque
+modèle, pour le choix du modèle réel derrière le modèle virtuel `auto`.
+"""
+
+import collections
+import threading
+import time
+
+try:
+    from proxy.completion_stats import percentile
+except ImportError:
+    from completion_stats import percentile
+
+# Statuts des appels OVH pour lesquels un modèle équivalent est essayé
+FALLBACK_STATUS = frozenset({429, 500, 502, 503, 504})
+
+class ModelUnavailable(Exception):
+    """
+    Tous les endpoints d'un modèle ont échoué (`status` : dernier statut obtenu)
+    et un modèle de repli peut prendre la requête
+    """
+
+    def __init__(self, model, status, detail=None):
+        self.model = model
+        self.status = status
+        self.detail = detail
+        super().__init__(f"{model} indisponible ({status}): {detail}")
+
+class _ModelState:
+    __slots__ = ("failures", "opened_until", "probe_until", "rate_limited_until", "ttft", "ttft_at",
+                 "in_flight", "ttft_samples")
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_until = 0.0
+        self.probe_until = 0.0
+        self.rate_limited_until = 0.0
+        self.ttft = None
+        self.ttft_at = 0.0
+        self.in_flight = 0
+        # (instant, délai avant le premier token) des dernières générations
+        self.ttft_samples = collections.deque(maxlen=200)
+
+class ModelHealth:
+    """
+    Disjoncteur, limitation et attente prévue de chaque modèle
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=30.0, rate_limit_cooldown=10.0, queue_slo=10.0,
+                 estimate_ttl=60.0, alpha=0.3, latency_window=300.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.queue_slo = queue_slo
+        self.estimate_ttl = estimate_ttl
+        self.alpha = alpha
+        self.latency_window = latency_window
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state(self, model):
+        state = self._states.get(model)
+        if state is None:
+            state = self._states[model] = _ModelState()
+        return state
+
+    def _unavailable(self, state, now, claim=True):
+        if state.failures >= self.failure_threshold:
+            if now < state.opened_until or now < state.probe_until:
+                return "breaker_open"
+            if claim:
+                # Fin du délai : cette requête sert de test, les suivantes attendent son résultat
+                state.probe_until = now + self.cooldown
+        if now < state.rate_limited_until:
+            return "rate_limited"
+        if (self.queue_slo and state.ttft is not None and now - state.ttft_at < self.estimate_ttl
+                and state.ttft > self.queue_slo):
+            return "queue_slo"
+        return None
+
+    def plan(self, models):
+        """
+        Ordre d'essai des modèles : [(modèle, raison de l'écarter ou None)], les modèles
+        disponibles d'abord (dans l'ordre donné), puis les modèles écartés en dernier recours.
+        La requête de test d'un disjoncteur n'est réservée qu'à l'appel (`claim_probe`) : un
+        modèle de repli jamais essayé ne la garde pas
+        """
+        now = time.monotonic()
+        with self._lock:
+            decisions = [(model, self._unavailable(self._state(model), now, claim=False)) for model in models]
+        return [d for d in decisions if d[1] is None] + [d for d in decisions if d[1] is not None]
+
+    def unavailable(self, model):
+        """Raison d'écarter le modèle, ou None (sans réserver la requête de test du disjoncteur)"""
+        with self._lock:
+            return self._unavailable(self._state(model), time.monotonic(), claim=False)
+
+    def claim_probe(self, model):
+        """
+        Réserve la requête de test d'un modèle dont le disjoncteur est à mi-ouverture, juste
+        avant de l'appeler ; retourne False si le disjoncteur est ouvert (ou le test déjà pris)
+        """
+        with self._lock:
+            return self._unavailable(self._state(model), time.monotonic()) != "breaker_open"
+
+    def begin(self, model):
+        with self._lock:
+            self._state(model).in_flight += 1
+
+    def end(self, model):
+        with self._lock:
+            state = self._state(model)
+            state.in_flight = max(0, state.in_flight - 1)
+
+    def load(self, model):
+        """(requêtes en cours, p95 du délai avant le premier token ou None) du modèle"""
+        with self._lock:
+            state = self._state(model)
+            return state.in_flight, self._ttft_p95(state, time.monotonic())
+
+    def _ttft_p95(self, state, now):
+        recent = sorted(value for at, value in state.ttft_samples if now - at < self.latency_window)
+        return percentile(recent, 95)
+
+    def record_success(self, model):
+        with self._lock:
+            state = self._state(model)
+            state.failures = 0
+            state.opened_until = state.probe_until = 0.0
+
+    def record_failure(self, model, status=None):
+        """Échec d'un appel au modèle ; retourne True si le disjoncteur vient de s'ouvrir"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(model)
+            if status == 429:
+                state.rate_limited_until = now + self.rate_limit_cooldown
+            state.failures += 1
+            state.probe_until = 0.0
+            if state.failures >= self.failure_threshold:
+                opened = now >= state.opened_until
+                state.opened_until = now + self.cooldown
+                return opened
+        return False
+
+    def observe_ttft(self, model, seconds):
+        """Ajoute un délai avant le premier token à la moyenne mobile du modèle"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(model)
+            if state.ttft is None or now - state.ttft_at >= self.estimate_ttl:
+                state.ttft = seconds
+            else:
+                state.ttft += self.alpha * (seconds - state.ttft)
+            state.ttft_at = now
+            state.ttft_samples.append((now, seconds))
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {
+                    "consecutive_failures": state.failures,
+                    "breaker": "open" if state.failures >= self.failure_threshold and now < state.opened_until
+                    else "half_open" if state.failures >= self.failure_threshold else "closed",
+                    "rate_limited_for": round(max(0.0, state.rate_limited_until - now), 1),
+                    "expected_wait_seconds": round(state.ttft, 3)
+                    if state.ttft is not None and now - state.ttft_at < self.estimate_ttl else None,
+                    "in_flight": state.in_flight,
+                    "ttft_p95_seconds": self._ttft_p95(state, now),
+                }
+                for model, state in sorted(self._states.items())
+            }
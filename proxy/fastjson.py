@@ -0,0 +1,103 @@
+"""
+Encodage et décodage JSON rapides sur le chemin critique
+
+orjson est utilisé s'il est installé, sinon le module `json` standard avec
+une sortie équivalente (UTF-8, séparateurs compacts). Les corps envoyés à
+OVH sont encodés une seule fois par requête et réutilisés à chaque essai.
+"""
+
+import json
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(content):
+        """Encode `content` en octets JSON UTF-8"""
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(data):
+        """Décode des octets ou une chaîne JSON"""
+        return orjson.loads(data)
+else:
+    BACKEND = "json"
+
+    def dumps(content):
+        """Encode `content` en octets JSON UTF-8"""
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(data):
+        """Décode des octets ou une chaîne JSON"""
+        return json.loads(data)
+
+# Taille des aperçus d'objets : chaînes tronquées, nombre de champs affichés
+PREVIEW_STRING = 80
+PREVIEW_FIELDS = 20
+
+def preview(content, limit=None):
+    """
+    Représentation JSON de `content` pour les logs, éventuellement tronquée à `limit` caractères.
+    Un dict ou une liste n'est jamais encodé en entier : seuls ses champs de premier
+    niveau sont résumés (chaînes tronquées, listes et objets imbriqués réduits à leur taille).
+    """
+    if isinstance(content, (bytes, bytearray)):
+        data = bytes(content[:limit * 4]) if limit else bytes(content)
+        text = data.decode("utf-8", errors="replace")
+    elif isinstance(content, dict):
+        fields = [f"{dumps(str(key)).decode('utf-8')}:{_summary(value)}"
+                  for key, value in list(content.items())[:PREVIEW_FIELDS]]
+        if len(content) > PREVIEW_FIELDS:
+            fields.append(f"...{len(content) - PREVIEW_FIELDS} champs")
+        text = "{" + ",".join(fields) + "}"
+    elif isinstance(content, (list, tuple)):
+        items = [_summary(value) for value in content[:PREVIEW_FIELDS]]
+        if len(content) > PREVIEW_FIELDS:
+            items.append(f"...{len(content) - PREVIEW_FIELDS} éléments")
+        text = "[" + ",".join(items) + "]"
+    else:
+        text = _summary(content)
+    return text[:limit] if limit else text
+
+def _summary(value):
+    if isinstance(value, str):
+        if len(value) > PREVIEW_STRING:
+            return dumps(value[:PREVIEW_STRING]).decode("utf-8")[:-1] + f'..." ({len(value)} caractères)'
+        return dumps(value).decode("utf-8")
+    if isinstance(value, dict):
+        return f"{{{len(value)} champs}}"
+    if isinstance(value, (list, tuple)):
+        return f"[{len(value)} éléments]"
+    return dumps(value).decode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse dont le rendu passe par l'encodeur rapide
+    """
+
+    def render(self, content):
+        return dumps(content)
+
+async def json_body(request: Request):
+    """
+    Dépendance FastAPI : lit et décode le corps JSON de la requête (un objet est attendu)
+    """
+    return decode_body(await request.body())
+
+def decode_body(body):
+    """
+    Décode un corps de requête JSON, ou lève une HTTPException 422
+    """
+    try:
+        payload = loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Corps JSON invalide: {str(e)}")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=422, detail="Le corps de la requête doit être un objet JSON.")
+    return payload
@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+"""
+Journal binaire des requêtes du proxy OVH LLM
+
+Chaque requête LLM produit un enregistrement compact (horodatage, modèle,
+endpoint choisi, tentatives, statut, latences, tokens, client). Les
+enregistrements sont écrits par lots dans des segments rotatifs, et peuvent
+être filtrés et agrégés en flux, sans charger tout l'historique en mémoire :
+
+    python -m proxy.journal --since 7d --group-by model
+    python -m proxy.journal --since 2024-03-01 --model llama-3-3-70b-instruct --status error
+"""
+
+import argparse
+import bisect
+import collections
+import json
+import math
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# En-tête de chaque segment : magie + version du format
+SEGMENT_MAGIC_PREFIX = b"OVHJ"
+SEGMENT_VERSION = 2
+SEGMENT_MAGIC = SEGMENT_MAGIC_PREFIX + bytes((SEGMENT_VERSION,))
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".seg"
+
+# Partie fixe d'un enregistrement :
+# horodatage, statut, tentatives, cache, latence totale (ms), latence amont (ms),
+# tokens du prompt, tokens générés, délai avant le premier token (ms, version 2)
+# L'octet `cache` est réservé : aucun cache ne répond aux requêtes LLM, il vaut toujours 255 (inconnu)
+_FIXED_BY_VERSION = {
+    1: struct.Struct("<dHBBIIII"),
+    2: struct.Struct("<dHBBIIIII"),
+}
+_FIXED = _FIXED_BY_VERSION[SEGMENT_VERSION]
+_TIMESTAMP = struct.Struct("<d")
+_LENGTH = struct.Struct("<H")
+
+# Champs texte, encodés chacun sur un octet de longueur + UTF-8 (255 octets max)
+STRING_FIELDS = ("model", "endpoint", "route", "client_id")
+
+FIELDS = ("timestamp", "status", "attempts", "cache_hit", "latency_ms", "upstream_ms",
+          "prompt_tokens", "completion_tokens", "ttft_ms") + STRING_FIELDS
+
+GROUP_BY_CHOICES = ("model", "endpoint", "route", "client_id", "status", "day", "hour")
+
+_U32_MAX = 0xFFFFFFFF
+
+# Un enregistrement est horodaté au début de la requête mais écrit après la réponse :
+# un segment peut donc contenir des requêtes commencées jusqu'à cette durée avant sa création
+_SEGMENT_SLACK_SECONDS = 900
+
+def _clamp(value, upper):
+    try:
+        value = int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+    return max(0, min(value, upper))
+
+def encode_record(record):
+    """
+    Encode un enregistrement (dict) au format binaire du journal
+    """
+    cache_hit = record.get("cache_hit")
+    parts = [_FIXED.pack(
+        float(record.get("timestamp") or time.time()),
+        _clamp(record.get("status"), 0xFFFF),
+        _clamp(record.get("attempts"), 0xFF),
+        255 if cache_hit is None else int(bool(cache_hit)),
+        _clamp(record.get("latency_ms"), _U32_MAX),
+        _clamp(record.get("upstream_ms"), _U32_MAX),
+        _clamp(record.get("prompt_tokens"), _U32_MAX),
+        _clamp(record.get("completion_tokens"), _U32_MAX),
+        _clamp(record.get("ttft_ms"), _U32_MAX),
+    )]
+    for field in STRING_FIELDS:
+        data = str(record.get(field) or "").encode("utf-8")[:255]
+        parts.append(bytes((len(data),)))
+        parts.append(data)
+    payload = b"".join(parts)
+    return _LENGTH.pack(len(payload)) + payload
+
+def decode_record(payload, fixed=_FIXED):
+    """
+    Décode un enregistrement binaire en dict (`fixed` : partie fixe de la version du segment)
+    """
+    values = fixed.unpack_from(payload, 0)
+    record = dict(zip(FIELDS[:len(values)], values))
+    record["cache_hit"] = None if record["cache_hit"] == 255 else bool(record["cache_hit"])
+    # Segments de version 1 : pas de mesure du premier token
+    record.setdefault("ttft_ms", 0)
+    offset = fixed.size
+    for field in STRING_FIELDS:
+        length = payload[offset]
+        offset += 1
+        record[field] = payload[offset:offset + length].decode("utf-8", errors="replace")
+        offset += length
+    return record
+
+class RequestJournal:
+    """
+    Écrivain du journal : les enregistrements sont mis en file en mémoire et
+    écrits par lots par un thread dédié, la requête n'attend jamais le disque.
+    """
+
+    def __init__(self, directory, segment_max_bytes=16 * 1024 * 1024, max_segments=500,
+                 flush_interval=2.0, batch_size=256):
+        self.directory = Path(directory)
+        self.segment_max_bytes = segment_max_bytes
+        self.max_segments = max_segments
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._segment_path = None
+        self._segment_day = None
+
+    def start(self):
+        """Démarre le thread d'écriture en arrière-plan"""
+        if self._thread is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="request-journal", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Arrête le thread d'écriture et vide la file"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def record(self, **fields):
+        """Ajoute un enregistrement à la file (ne fait aucune entrée/sortie)"""
+        with self._lock:
+            self._pending.append(fields)
+            pending_count = len(self._pending)
+        if pending_count >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Écrit immédiatement les enregistrements en attente"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        data = b"".join(encode_record(record) for record in batch)
+        with self._write_lock:
+            path = self._current_segment()
+            with open(path, "ab") as f:
+                f.write(data)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erreur lors de l'écriture du journal des requêtes: {str(e)}")
+
+    def _current_segment(self):
+        """Retourne le segment courant, en effectuant la rotation si nécessaire"""
+        timestamp = time.time()
+        day = time.strftime("%Y%m%d", time.localtime(timestamp))
+        path = self._segment_path
+        if (path is None or day != self._segment_day or not path.exists()
+                or path.stat().st_size >= self.segment_max_bytes):
+            path = self.directory / f"{SEGMENT_PREFIX}{int(timestamp * 1000):015d}{SEGMENT_SUFFIX}"
+            with open(path, "wb") as f:
+                f.write(SEGMENT_MAGIC)
+            self._segment_path = path
+            self._segment_day = day
+            self._prune_segments()
+        return path
+
+    def _prune_segments(self):
+        segments = list_segments(self.directory)
+        for _, old_path in segments[:max(0, len(segments) - self.max_segments)]:
+            try:
+                old_path.unlink()
+            except OSError:
+                pass
+
+def list_segments(directory):
+    """
+    Liste les segments du journal, triés par horodatage de début
+    """
+    segments = []
+    directory = Path(directory)
+    if not directory.is_dir():
+        return segments
+    for path in directory.iterdir():
+        name = path.name
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+            try:
+                start_ms = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            except ValueError:
+                continue
+            segments.append((start_ms / 1000, path))
+    segments.sort()
+    return segments
+
+def _iter_segment(path):
+    """
+    Parcourt les enregistrements bruts d'un segment : (partie fixe de sa version, octets)
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(SEGMENT_MAGIC))
+        fixed = _FIXED_BY_VERSION.get(magic[-1]) if magic[:-1] == SEGMENT_MAGIC_PREFIX else None
+        if fixed is None:
+            return
+        while True:
+            header = f.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                return
+            (length,) = _LENGTH.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return  # Lot partiellement écrit
+            yield fixed, payload
+
+def _matches_status(status, wanted):
+    if wanted is None:
+        return True
+    if wanted == "error":
+        return status >= 400 or status == 0
+    if wanted == "ok":
+        return 0 < status < 400
+    return str(status) == str(wanted)
+
+def iter_records(directory, since=None, until=None, model=None, endpoint=None, route=None,
+                 client_id=None, status=None):
+    """
+    Parcourt en flux les enregistrements correspondant aux filtres
+    """
+    segments = list_segments(directory)
+    starts = [start for start, _ in segments]
+    for index, (start, path) in enumerate(segments):
+        if until is not None and start > until + _SEGMENT_SLACK_SECONDS:
+            break
+        if since is not None and index + 1 < len(starts) and starts[index + 1] <= since:
+            continue
+        for fixed, payload in _iter_segment(path):
+            # Filtrer sur l'horodatage avant de décoder les champs texte
+            timestamp = _TIMESTAMP.unpack_from(payload, 0)[0]
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp >= until:
+                continue
+            record = decode_record(payload, fixed)
+            if model is not None and record["model"] != model:
+                continue
+            if endpoint is not None and record["endpoint"] != endpoint:
+                continue
+            if route is not None and record["route"] != route:
+                continue
+            if client_id is not None and record["client_id"] != client_id:
+                continue
+            if not _matches_status(record["status"], status):
+                continue
+            yield record
+
+class LatencyHistogram:
+    """
+    Histogramme à buckets géométriques (facteur 1.25) pour estimer les percentiles
+    de latence avec une mémoire bornée
+    """
+
+    FACTOR = 1.25
+    BOUNDS = [1.25 ** i for i in range(70)]  # de 1 ms à ~10 minutes
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+
+    def add(self, value_ms):
+        self.counts[bisect.bisect_left(self.BOUNDS, value_ms)] += 1
+        self.total += 1
+
+    def percentile(self, pct):
+        if not self.total:
+            return None
+        target = math.ceil(self.total * pct / 100)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return round(self.BOUNDS[index]) if index < len(self.BOUNDS) else None
+        return None
+
+def _group_key(record, group_by):
+    if group_by == "day":
+        return time.strftime("%Y-%m-%d", time.localtime(record["timestamp"]))
+    if group_by == "hour":
+        return time.strftime("%Y-%m-%d %H:00", time.localtime(record["timestamp"]))
+    return record[group_by]
+
+def aggregate(records, group_by=None):
+    """
+    Agrège un flux d'enregistrements, éventuellement par groupe
+    """
+    groups = {}
+    for record in records:
+        key = _group_key(record, group_by) if group_by else "all"
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                "requests": 0, "errors": 0, "attempts": 0, "cache_hits": 0,
+                "prompt_tokens": 0, "completion_tokens": 0,
+                "latency_sum": 0, "upstream_sum": 0,
+                "latency": LatencyHistogram(), "upstream": LatencyHistogram(),
+                "ttft": LatencyHistogram(), "streamed_tokens": 0, "generation_ms": 0,
+            }
+        group["requests"] += 1
+        if not _matches_status(record["status"], "ok"):
+            group["errors"] += 1
+        group["attempts"] += record["attempts"]
+        group["cache_hits"] += 1 if record["cache_hit"] else 0
+        group["prompt_tokens"] += record["prompt_tokens"]
+        group["completion_tokens"] += record["completion_tokens"]
+        group["latency_sum"] += record["latency_ms"]
+        group["upstream_sum"] += record["upstream_ms"]
+        group["latency"].add(record["latency_ms"])
+        group["upstream"].add(record["upstream_ms"])
+        if record["ttft_ms"]:
+            group["ttft"].add(record["ttft_ms"])
+            # Débit de génération : tokens produits après le premier, sur la durée qui suit
+            if record["completion_tokens"] > 1 and record["upstream_ms"] > record["ttft_ms"]:
+                group["streamed_tokens"] += record["completion_tokens"] - 1
+                group["generation_ms"] += record["upstream_ms"] - record["ttft_ms"]
+
+    summary = {}
+    for key, group in groups.items():
+        count = group["requests"]
+        summary[str(key)] = {
+            "requests": count,
+            "errors": group["errors"],
+            "error_rate": round(group["errors"] / count, 4),
+            "avg_attempts": round(group["attempts"] / count, 2),
+            "cache_hits": group["cache_hits"],
+            "prompt_tokens": group["prompt_tokens"],
+            "completion_tokens": group["completion_tokens"],
+            "latency_ms": {
+                "avg": round(group["latency_sum"] / count),
+                "p50": group["latency"].percentile(50),
+                "p95": group["latency"].percentile(95),
+                "p99": group["latency"].percentile(99),
+            },
+            "upstream_ms": {
+                "avg": round(group["upstream_sum"] / count),
+                "p50": group["upstream"].percentile(50),
+                "p95": group["upstream"].percentile(95),
+            },
+            "ttft_ms": {
+                "p50": group["ttft"].percentile(50),
+                "p95": group["ttft"].percentile(95),
+            },
+            "tokens_per_second": (
+                round(group["streamed_tokens"] * 1000 / group["generation_ms"], 1) if group["generation_ms"] else None
+            ),
+        }
+    return summary
+
+def tail(records, limit):
+    """
+    Retourne les `limit` derniers enregistrements d'un flux (mémoire bornée)
+    """
+    return list(collections.deque(records, maxlen=limit))
+
+_DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_time(value, now=None):
+    """
+    Convertit une borne temporelle en timestamp : durée relative ("30m", "6h", "7d"),
+    timestamp Unix ou date ISO ("2024-03-01", "2024-03-01T12:00")
+    """
+    if value is None or value == "":
+        return None
+    value = str(value).strip()
+    match = _DURATION_RE.match(value)
+    if match:
+        return (now or time.time()) - float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"Borne temporelle invalide: {value}")
+
+def query(directory, since=None, until=None, group_by=None, limit=None, **filters):
+    """
+    Interroge le journal : agrégats si `group_by` ou `limit` est absent,
+    sinon les derniers enregistrements correspondants
+    """
+    if group_by is not None and group_by not in GROUP_BY_CHOICES:
+        raise ValueError(f"Regroupement inconnu: {group_by}")
+    records = iter_records(directory, since=parse_time(since), until=parse_time(until), **filters)
+    if limit:
+        return {"records": tail(records, limit)}
+    return {"group_by": group_by, "groups": aggregate(records, group_by)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Interroger le journal des requêtes du proxy OVH LLM")
+    parser.add_argument("--dir", default=os.getenv("JOURNAL_DIR", "/tmp/proxy_journal"),
+                        help="Répertoire des segments du journal")
+    parser.add_argument("--since", help="Début de la période (ex: 6h, 7d, 2024-03-01)")
+    parser.add_argument("--until", help="Fin de la période")
+    parser.add_argument("--model")
+    parser.add_argument("--endpoint")
+    parser.add_argument("--route")
+    parser.add_argument("--client-id")
+    parser.add_argument("--status", help="Code HTTP exact, 'ok' ou 'error'")
+    parser.add_argument("--group-by", choices=GROUP_BY_CHOICES)
+    parser.add_argument("--limit", type=int, help="Afficher les N derniers enregistrements au lieu des agrégats")
+    args = parser.parse_args(argv)
+
+    result = query(
+        args.dir, since=args.since, until=args.until, group_by=args.group_by, limit=args.limit,
+        model=args.model, endpoint=args.endpoint, route=args.route,
+        client_id=args.client_id, status=args.status,
+    )
+    json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
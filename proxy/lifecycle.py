@@ -0,0 +1,95 @@
+"""
+Cycle de vie du processus : vivacité et disponibilité
+
+Le processus est « vivant » dès qu'il répond aux requêtes HTTP. Il n'est
+« prêt » qu'une fois la configuration chargée et, si demandé, les
+connexions vers OVH ouvertes : c'est l'état que doit attendre un
+orchestrateur avant de lui envoyer du trafic. La durée de chaque étape du
+démarrage est conservée pour /health.
+
+À l'arrêt (SIGTERM), le processus passe « en vidange » : il n'est plus
+prêt, refuse les nouvelles requêtes (sauf si un autre processus a repris
+le socket d'écoute) et laisse les générations en cours se terminer
+jusqu'à l'échéance de vidange.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+STARTING = "starting"
+READY = "ready"
+DRAINING = "draining"
+
+class Lifecycle:
+    """
+    État du processus pour les sondes de vivacité (/health/live) et de disponibilité (/health/ready)
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.state = STARTING
+        self.ready_after = None
+        self.steps = {}
+        self.draining_since = None
+        self.refuse_new = False
+        self.in_flight = 0
+        self.refused = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    @property
+    def draining(self):
+        return self.state == DRAINING
+
+    def uptime(self):
+        return time.monotonic() - self._started
+
+    @contextmanager
+    def step(self, name):
+        """Chronomètre une étape du démarrage (secondes, conservées dans `steps`)"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.steps[name] = round(time.monotonic() - start, 4)
+
+    def mark_ready(self):
+        with self._lock:
+            if self.state != STARTING:
+                return
+            self.state = READY
+            self.ready_after = round(self.uptime(), 4)
+        print(f"Proxy prêt en {self.ready_after:.3f} s (étapes: {self.steps})")
+
+    def mark_draining(self, refuse_new=True):
+        """
+        Passe en vidange (définitif) ; avec `refuse_new`, les nouvelles requêtes sont refusées.
+        Retourne False si le processus était déjà en vidange.
+        """
+        with self._lock:
+            if self.state == DRAINING:
+                return False
+            self.state = DRAINING
+            self.draining_since = time.time()
+            self.refuse_new = refuse_new
+        refused = "refusées" if refuse_new else "servies jusqu'à la fermeture du socket d'écoute"
+        print(f"Arrêt demandé: vidange de {self.in_flight} requêtes en cours, nouvelles requêtes {refused}")
+        return True
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "ready": self.state == READY,
+                "uptime_seconds": round(self.uptime(), 3),
+                "ready_after_seconds": self.ready_after,
+                "startup_steps": dict(self.steps),
+                "in_flight": self.in_flight,
+                "draining_since": self.draining_since,
+            }
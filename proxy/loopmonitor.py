@@ -0,0 +1,140 @@
+"""
+Surveillance du retard de la boucle d'événements
+
+Une tâche se réveille toutes les `interval` secondes et mesure son retard
+sur l'heure prévue : ce retard est le temps pendant lequel la boucle était
+occupée par d'autres callbacks. Les percentiles et le maximum sur une
+fenêtre glissante sont exportés dans les métriques.
+
+En mode détection (`detect_blocking`), un thread de surveillance vérifie
+que la tâche continue de se réveiller. Si la boucle ne répond plus depuis
+`threshold` secondes, la pile du thread de la boucle est journalisée : c'est
+le code qui la bloque (`requests.*`, `time.sleep`, `open()`...).
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+class LoopLagMonitor:
+    """
+    Mesure le retard de la boucle d'événements et, si demandé, détecte les callbacks bloquants
+    """
+
+    def __init__(self, interval=0.05, window=1200, detect_blocking=False, threshold=0.1, max_stack_depth=30):
+        self.interval = interval
+        self.detect_blocking = detect_blocking
+        self.threshold = threshold
+        self.max_stack_depth = max_stack_depth
+        self.lags = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.samples = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Démarre la mesure (à appeler depuis la boucle d'événements)"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        if self.detect_blocking:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._heartbeat = now
+            self.lags.append(lag)
+            self.samples += 1
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _watch(self):
+        reported = None
+        check = max(self.threshold / 4, 0.005)
+        while not self._stopping.wait(check):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if reported is not None and reported[0] != heartbeat:
+                self._report_end(reported, heartbeat)
+                reported = None
+            if stalled < self.threshold or reported is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame, limit=self.max_stack_depth)) if frame else "(pile indisponible)"
+            self.blocked += 1
+            reported = (heartbeat, time.monotonic() - stalled)
+            logger.warning(f"Boucle d'événements bloquée depuis {stalled * 1000:.0f} ms, pile du thread de la boucle:\n{stack}")
+
+    def _report_end(self, reported, heartbeat):
+        duration = heartbeat - reported[1]
+        self.blocked_seconds += duration
+        logger.warning(f"Boucle d'événements débloquée après {duration * 1000:.0f} ms")
+
+    def snapshot(self):
+        """Percentiles (secondes) du retard sur la fenêtre courante, maximum depuis le démarrage"""
+        values = sorted(self.lags)
+        return {
+            "samples": self.samples,
+            "window": len(values),
+            "p50": _percentile(values, 0.5),
+            "p95": _percentile(values, 0.95),
+            "p99": _percentile(values, 0.99),
+            "window_max": values[-1] if values else None,
+            "max": self.max_lag,
+            "blocked": self.blocked,
+            "blocked_seconds": self.blocked_seconds,
+        }
+
+    def collect(self):
+        """Collecteur pour `Metrics.add_collector`"""
+        snapshot = self.snapshot()
+        samples = [
+            ("proxy_event_loop_lag_seconds", "summary", "Retard de la boucle d'événements (fenêtre glissante)",
+             {"quantile": quantile}, snapshot[name])
+            for quantile, name in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))
+        ]
+        samples += [
+            ("proxy_event_loop_lag_window_max_seconds", "gauge", "Retard maximal sur la fenêtre glissante", {}, snapshot["window_max"]),
+            ("proxy_event_loop_lag_max_seconds", "gauge", "Retard maximal depuis le démarrage", {}, snapshot["max"]),
+            ("proxy_event_loop_lag_samples_total", "counter", "Nombre de mesures du retard", {}, snapshot["samples"]),
+        ]
+        if self.detect_blocking:
+            samples += [
+                ("proxy_event_loop_blocked_total", "counter", "Blocages de la boucle au-delà du seuil", {}, snapshot["blocked"]),
+                ("proxy_event_loop_blocked_seconds_total", "counter", "Durée cumulée des blocages détectés", {}, snapshot["blocked_seconds"]),
+            ]
+        return samples
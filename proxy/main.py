@@ -1,6 +1,8 @@
 import uvicorn
 import os
+import socket
 import sys
+import time
 
 # Configuration de uvicorn pour des logs plus détaillés
 log_config = {
@@ -49,10 +51,52 @@ log_config = {
 
 try:
     # Essayer d'importer depuis le package proxy (pour Docker)
-    from proxy.app import app
+    from proxy.app import app, lifecycle
 except ImportError:
     # Si ça ne fonctionne pas, essayer d'importer directement (pour le développement local)
-    from app import app
+    from app import app, lifecycle
+
+class DrainingServer(uvicorn.Server):
+    """
+    Serveur uvicorn avec arrêt progressif : au premier SIGTERM/SIGINT, le proxy passe
+    en vidange (/health/ready répond 503), continue d'écouter `announce` secondes pour
+    laisser le répartiteur de charge le retirer, puis ferme le socket d'écoute et attend
+    les requêtes en cours (au plus `timeout_graceful_shutdown`). Les nouvelles requêtes
+    sont refusées, sauf en mode `handoff` (SO_REUSEPORT) : le nouveau processus écoute
+    déjà sur le port, celles acceptées avant la fermeture du socket sont servies.
+    Un second signal arrête l'attente de l'annonce ; un second CTRL+C force l'arrêt.
+    """
+
+    def __init__(self, config, announce=0.0, handoff=False):
+        super().__init__(config)
+        self.announce = announce
+        self.handoff = handoff
+        self.exit_at = None
+
+    def handle_exit(self, sig, frame):
+        if self.exit_at is None and not self.should_exit:
+            lifecycle.mark_draining(refuse_new=not self.handoff)
+            self.exit_at = time.monotonic() + self.announce
+            if self.announce > 0:
+                return
+        super().handle_exit(sig, frame)
+
+    async def on_tick(self, counter):
+        if self.exit_at is not None and time.monotonic() >= self.exit_at:
+            self.should_exit = True
+        return await super().on_tick(counter)
+
+def reuse_port_socket(host, port):
+    """
+    Socket d'écoute partageable (SO_REUSEPORT) : le nouveau processus écoute sur le même
+    port avant que l'ancien ne reçoive SIGTERM, la reprise se fait sans connexion refusée
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
 
 if __name__ == "__main__":
     print("Démarrage du serveur sur http://localhost:8000")
@@ -61,13 +105,25 @@ if __name__ == "__main__":
     # S'assurer que l'adresse d'écoute est correcte
     host = "0.0.0.0"  # Écouter sur toutes les interfaces réseau
     port = int(os.environ.get("PORT", 8000))
+
+    # Vidange à l'arrêt : les générations en cours (jusqu'à 120 s) peuvent se terminer
+    drain_timeout = float(os.environ.get("DRAIN_TIMEOUT_SECONDS", 120))
+    drain_announce = float(os.environ.get("DRAIN_ANNOUNCE_SECONDS", 0))
+    reuse_port = os.environ.get("REUSE_PORT", "false").lower() in ("1", "true", "yes")
     
     # Démarrer le serveur avec la configuration des logs
-    uvicorn.run(
+    config = uvicorn.Config(
         app, 
         host=host, 
         port=port,
         log_config=log_config,
         log_level="debug",
-        timeout_keep_alive=120  # Augmenter le timeout pour les connexions persistantes
-    ) 
\ No newline at end of file
+        timeout_keep_alive=120,  # Augmenter le timeout pour les connexions persistantes
+        timeout_graceful_shutdown=drain_timeout,
+    )
+    server = DrainingServer(config, announce=drain_announce, handoff=reuse_port)
+    if reuse_port:
+        print(f"Socket d'écoute partagé (SO_REUSEPORT) sur {host}:{port}")
+        server.run(sockets=[reuse_port_socket(host, port)])
+    else:
+        server.run()
@@ -0,0 +1,91 @@
+"""
+Métriques du proxy au format texte Prometheus
+
+Les compteurs sont incrémentés par le code du proxy ; les valeurs calculées
+à la demande (retard de la boucle d'événements, pools de connexions...)
+sont fournies par des collecteurs appelés au moment de l'export.
+"""
+
+import threading
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class Metrics:
+    """
+    Registre des métriques : compteurs, jauges et collecteurs
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._values = {}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text):
+        """Déclare une métrique (`counter` ou `gauge`) et son texte d'aide"""
+        with self._lock:
+            self._types[name] = kind
+            self._help[name] = help_text
+            self._values.setdefault(name, {})
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values.setdefault(name, {})[key] = value
+
+    def get(self, name, **labels):
+        with self._lock:
+            return self._values.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def add_collector(self, collector):
+        """
+        Ajoute une fonction appelée à chaque export, qui retourne des tuples
+        (nom, type, aide, labels, valeur)
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """Export au format texte Prometheus (version 0.0.4)"""
+        families = {}
+        with self._lock:
+            for name, series in self._values.items():
+                families[name] = [self._types.get(name, "untyped"), self._help.get(name, ""), list(series.items())]
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"Erreur dans un collecteur de métriques: {str(e)}")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                family = families.setdefault(name, [kind, help_text, []])
+                family[2].append((tuple(sorted(labels.items())), value))
+        lines = []
+        for name in sorted(families):
+            kind, help_text, series = families[name]
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
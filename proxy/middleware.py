@@ -0,0 +1,389 @@
+"""
+Middlewares ASGI du proxy OVH LLM
+"""
+
+import contextvars
+import importlib
+import logging
+import time
+import zlib
+from importlib.util import find_spec
+
+# Contexte de la requête en cours, alimenté par les handlers et `send_request`
+# (modèle, endpoint choisi, tentatives, latence amont, tokens...) pour le journal
+request_context = contextvars.ContextVar("request_context", default=None)
+
+def annotate_request(**fields):
+    """
+    Ajoute des informations au contexte de la requête en cours, s'il existe
+    """
+    ctx = request_context.get()
+    if ctx is not None:
+        ctx.update(fields)
+
+def get_client_id(scope):
+    """
+    Identifie le client d'une requête : en-tête X-Client-Id, sinon X-Forwarded-For, sinon l'adresse IP
+    """
+    headers = dict(scope.get("headers") or [])
+    client_id = headers.get(b"x-client-id")
+    if client_id:
+        return client_id.decode("latin-1")
+    forwarded = headers.get(b"x-forwarded-for")
+    if forwarded:
+        return forwarded.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else ""
+
+class RequestLoggingMiddleware:
+    """
+    Middleware ASGI pur qui journalise chaque requête HTTP.
+
+    Le corps de la requête n'est jamais bufferisé : seuls les `max_body_bytes`
+    premiers octets sont copiés au passage dans `receive` pour les logs. Les
+    morceaux de la réponse sont transmis tels quels à `send`, on se contente
+    de compter leur taille.
+    """
+
+    def __init__(self, app, max_body_bytes=2000, logger=None):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.logger = logger or logging.getLogger(__name__)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        max_body_bytes = self.max_body_bytes
+        captured = bytearray()
+        state = {"status": None, "bytes_in": 0, "bytes_out": 0, "truncated": False}
+
+        async def logging_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                state["bytes_in"] += len(body)
+                remaining = max_body_bytes - len(captured)
+                if remaining > 0 and body:
+                    captured.extend(body[:remaining])
+                if len(body) > remaining:
+                    state["truncated"] = True
+            return message
+
+        async def logging_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["bytes_out"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, logging_receive, logging_send)
+        finally:
+            duration_ms = (time.perf_counter() - start_time) * 1000
+            self.logger.info(
+                f"Requête: {scope['method']} {scope['path']} -> {state['status']} "
+                f"(entrée: {state['bytes_in']} o, sortie: {state['bytes_out']} o, durée: {duration_ms:.1f} ms)"
+            )
+            if captured:
+                body_str = captured.decode("utf-8", errors="replace")
+                if state["truncated"]:
+                    self.logger.info(f"Corps de la requête (tronqué): {body_str}...")
+                else:
+                    self.logger.info(f"Corps de la requête: {body_str}")
+
+class JournalMiddleware:
+    """
+    Middleware ASGI pur qui ouvre un contexte par requête LLM et écrit un
+    enregistrement dans le journal des requêtes une fois la réponse envoyée
+    (si `journal` est fourni). Le nombre de tokens économisés par la gestion
+    de la fenêtre de contexte est renvoyé dans l'en-tête X-Proxy-Tokens-Saved,
+    le modèle qui a servi la requête dans X-Proxy-Model (et le modèle demandé
+    dans X-Proxy-Fallback-From en cas de repli vers un modèle équivalent).
+    Les `listeners` reçoivent le contexte complet de chaque requête terminée.
+    """
+
+    def __init__(self, app, journal, paths, listeners=()):
+        self.app = app
+        self.journal = journal
+        self.paths = frozenset(paths)
+        self.listeners = tuple(listeners)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.time()
+        ctx = {"route": scope["path"], "client_id": get_client_id(scope), "attempts": 0, "status": 0}
+        token = request_context.set(ctx)
+
+        async def journal_send(message):
+            if message["type"] == "http.response.start":
+                ctx["status"] = message["status"]
+                extra_headers = []
+                if ctx.get("tokens_saved"):
+                    extra_headers.append((b"x-proxy-tokens-saved", str(ctx["tokens_saved"]).encode("latin-1")))
+                if ctx.get("served_model"):
+                    extra_headers.append((b"x-proxy-model", ctx["served_model"].encode("latin-1")))
+                if ctx.get("fallback_from"):
+                    extra_headers.append((b"x-proxy-fallback-from", ctx["fallback_from"].encode("latin-1")))
+                if extra_headers:
+                    message["headers"] = list(message.get("headers", [])) + extra_headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, journal_send)
+        finally:
+            request_context.reset(token)
+            finish_request(ctx, start_time, self.journal, self.listeners)
+
+def finish_request(ctx, start_time, journal=None, listeners=()):
+    """
+    Complète le contexte d'une requête terminée, l'écrit dans le journal et le passe aux observateurs
+    """
+    ctx["timestamp"] = start_time
+    ctx["latency_ms"] = (time.time() - start_time) * 1000
+    if journal is not None:
+        journal.record(**ctx)
+    for listener in listeners:
+        try:
+            listener(ctx)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Erreur d'un observateur du journal: {str(e)}")
+
+class DrainMiddleware:
+    """
+    Middleware ASGI pur qui compte les requêtes HTTP en cours et, une fois le
+    processus en vidange avec refus des nouvelles requêtes (`lifecycle.refuse_new`),
+    leur répond 503 avec Retry-After et Connection: close, pour que le client
+    réessaie sur le processus qui prend le relais. Les sondes de santé
+    (`exempt_paths`) restent servies.
+    """
+
+    def __init__(self, app, lifecycle, exempt_paths=(), retry_after=1):
+        self.app = app
+        self.lifecycle = lifecycle
+        self.exempt_paths = tuple(exempt_paths)
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        if self.lifecycle.draining and self.lifecycle.refuse_new:
+            self.lifecycle.refused += 1
+            body = '{"detail":"Le proxy redémarre, veuillez réessayer."}'.encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"retry-after", str(self.retry_after).encode("latin-1")),
+                    (b"connection", b"close"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        self.lifecycle.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.lifecycle.in_flight -= 1
+
+class _GzipEncoder:
+    def __init__(self, level=6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self):
+        return self._compressor.flush()
+
+class _BrotliEncoder:
+    def __init__(self, quality=4):
+        brotli = importlib.import_module("brotli")
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data, flush=False):
+        out = self._compressor.process(data)
+        return out + self._compressor.flush() if flush else out
+
+    def finish(self):
+        return self._compressor.finish()
+
+class _ZstdEncoder:
+    def __init__(self, level=3):
+        zstandard = importlib.import_module("zstandard")
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+
+    def compress(self, data, flush=False):
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(self._flush_block) if flush else out
+
+    def finish(self):
+        return self._compressor.flush()
+
+# Encodages disponibles, par ordre de préférence du serveur. Les modules brotli et
+# zstandard ne sont importés qu'à la première réponse compressée avec eux.
+ENCODERS = {}
+if find_spec("zstandard") is not None:
+    ENCODERS["zstd"] = _ZstdEncoder
+if find_spec("brotli") is not None:
+    ENCODERS["br"] = _BrotliEncoder
+ENCODERS["gzip"] = _GzipEncoder
+
+# Types de contenu transmis au fil de l'eau : chaque morceau est vidé immédiatement vers le client
+STREAMING_CONTENT_TYPES = ("text/event-stream", "application/x-ndjson")
+COMPRESSIBLE_CONTENT_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "application/xml")
+
+def choose_encoding(accept_encoding, available=None):
+    """
+    Choisit l'encodage à utiliser d'après l'en-tête Accept-Encoding (valeurs q comprises)
+    """
+    available = ENCODERS if available is None else available
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        if name:
+            weights[name] = weight
+    best = None
+    for name in available:
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (name, weight)
+    return best[0] if best else None
+
+class CompressionMiddleware:
+    """
+    Middleware ASGI pur qui compresse les réponses selon l'en-tête Accept-Encoding
+    (zstd, brotli ou gzip selon les modules installés).
+
+    La décision est prise dès les en-têtes quand ils suffisent (type de contenu,
+    encodage existant, Content-Length) : les en-têtes des flux et des réponses
+    non compressées partent sans attendre le corps. Les réponses d'un seul bloc
+    plus petites que `minimum_size` sont envoyées telles quelles. Pour les flux
+    SSE et NDJSON, chaque morceau est compressé puis vidé immédiatement, pour
+    que le client reçoive les tokens sans attendre. Toute réponse d'un type
+    compressible porte `Vary: Accept-Encoding`, compressée ou non.
+    """
+
+    def __init__(self, app, minimum_size=1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    def decide(self, start, encoding):
+        """
+        (décision, compressible) pour un message `http.response.start` : décision
+        "compress", "identity" ou None (attendre le premier morceau du corps)
+        """
+        headers = dict(start.get("headers") or [])
+        status = start["status"]
+        if status < 200 or status in (204, 304) or b"content-encoding" in headers:
+            return "identity", False
+        content_type = headers.get(b"content-type", b"").decode("latin-1").lower()
+        if not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES):
+            return "identity", False
+        if encoding is None:
+            return "identity", True
+        if content_type.startswith(STREAMING_CONTENT_TYPES):
+            return "compress", True
+        content_length = headers.get(b"content-length")
+        if content_length is not None:
+            try:
+                return ("compress" if int(content_length) >= self.minimum_size else "identity"), True
+            except ValueError:
+                pass
+        return None, True
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = b""
+        for name, value in scope.get("headers") or []:
+            if name == b"accept-encoding":
+                accept_encoding = value
+                break
+        encoding = choose_encoding(accept_encoding.decode("latin-1"))
+
+        state = {"start": None, "encoder": None, "flush": False, "identity": False}
+
+        async def start_response(start, decision):
+            raw_headers = []
+            vary = None
+            for name, value in start.get("headers") or []:
+                if name == b"vary":
+                    vary = value
+                    continue
+                if decision == "compress":
+                    if name == b"content-length":
+                        continue
+                    if name == b"etag" and not value.startswith(b"W/"):
+                        # Le corps compressé n'est plus identique octet pour octet : l'ETag devient faible
+                        value = b"W/" + value
+                raw_headers.append((name, value))
+            if vary is None:
+                vary = b"Accept-Encoding"
+            elif b"accept-encoding" not in vary.lower() and vary.strip() != b"*":
+                vary += b", Accept-Encoding"
+            raw_headers.append((b"vary", vary))
+            if decision == "compress":
+                content_type = dict(raw_headers).get(b"content-type", b"").decode("latin-1").lower()
+                state["flush"] = content_type.startswith(STREAMING_CONTENT_TYPES)
+                state["encoder"] = ENCODERS[encoding]()
+                raw_headers.append((b"content-encoding", encoding.encode("latin-1")))
+            else:
+                state["identity"] = True
+            await send(dict(start, headers=raw_headers))
+
+        async def compression_send(message):
+            if message["type"] == "http.response.start":
+                decision, compressible = self.decide(message, encoding)
+                if decision is None:
+                    # Ni flux ni Content-Length : l'envoi des en-têtes attend le premier morceau du corps
+                    state["start"] = message
+                elif compressible:
+                    await start_response(message, decision)
+                else:
+                    state["identity"] = True
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or state["identity"]:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if state["encoder"] is None:
+                await start_response(state["start"], "compress" if more_body or len(body) >= self.minimum_size else "identity")
+                if state["identity"]:
+                    await send(message)
+                    return
+
+            encoder = state["encoder"]
+            data = encoder.compress(body, flush=more_body and state["flush"])
+            if not more_body:
+                data += encoder.finish()
+            if data or not more_body:
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, compression_send)
@@ -0,0 +1,98 @@
+"""
+Relais brut des requêtes OpenAI qui ne demandent aucune transformation
+
+Pour un client OpenAI classique, le corps de la requête est transmis à OVH
+tel quel : seul le champ `model` est remplacé par le nom attendu par OVH,
+directement dans les octets. La réponse d'OVH (JSON ou flux SSE) est
+renvoyée au client sans être décodée. Tous les paramètres OpenAI (`stop`,
+`top_p`, `tools`, `stream`...) sont donc conservés.
+
+L'analyse se limite à quelques expressions régulières sur les octets. Dès
+qu'un cas est ambigu (plusieurs champs `model`, nom non textuel...), la
+requête est laissée au chemin normal.
+"""
+
+import re
+from collections import namedtuple
+
+try:
+    from proxy import fastjson
+except ImportError:
+    import fastjson
+
+# Une chaîne JSON ne peut pas contenir de guillemet non échappé : ces motifs ne
+# peuvent donc pas correspondre à l'intérieur du contenu d'un message
+_MODEL_FIELD = re.compile(rb'"model"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_STREAM_FIELD = re.compile(rb'"stream"\s*:\s*(true|false)')
+_TEST_MODE_FIELD = re.compile(rb'"test_mode"\s*:')
+_PROMPT_TOKENS = re.compile(rb'"prompt_tokens"\s*:\s*(\d+)')
+_COMPLETION_TOKENS = re.compile(rb'"completion_tokens"\s*:\s*(\d+)')
+
+_STREAM_OPTIONS_FIELD = re.compile(rb'"stream_options"\s*:')
+_CONTENT_TEXT = re.compile(rb'"(?:content|text)"\s*:\s*"[^"]')
+
+RawRequest = namedtuple("RawRequest", ["model", "model_span", "stream", "stream_span"])
+
+def inspect_request(body):
+    """
+    Extrait le modèle et l'option `stream` d'un corps de requête brut.
+    Retourne None si le corps ne se prête pas au relais brut.
+    """
+    if not body or not body.lstrip().startswith(b"{") or _TEST_MODE_FIELD.search(body):
+        return None
+    matches = list(_MODEL_FIELD.finditer(body))
+    if len(matches) != 1:
+        return None
+    match = matches[0]
+    raw_model = match.group(1)
+    if b"\\" in raw_model:
+        return None
+    stream_matches = list(_STREAM_FIELD.finditer(body))
+    if len(stream_matches) > 1:
+        return None
+    stream = bool(stream_matches) and stream_matches[0].group(1) == b"true"
+    stream_span = stream_matches[0].span(1) if stream_matches else None
+    return RawRequest(raw_model.decode("utf-8", errors="replace"), match.span(1), stream, stream_span)
+
+def patch_model(body, raw_request, upstream_name, stream=False):
+    """
+    Remplace la valeur du champ `model` dans le corps brut. Avec `stream`, une
+    requête non-streamée est transformée en requête streamée, avec le décompte
+    des tokens dans le dernier événement (`stream_options.include_usage`).
+    """
+    edits = []
+    if upstream_name != raw_request.model:
+        # Le nom est encodé en JSON (sans les guillemets, déjà présents dans le corps)
+        edits.append((raw_request.model_span, fastjson.dumps(upstream_name)[1:-1]))
+    if stream and not raw_request.stream:
+        opening = body.index(b"{") + 1
+        inserted = b""
+        if raw_request.stream_span is not None:
+            edits.append((raw_request.stream_span, b"true"))
+        else:
+            inserted += b'"stream":true,'
+        if not _STREAM_OPTIONS_FIELD.search(body):
+            inserted += b'"stream_options":{"include_usage":true},'
+        if inserted:
+            edits.append(((opening, opening), inserted))
+    # Modifications appliquées de la fin vers le début : les positions restent valides
+    for (start, end), value in sorted(edits, reverse=True):
+        body = body[:start] + value + body[end:]
+    return body
+
+def has_generated_text(data):
+    """
+    Indique si un morceau de flux SSE contient du texte généré (champ `content` ou `text` non vide)
+    """
+    return _CONTENT_TEXT.search(data) is not None
+
+def extract_usage(data):
+    """
+    Lit les compteurs de tokens d'une réponse (ou d'un morceau de flux SSE) sans la décoder
+    """
+    prompt_tokens = _PROMPT_TOKENS.search(data)
+    completion_tokens = _COMPLETION_TOKENS.search(data)
+    return (
+        int(prompt_tokens.group(1)) if prompt_tokens else None,
+        int(completion_tokens.group(1)) if completion_tokens else None,
+    )
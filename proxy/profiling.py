@@ -0,0 +1,262 @@
+"""
+Profilage statistique à la demande
+
+Un échantillonneur relève périodiquement la pile de chaque thread
+(`sys._current_frames`) tant qu'un profil est en cours. Rien ne tourne en
+dehors de ces fenêtres : sans en-tête `X-Proxy-Profile: 1` (ou appel à
+`/debug/profile`), le coût se limite à la recherche de l'en-tête.
+
+Les profils sont exportés en piles repliées (`collapsed`, pour flamegraph.pl
+ou speedscope) ou au format JSON de speedscope, une pile par thread.
+"""
+
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+from starlette.concurrency import run_in_threadpool
+
+PROFILE_FORMATS = ("speedscope", "collapsed")
+
+# Fonctions feuilles d'un thread qui attend (boucle d'événements au repos, file vide...)
+IDLE_FRAMES = frozenset({
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("socketserver.py", "serve_forever"),
+})
+
+SAMPLER_THREAD_PREFIX = "proxy-profiler"
+
+def _short_path(filename):
+    # Chemin relatif à l'entrée de sys.path la plus longue qui le contient
+    best = ""
+    for entry in sys.path:
+        if entry and filename.startswith(entry) and len(entry) > len(best):
+            best = entry
+    return filename[len(best):].lstrip(os.sep) if best else filename
+
+def _frame_label(code):
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+def _is_idle(code):
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+class Profile:
+    """
+    Résultat d'un profilage : nombre d'échantillons par (thread, pile)
+    """
+
+    def __init__(self, name, interval, started, duration, samples, profile_id=None):
+        self.id = profile_id or secrets.token_hex(6)
+        self.name = name
+        self.interval = interval
+        self.started = started
+        self.duration = duration
+        self.samples = samples
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started": round(self.started, 3),
+            "duration_s": round(self.duration, 3),
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": sum(self.samples.values()),
+        }
+
+    def collapsed(self):
+        """
+        Piles repliées : une ligne `thread;appelant;...;appelé N` par pile distincte
+        """
+        lines = []
+        for (thread, stack), count in self.samples.most_common():
+            frames = [thread.replace(";", ":")] + [_frame_label(code).replace(";", ":") for code in stack]
+            lines.append(f"{';'.join(frames)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self):
+        """
+        Profil au format JSON de speedscope (https://www.speedscope.app), un profil échantillonné par thread
+        """
+        frames = []
+        frame_index = {}
+        by_thread = {}
+        for (thread, stack), count in self.samples.items():
+            indices = []
+            for code in stack:
+                if code not in frame_index:
+                    frame_index[code] = len(frames)
+                    frames.append({
+                        "name": code.co_name,
+                        "file": _short_path(code.co_filename),
+                        "line": code.co_firstlineno,
+                    })
+                indices.append(frame_index[code])
+            by_thread.setdefault(thread, []).append((indices, count * self.interval))
+        profiles = []
+        for thread, stacks in sorted(by_thread.items()):
+            total = sum(weight for _, weight in stacks)
+            profiles.append({
+                "type": "sampled",
+                "name": thread,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": [indices for indices, _ in stacks],
+                "weights": [weight for _, weight in stacks],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "ovh-proxy-llm",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+class StackSampler:
+    """
+    Relève la pile de tous les threads toutes les `interval` secondes, depuis un thread dédié
+    """
+
+    def __init__(self, name, interval=0.005, include_idle=False, profile_id=None):
+        self.name = name
+        self.profile_id = profile_id
+        self.interval = interval
+        self.include_idle = include_idle
+        self._samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run, name=f"{SAMPLER_THREAD_PREFIX}-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Arrête l'échantillonnage et retourne le profil"""
+        self._stop.set()
+        self._thread.join()
+        return Profile(self.name, self.interval, self._started, time.time() - self._started, self._samples,
+                       profile_id=self.profile_id)
+
+    def _run(self):
+        names = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident)
+                if name is None:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    name = names.get(ident, str(ident))
+                if name.startswith(SAMPLER_THREAD_PREFIX):
+                    continue
+                if not self.include_idle and _is_idle(frame.f_code):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                self._samples[(name, tuple(stack))] += 1
+
+class ProfileStore:
+    """
+    Conserve les `max_profiles` derniers profils en mémoire, et les écrit dans `directory` si fourni
+    """
+
+    def __init__(self, max_profiles=20, directory=None, max_active=4):
+        self.max_profiles = max_profiles
+        self.directory = Path(directory) if directory else None
+        self.max_active = max_active
+        self._profiles = OrderedDict()
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Réserve une place d'échantillonneur (les profils simultanés sont limités)"""
+        with self._lock:
+            if self._active >= self.max_active:
+                return False
+            self._active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        if self.directory is not None:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                with open(self.directory / f"{profile.id}.speedscope.json", "w") as f:
+                    json.dump(profile.speedscope(), f)
+            except OSError as e:
+                print(f"Erreur lors de l'écriture du profil {profile.id}: {str(e)}")
+        return profile
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [profile.summary() for profile in reversed(profiles)]
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI pur : une requête portant l'en-tête `X-Proxy-Profile: 1` et autorisée
+    par `authorize(scope)` est profilée, et l'identifiant du profil est renvoyé dans
+    l'en-tête X-Proxy-Profile-Id
+    """
+
+    def __init__(self, app, store, authorize, interval=0.005):
+        self.app = app
+        self.store = store
+        self.authorize = authorize
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope["headers"]:
+            if name == b"x-proxy-profile":
+                break
+        else:
+            await self.app(scope, receive, send)
+            return
+        if value.strip().lower() not in (b"1", b"true", b"yes") or not self.authorize(scope) or not self.store.acquire():
+            await self.app(scope, receive, send)
+            return
+
+        # L'identifiant est annoncé dès le début de la réponse, le profil couvre aussi le corps
+        profile_id = secrets.token_hex(6)
+        sampler = StackSampler(f"{scope.get('method')} {scope['path']}", interval=self.interval, profile_id=profile_id)
+
+        async def profile_send(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-proxy-profile-id", profile_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, profile_send)
+        finally:
+            profile = sampler.stop()
+            self.store.release()
+            await run_in_threadpool(self.store.add, profile)
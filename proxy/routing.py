@@ -0,0 +1,458 @@
+"""
+Table de routage des modèles vers les endpoints OVH
+
+La table est construite à partir des valeurs par défaut et du fichier
+`endpoints_config.json`, validée, puis publiée comme un objet immuable.
+Une requête récupère la table courante une seule fois et la garde jusqu'à
+la fin : un rechargement de la configuration n'affecte que les requêtes
+suivantes.
+"""
+
+import json
+import os
+import random
+import threading
+from collections import namedtuple
+from pathlib import Path
+from types import MappingProxyType
+
+# Liste des endpoints OVH pour chaque modèle
+# Les noms des modèles doivent être ceux utilisés par l'API OVH
+# Note: Ces clés peuvent être différentes des noms internes utilisés par l'API
+DEFAULT_ENDPOINTS = {
+    "mistral-7b-instruct-v0.3": "https://mistral-7b-instruct-v0-3.endpoints.kepler.ai.cloud.ovh.net",
+    "mixtral-8x7b-instruct-v0.1": "https://mixtral-8x7b-instruct-v01.endpoints.kepler.ai.cloud.ovh.net",
+    "mistral-nemo-instruct-2407": "https://mistral-nemo-instruct-2407.endpoints.kepler.ai.cloud.ovh.net",
+    "llama-3-1-8b-instruct": "https://llama-3-1-8b-instruct.endpoints.kepler.ai.cloud.ovh.net",
+    "llama-3-3-70b-instruct": "https://llama-3-3-70b-instruct.endpoints.kepler.ai.cloud.ovh.net",
+    "llama-3-1-70b-instruct": "https://llama-3-1-70b-instruct.endpoints.kepler.ai.cloud.ovh.net",
+    "deepseek-r1-distill-llama-70b": "https://deepseek-r1-distill-llama-70b.endpoints.kepler.ai.cloud.ovh.net",
+    "mamba-codestral-7b-v0-1": "https://mamba-codestral-7b-v0-1.endpoints.kepler.ai.cloud.ovh.net",
+    "stable-diffusion-xl": "https://stable-diffusion-xl.endpoints.kepler.ai.cloud.ovh.net"
+}
+
+# Dictionnaire de correspondance entre nos noms de modèles et ceux d'OVH
+DEFAULT_MODEL_NAME_MAP = {
+    "mistral-7b-instruct-v0.3": "Mistral-7B-Instruct-v0.3",
+    "mixtral-8x7b-instruct-v0.1": "Mixtral-8x7B-Instruct-v0.1",
+    "mistral-nemo-instruct-2407": "Mistral-Nemo-Instruct-2407",
+    "llama-3-1-8b-instruct": "Llama-3.1-8B-Instruct",
+    "llama-3-3-70b-instruct": "Meta-Llama-3_3-70B-Instruct",
+    "llama-3-1-70b-instruct": "Meta-Llama-3_1-70B-Instruct",
+    "deepseek-r1-distill-llama-70b": "DeepSeek-R1-Distill-Llama-70B",
+    "mamba-codestral-7b-v0-1": "mamba-codestral-7B-v0.1"
+}
+
+# Groupes de modèles équivalents : quand un modèle est saturé, la requête passe aux
+# autres membres de son groupe, dans l'ordre du groupe
+DEFAULT_MODEL_GROUPS = (
+    ("llama-3-3-70b-instruct", "llama-3-1-70b-instruct"),
+)
+
+# Modèle virtuel `auto` : la première règle dont les conditions sont remplies (classe de la
+# requête, taille estimée du prompt, charge du modèle) choisit le modèle réel ; la dernière
+# règle sert de modèle par défaut
+DEFAULT_AUTO_ROUTING = {
+    "name": "auto",
+    "max_in_flight": 8,
+    "max_p95_seconds": 15,
+    "rules": [
+        {"model": "llama-3-1-8b-instruct", "classes": ["general"], "max_prompt_tokens": 1000},
+        {"model": "mamba-codestral-7b-v0-1", "classes": ["code"], "max_prompt_tokens": 16000},
+        {"model": "mistral-nemo-instruct-2407", "classes": ["general"], "max_prompt_tokens": 8000},
+        {"model": "llama-3-3-70b-instruct"},
+    ],
+}
+
+AUTO_CLASSES = ("general", "explain", "code")
+
+AutoRule = namedtuple("AutoRule", ["model", "classes", "max_prompt_tokens", "max_in_flight", "max_p95_seconds"])
+AutoPolicy = namedtuple("AutoPolicy", ["name", "rules"])
+
+EndpointTarget = namedtuple("EndpointTarget", ["url", "weight", "token"])
+
+class RoutingConfigError(ValueError):
+    """Configuration de routage invalide"""
+
+class ModelRoute(namedtuple("ModelRoute", ["name", "upstream_name", "targets", "weighted", "context_length"], defaults=(None,))):
+    """
+    Routage d'un modèle : le premier endpoint est le principal, les suivants sont les alternatifs
+    """
+    __slots__ = ()
+
+    @property
+    def primary(self):
+        return self.targets[0]
+
+    def ordered_targets(self):
+        """
+        Ordre d'essai des endpoints : ordre de la configuration, ou tirage pondéré
+        sans remise si des poids ont été configurés pour ce modèle
+        """
+        if not self.weighted or len(self.targets) < 2:
+            return self.targets
+        return tuple(sorted(self.targets, key=lambda t: random.random() ** (1.0 / t.weight), reverse=True))
+
+class RoutingTable:
+    """
+    Table de routage immuable
+    """
+
+    def __init__(self, models, version=0, source=None, mtime=None, groups=(), auto_policy=None):
+        self.models = MappingProxyType(dict(models))
+        self.auto_policy = auto_policy
+        self.version = version
+        self.source = source
+        self.mtime = mtime
+        self.groups = tuple(tuple(group) for group in groups)
+        # Modèles de repli de chaque modèle : les autres membres de ses groupes, dans l'ordre
+        fallbacks = {}
+        for group in self.groups:
+            for model in group:
+                chain = fallbacks.setdefault(model, [])
+                chain.extend(other for other in group if other != model and other not in chain)
+        self.fallbacks = MappingProxyType({model: tuple(chain) for model, chain in fallbacks.items() if chain})
+        # Vues de compatibilité : endpoint principal et liste des alternatifs par modèle
+        self.endpoints = MappingProxyType({name: route.primary.url for name, route in self.models.items()})
+        self.alternative_endpoints = MappingProxyType({
+            name: tuple(target.url for target in route.targets[1:])
+            for name, route in self.models.items() if len(route.targets) > 1
+        })
+        self.urls = frozenset(target.url for route in self.models.values() for target in route.targets)
+
+    def get(self, model_name):
+        return self.models.get(model_name)
+
+    def equivalents(self, model_name):
+        """Le modèle suivi de ses modèles de repli"""
+        return (model_name,) + self.fallbacks.get(model_name, ())
+
+def _is_url(value):
+    return isinstance(value, str) and value.startswith(("http://", "https://"))
+
+def _parse_target(spec, tokens, default_token, errors, where):
+    """
+    Accepte "url", [url], [url, index_token] ou {"url", "weight", "token_index", "token_env"}
+    """
+    weight = None
+    token_index = 0
+    token_env = None
+    if isinstance(spec, str):
+        url = spec
+    elif isinstance(spec, list) and spec:
+        url = spec[0]
+        if len(spec) > 1:
+            token_index = spec[1]
+    elif isinstance(spec, dict):
+        url = spec.get("url")
+        weight = spec.get("weight")
+        token_index = spec.get("token_index", 0)
+        token_env = spec.get("token_env")
+    else:
+        errors.append(f"{where}: format d'endpoint incorrect: {spec!r}")
+        return None
+
+    if not _is_url(url):
+        errors.append(f"{where}: URL invalide: {url!r}")
+        return None
+    url = url.rstrip("/")
+    if weight is not None and (isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0):
+        errors.append(f"{where}: poids invalide pour {url}: {weight!r}")
+        return None
+
+    if token_env is not None:
+        token = os.getenv(token_env)
+        if not token:
+            errors.append(f"{where}: variable d'environnement {token_env} non définie pour {url}")
+            return None
+    elif not tokens:
+        # Sans liste de tokens, l'index est ignoré et le token principal est utilisé pour tous les endpoints
+        token = default_token
+    else:
+        if isinstance(token_index, bool) or not isinstance(token_index, int) or token_index < 0 or token_index > len(tokens):
+            errors.append(f"{where}: index de token invalide pour {url}: {token_index!r}")
+            return None
+        token = default_token if token_index == 0 else tokens[token_index - 1]
+        if not token:
+            errors.append(f"{where}: token {token_index} non défini pour {url}")
+            return None
+    return EndpointTarget(url, weight, token)
+
+def build_routing_table(config, default_token, version=0, source=None, mtime=None, discovered=None):
+    """
+    Construit et valide une table de routage à partir du contenu de `endpoints_config.json`
+    et, si fourni, du résultat de la découverte des modèles (`discovered`, {modèle: {"upstream_name",
+    "context_length"}}) : la découverte remplace les valeurs par défaut, la configuration explicite
+    reste prioritaire
+
+    Format accepté (toutes les sections sont optionnelles) :
+    - "endpoints": {modèle: "url" | {"url", "upstream_name", "weight", "token_index", "token_env"} | null}
+      complète ou remplace les endpoints par défaut (null retire le modèle)
+    - "alternative_endpoints": {modèle: ["url" | [url, index_token] | {"url", "weight", ...}]}
+    - "tokens": ["NOM_VARIABLE_ENV", ...], référencés par index à partir de 1 (0 = token principal)
+    - "context_lengths": {modèle: taille de la fenêtre de contexte en tokens}, aussi
+      accepté sous la clé "context_length" de la forme objet d'un endpoint
+    - "model_groups": [[modèle, modèle, ...], ...] groupes de modèles équivalents, dans
+      l'ordre de repli (remplace DEFAULT_MODEL_GROUPS)
+    - "auto_routing": politique du modèle virtuel `auto` (remplace DEFAULT_AUTO_ROUTING,
+      null le désactive)
+    """
+    if not isinstance(config, dict):
+        raise RoutingConfigError("La configuration doit être un objet JSON")
+    errors = []
+
+    token_envs = config.get("tokens", [])
+    if not isinstance(token_envs, list) or not all(isinstance(name, str) for name in token_envs):
+        raise RoutingConfigError("'tokens' doit être une liste de noms de variables d'environnement")
+    tokens = [os.getenv(name) for name in token_envs]
+
+    configured_context_lengths = config.get("context_lengths", {})
+    if not isinstance(configured_context_lengths, dict):
+        raise RoutingConfigError("'context_lengths' doit être un objet {modèle: nombre de tokens}")
+
+    primaries = dict(DEFAULT_ENDPOINTS)
+    upstream_names = dict(DEFAULT_MODEL_NAME_MAP)
+    context_lengths = {}
+    for model, info in (discovered or {}).items():
+        if info.get("upstream_name"):
+            upstream_names[model] = info["upstream_name"]
+        if info.get("context_length"):
+            context_lengths[model] = info["context_length"]
+    context_lengths.update(configured_context_lengths)
+    configured_endpoints = config.get("endpoints", {})
+    if not isinstance(configured_endpoints, dict):
+        raise RoutingConfigError("'endpoints' doit être un objet {modèle: endpoint}")
+    for model, spec in configured_endpoints.items():
+        if spec is None:
+            primaries.pop(model, None)
+            continue
+        if isinstance(spec, dict) and "upstream_name" in spec:
+            upstream_names[model] = spec["upstream_name"]
+        if isinstance(spec, dict) and "context_length" in spec:
+            context_lengths[model] = spec["context_length"]
+        primaries[model] = spec
+
+    alternatives = config.get("alternative_endpoints", {})
+    if not isinstance(alternatives, dict):
+        raise RoutingConfigError("'alternative_endpoints' doit être un objet {modèle: [endpoints]}")
+
+    models = {}
+    for model in list(primaries.keys()) + [m for m in alternatives.keys() if m not in primaries]:
+        if not isinstance(model, str) or not model or ":" in model:
+            errors.append(f"Nom de modèle invalide: {model!r}")
+            continue
+        targets = []
+        if model in primaries:
+            target = _parse_target(primaries[model], tokens, default_token, errors, model)
+            if target:
+                targets.append(target)
+        alt_specs = alternatives.get(model, [])
+        if not isinstance(alt_specs, list):
+            errors.append(f"{model}: la liste des endpoints alternatifs doit être un tableau")
+            continue
+        for spec in alt_specs:
+            target = _parse_target(spec, tokens, default_token, errors, f"{model} (alternatif)")
+            if target and target.url not in [t.url for t in targets]:
+                targets.append(target)
+        if not targets:
+            continue
+        context_length = context_lengths.get(model)
+        if context_length is not None and (isinstance(context_length, bool) or not isinstance(context_length, int) or context_length <= 0):
+            errors.append(f"{model}: taille de contexte invalide: {context_length!r}")
+            continue
+        weighted = any(target.weight is not None for target in targets)
+        targets = tuple(target._replace(weight=target.weight or 1.0) for target in targets)
+        models[model] = ModelRoute(model, upstream_names.get(model, model), targets, weighted, context_length)
+
+    configured_groups = config.get("model_groups")
+    if configured_groups is None:
+        # Les groupes par défaut ne retiennent que les modèles présents dans la table
+        groups = [[model for model in group if model in models] for group in DEFAULT_MODEL_GROUPS]
+    elif not isinstance(configured_groups, list) or not all(isinstance(group, list) for group in configured_groups):
+        raise RoutingConfigError("'model_groups' doit être une liste de groupes [modèle, ...]")
+    else:
+        groups = configured_groups
+        for group in groups:
+            for model in group:
+                if not isinstance(model, str) or model not in models:
+                    errors.append(f"model_groups: modèle inconnu: {model!r}")
+    groups = [group for group in groups if len(group) > 1]
+
+    auto_policy = _parse_auto_policy(config.get("auto_routing", DEFAULT_AUTO_ROUTING), models, errors,
+                                     strict="auto_routing" in config)
+
+    if errors:
+        raise RoutingConfigError("; ".join(errors))
+    return RoutingTable(models, version=version, source=source, mtime=mtime, groups=groups, auto_policy=auto_policy)
+
+def _positive_number(value):
+    return value is None or (not isinstance(value, bool) and isinstance(value, (int, float)) and value > 0)
+
+def _parse_auto_policy(spec, models, errors, strict):
+    """
+    Valide la politique du modèle virtuel `auto`. Avec la politique par défaut (`strict` faux),
+    les règles visant un modèle absent de la table sont ignorées au lieu d'être refusées.
+    """
+    if spec is None:
+        return None
+    if not isinstance(spec, dict) or not isinstance(spec.get("rules"), list):
+        errors.append("auto_routing: objet attendu avec une liste 'rules'")
+        return None
+    name = spec.get("name", "auto")
+    if not isinstance(name, str) or not name or ":" in name or name in models:
+        errors.append(f"auto_routing: nom de modèle virtuel invalide: {name!r}")
+        return None
+    defaults = {key: spec.get(key) for key in ("max_in_flight", "max_p95_seconds")}
+    for key, value in defaults.items():
+        if not _positive_number(value):
+            errors.append(f"auto_routing: {key} invalide: {value!r}")
+    rules = []
+    for index, rule in enumerate(spec["rules"]):
+        where = f"auto_routing: règle {index + 1}"
+        if not isinstance(rule, dict) or not isinstance(rule.get("model"), str):
+            errors.append(f"{where}: objet avec un champ 'model' attendu")
+            continue
+        if rule["model"] not in models:
+            if strict:
+                errors.append(f"{where}: modèle inconnu: {rule['model']!r}")
+            continue
+        classes = rule.get("classes")
+        if classes is not None and (not isinstance(classes, list) or not set(classes) <= set(AUTO_CLASSES)):
+            errors.append(f"{where}: classes invalides: {classes!r} (attendu: {', '.join(AUTO_CLASSES)})")
+            continue
+        limits = {
+            "max_prompt_tokens": rule.get("max_prompt_tokens"),
+            "max_in_flight": rule.get("max_in_flight", defaults["max_in_flight"]),
+            "max_p95_seconds": rule.get("max_p95_seconds", defaults["max_p95_seconds"]),
+        }
+        invalid = [key for key, value in limits.items() if not _positive_number(value)]
+        if invalid:
+            errors.append(f"{where}: valeur invalide pour {', '.join(invalid)}")
+            continue
+        rules.append(AutoRule(rule["model"], frozenset(classes) if classes else None, **limits))
+    if not rules:
+        return None
+    return AutoPolicy(name, tuple(rules))
+
+def default_config_path():
+    """
+    Chemin du fichier de configuration : ENDPOINTS_CONFIG_PATH, sinon le répertoire courant,
+    sinon le répertoire du proxy
+    """
+    env_path = os.getenv("ENDPOINTS_CONFIG_PATH")
+    if env_path:
+        return Path(env_path)
+    cwd_path = Path("endpoints_config.json")
+    if cwd_path.exists():
+        return cwd_path
+    return Path(__file__).parent / "endpoints_config.json"
+
+class RoutingManager:
+    """
+    Détient la table de routage courante et la remplace atomiquement quand le fichier change
+    """
+
+    def __init__(self, config_path, default_token):
+        self.config_path = Path(config_path)
+        self.default_token = default_token
+        self.current = build_routing_table({}, default_token)
+        self.discovered = {}
+        self.last_error = None
+        self._config = {}
+        self._failed_mtime = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback):
+        """Enregistre une fonction appelée avec (ancienne_table, nouvelle_table) après chaque remplacement"""
+        self._listeners.append(callback)
+
+    def _stat(self):
+        try:
+            stat = self.config_path.stat()
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def reload(self, force=False):
+        """
+        Recharge la configuration si le fichier a changé (ou si `force`).
+        Retourne True si une nouvelle table a été publiée. En cas d'erreur de
+        validation, l'ancienne table est conservée et l'erreur est levée.
+        """
+        with self._lock:
+            mtime = self._stat()
+            if not force and mtime in (self.current.mtime, self._failed_mtime):
+                return False
+            config = {}
+            if mtime is not None:
+                try:
+                    with open(self.config_path, "r") as f:
+                        config = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    self.last_error = f"Lecture de {self.config_path} impossible: {str(e)}"
+                    self._failed_mtime = mtime
+                    raise RoutingConfigError(self.last_error)
+            try:
+                table = build_routing_table(
+                    config, self.default_token, version=self.current.version + 1,
+                    source=str(self.config_path) if mtime is not None else None, mtime=mtime,
+                    discovered=self.discovered,
+                )
+            except RoutingConfigError as e:
+                self.last_error = str(e)
+                self._failed_mtime = mtime
+                raise
+            old_table, self.current = self.current, table
+            self._config = config
+            self.last_error = None
+            self._failed_mtime = None
+        self._notify(old_table, table)
+        return True
+
+    def set_discovered(self, discovered):
+        """
+        Applique le résultat de la découverte des modèles (noms OVH, tailles de contexte)
+        et publie une nouvelle table construite avec la dernière configuration valide
+        """
+        with self._lock:
+            current = self.current
+            table = build_routing_table(
+                self._config, self.default_token, version=current.version + 1,
+                source=current.source, mtime=current.mtime, discovered=discovered,
+            )
+            self.discovered = dict(discovered)
+            old_table, self.current = current, table
+        self._notify(old_table, table)
+
+    def _notify(self, old_table, table):
+        for callback in self._listeners:
+            try:
+                callback(old_table, table)
+            except Exception as e:
+                print(f"Erreur lors de la notification du rechargement de la configuration: {str(e)}")
+
+    def start_watching(self, interval=5.0):
+        """Surveille le fichier de configuration (scrutation du mtime) dans un thread dédié"""
+        if self._thread is not None or interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, args=(interval,), name="routing-watcher", daemon=True)
+        self._thread.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                if self.reload():
+                    print(f"Configuration des endpoints rechargée depuis {self.config_path} (version {self.current.version})")
+            except RoutingConfigError as e:
+                # L'erreur n'est signalée qu'une fois : on réessaiera au prochain changement du fichier
+                print(f"Configuration des endpoints invalide, ancienne table conservée: {str(e)}")
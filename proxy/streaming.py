@@ -0,0 +1,256 @@
+"""
+Appels OVH en flux pour les clients qui attendent une réponse complète
+
+Même quand le client ne demande pas de flux, la requête est envoyée à OVH
+avec `stream: true` : le premier token arrive bien avant la fin de la
+génération, ce qui permet de mesurer le délai avant le premier token
+(TTFT) et le débit de chaque requête, et de détecter un endpoint bloqué
+(pas de premier token, ou silence au milieu de la génération) sans
+attendre le timeout global de 60 secondes.
+
+Les événements SSE sont assemblés au fil de l'eau en une réponse
+OpenAI complète (`chat.completion` ou `text_completion`) : les fragments
+de texte sont conservés dans une liste et joints une seule fois à la fin,
+sans copie intermédiaire du texte déjà reçu.
+"""
+
+import time
+
+import requests
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+try:
+    from proxy import fastjson
+except ImportError:
+    import fastjson
+
+class UpstreamStalled(Exception):
+    """
+    L'endpoint n'a pas produit de premier token à temps (`phase` = "ttft")
+    ou s'est tu au milieu de la génération (`phase` = "idle")
+    """
+
+    def __init__(self, phase, timeout):
+        self.phase = phase
+        self.timeout = timeout
+        if phase == "ttft":
+            message = f"Aucun token reçu d'OVH après {timeout:g} secondes"
+        else:
+            message = f"Flux OVH interrompu: aucun token depuis {timeout:g} secondes"
+        super().__init__(message)
+
+class EmptyUpstreamResponse(Exception):
+    """
+    OVH a répondu 200 sans aucun événement exploitable : flux vide, ou corps
+    non-SSE qui n'est pas une réponse complète (page d'erreur d'un intermédiaire)
+    """
+
+def iter_sse_data(chunks):
+    """
+    Extrait le contenu des lignes `data:` d'un flux SSE reçu par morceaux quelconques,
+    jusqu'à `data: [DONE]`
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            if buffer.startswith(b"data:", start):
+                data = bytes(buffer[start + 5:end]).strip()
+                if data == b"[DONE]":
+                    return
+                if data:
+                    yield data
+            start = end + 1
+        # Seule la ligne incomplète reste dans le tampon
+        del buffer[:start]
+
+class _Choice:
+    __slots__ = ("parts", "role", "finish_reason", "tool_calls", "logprobs")
+
+    def __init__(self):
+        self.parts = []
+        self.role = None
+        self.finish_reason = None
+        self.tool_calls = {}
+        self.logprobs = None
+
+class CompletionAssembler:
+    """
+    Reconstruit la réponse complète d'OVH à partir des événements de son flux
+    (`route` = "chat" ou "completions")
+    """
+
+    def __init__(self, route):
+        self.chat = route == "chat"
+        self.meta = {}
+        self.choices = {}
+        self.usage = None
+        self.token_events = 0
+        self.first_token_at = None
+        self.last_token_at = None
+        # Réponse complète reçue telle quelle (OVH a ignoré `stream`)
+        self.complete = None
+
+    def feed(self, event):
+        """
+        Ajoute un événement décodé ; retourne True s'il contient du texte généré
+        """
+        for key in ("id", "created", "model", "system_fingerprint"):
+            if key not in self.meta and event.get(key) is not None:
+                self.meta[key] = event[key]
+        if event.get("usage"):
+            self.usage = event["usage"]
+        produced = False
+        for choice in event.get("choices") or ():
+            state = self.choices.get(choice.get("index", 0))
+            if state is None:
+                state = self.choices[choice.get("index", 0)] = _Choice()
+            if self.chat:
+                delta = choice.get("delta") or {}
+                text = delta.get("content")
+                if delta.get("role"):
+                    state.role = delta["role"]
+                if delta.get("tool_calls"):
+                    self._merge_tool_calls(state, delta["tool_calls"])
+                    produced = True
+            else:
+                text = choice.get("text")
+                if text is None and choice.get("delta"):
+                    text = choice["delta"].get("content")
+            if text:
+                state.parts.append(text)
+                produced = True
+            if choice.get("logprobs"):
+                state.logprobs = choice["logprobs"]
+            if choice.get("finish_reason"):
+                state.finish_reason = choice["finish_reason"]
+        if produced:
+            self.token_events += 1
+            self.last_token_at = time.perf_counter()
+            if self.first_token_at is None:
+                self.first_token_at = self.last_token_at
+        return produced
+
+    @staticmethod
+    def _merge_tool_calls(state, fragments):
+        for fragment in fragments:
+            call = state.tool_calls.get(fragment.get("index", 0))
+            if call is None:
+                call = state.tool_calls[fragment.get("index", 0)] = {
+                    "id": None, "type": "function", "name": None, "arguments": [],
+                }
+            if fragment.get("id"):
+                call["id"] = fragment["id"]
+            if fragment.get("type"):
+                call["type"] = fragment["type"]
+            function = fragment.get("function") or {}
+            if function.get("name"):
+                call["name"] = function["name"]
+            if function.get("arguments"):
+                call["arguments"].append(function["arguments"])
+
+    def adopt(self, completion):
+        """
+        Reprend une réponse complète non-streamée : elle sera retournée telle quelle
+        (sans délai avant le premier token, le texte étant arrivé d'un bloc)
+        """
+        self.complete = completion
+        self.usage = completion.get("usage") or None
+
+    def completion_tokens(self):
+        """Tokens générés : compteur d'OVH s'il est fourni, sinon nombre d'événements porteurs de texte"""
+        if self.usage and self.usage.get("completion_tokens") is not None:
+            return self.usage["completion_tokens"]
+        return self.token_events
+
+    def result(self):
+        """Réponse complète, au format de la réponse non-streamée d'OVH"""
+        if self.complete is not None:
+            return self.complete
+        choices = []
+        for index in sorted(self.choices):
+            state = self.choices[index]
+            text = "".join(state.parts)
+            choice = {"index": index}
+            if self.chat:
+                message = {"role": state.role or "assistant", "content": text}
+                if state.tool_calls:
+                    message["tool_calls"] = [
+                        {
+                            "id": call["id"],
+                            "type": call["type"],
+                            "function": {"name": call["name"], "arguments": "".join(call["arguments"])},
+                        }
+                        for _, call in sorted(state.tool_calls.items())
+                    ]
+                    if not text:
+                        message["content"] = None
+                choice["message"] = message
+            else:
+                choice["text"] = text
+            choice["logprobs"] = state.logprobs
+            choice["finish_reason"] = state.finish_reason
+            choices.append(choice)
+        result = {
+            "id": self.meta.get("id"),
+            "object": "chat.completion" if self.chat else "text_completion",
+            "created": self.meta.get("created", int(time.time())),
+            "model": self.meta.get("model"),
+            "choices": choices,
+        }
+        if "system_fingerprint" in self.meta:
+            result["system_fingerprint"] = self.meta["system_fingerprint"]
+        if self.usage:
+            result["usage"] = self.usage
+        return result
+
+def read_completion(response, route, started, ttft_timeout, idle_timeout, set_read_timeout=None):
+    """
+    Lit le flux SSE d'une réponse OVH (ouverte avec `stream=True`, timeout de lecture
+    = `ttft_timeout`) et retourne l'assembleur rempli. `started` est l'instant
+    (perf_counter) de l'envoi de la requête. Après le premier token, le timeout de
+    lecture du socket passe à `idle_timeout` via `set_read_timeout(response, secondes)`.
+    Lève UpstreamStalled si l'endpoint ne produit pas de token à temps, et
+    EmptyUpstreamResponse s'il n'envoie aucun événement. Un corps qui n'est pas un
+    flux SSE (`stream` ignoré) est repris comme réponse complète.
+    """
+    assembler = CompletionAssembler(route)
+    if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+        try:
+            completion = fastjson.loads(response.content)
+        except ValueError:
+            completion = None
+        if not isinstance(completion, dict) or not completion.get("choices"):
+            raise EmptyUpstreamResponse("Réponse OVH sans flux SSE ni réponse complète")
+        assembler.adopt(completion)
+        return assembler
+    try:
+        for data in iter_sse_data(response.iter_content(chunk_size=None)):
+            first = assembler.first_token_at is None
+            if assembler.feed(fastjson.loads(data)):
+                if first and set_read_timeout is not None:
+                    set_read_timeout(response, idle_timeout)
+            elif first and time.perf_counter() - started > ttft_timeout:
+                # Des événements arrivent (rôle, keep-alive) mais toujours aucun token
+                raise UpstreamStalled("ttft", ttft_timeout)
+    except (requests.exceptions.ConnectionError, ProtocolError) as e:
+        if not _is_read_timeout(e):
+            raise
+        if assembler.first_token_at is None:
+            raise UpstreamStalled("ttft", ttft_timeout) from e
+        raise UpstreamStalled("idle", idle_timeout) from e
+    if not assembler.choices:
+        raise EmptyUpstreamResponse("Flux OVH terminé sans aucun événement")
+    return assembler
+
+def _is_read_timeout(error):
+    # requests enveloppe le ReadTimeoutError d'urllib3 levé pendant la lecture du flux
+    while error is not None:
+        if isinstance(error, (ReadTimeoutError, TimeoutError)):
+            return True
+        error = error.args[0] if error.args and isinstance(error.args[0], BaseException) else None
+    return False
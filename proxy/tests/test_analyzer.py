@@ -0,0 +1,60 @@
+"""
+Tests unitaires de l'analyse des requêtes de chat (analyzer.RequestAnalyzer)
+"""
+
+from proxy.analyzer import CODE, EXPLAIN, REASONING, RequestAnalyzer, scan_text
+
+def test_scan_text_classes():
+    """Chaque mot-clé donne ses classes, sans tenir compte de la casse"""
+    assert scan_text("Bonjour, ça va ?") == 0
+    assert scan_text("Écris un SCRIPT bash") == CODE
+    assert scan_text("Explique-moi la photosynthèse") == EXPLAIN | REASONING
+    assert scan_text("comment vas-tu ?") == REASONING
+    assert scan_text("Comment fonctionne une API ?") == EXPLAIN | REASONING | CODE
+
+def test_scan_text_nested_keywords():
+    """Un mot-clé qui en contient un autre hérite de ses classes ("fonctionne" contient "fonction")"""
+    assert scan_text("ça fonctionne") == REASONING | CODE
+    assert scan_text("donne le détail") == EXPLAIN | REASONING
+
+def test_analyze_messages_features():
+    """Classes, taille et nombre de messages ; les contenus non textuels sont ignorés"""
+    analyzer = RequestAnalyzer()
+    features = analyzer.analyze_messages([
+        {"role": "system", "content": "Tu es un assistant."},
+        {"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:..."}}]},
+        {"role": "user", "content": "Écris une fonction Python"},
+    ])
+    assert features.messages == 3
+    assert features.chars == len("Tu es un assistant.") + len("Écris une fonction Python")
+    assert features.code and not features.explain
+    assert features.request_class == "code"
+
+def test_analyze_messages_empty():
+    """Un historique absent ou vide donne une requête générale"""
+    features = RequestAnalyzer().analyze_messages(None)
+    assert features == (0, 0, 0, 0)
+    assert features.request_class == "general"
+
+def test_long_messages_are_cached():
+    """Un message long déjà analysé n'est pas parcouru une seconde fois ; les messages courts ne sont pas mis en cache"""
+    analyzer = RequestAnalyzer(min_cached_chars=50)
+    history = [{"role": "user", "content": "Explique en détail " + "x" * 100}, {"role": "user", "content": "et le code ?"}]
+    first = analyzer.analyze_messages(history)
+    second = analyzer.analyze_messages(history)
+    assert first.scanned_messages == 2
+    assert second.scanned_messages == 1
+    assert first.classes == second.classes == EXPLAIN | REASONING | CODE
+
+def test_cache_is_bounded():
+    """Le cache LRU ne dépasse pas `cache_size` entrées"""
+    analyzer = RequestAnalyzer(cache_size=2, min_cached_chars=1)
+    for index in range(5):
+        analyzer.analyze_messages([{"role": "user", "content": f"message {index}"}])
+    assert len(analyzer._cache) == 2
+
+def test_analyze_text():
+    """Un prompt simple (/api/generate) est analysé comme un message unique"""
+    analyzer = RequestAnalyzer()
+    assert analyzer.analyze_text("Explique ce programme").classes == EXPLAIN | REASONING | CODE
+    assert analyzer.analyze_text(None) == (0, 0, 0, 0)
@@ -7,6 +7,8 @@ import requests
 import json
 import sys
 import os
+import asyncio
+import websockets
 
 # Configuration
 SERVER_URL = "http://localhost:8000"  # URL du serveur à tester
@@ -109,6 +111,38 @@ def test_list_models():
         print(f"  → Erreur: {str(e)}")
         return False
 
+def test_models_etag():
+    """Test de la revalidation du catalogue des modèles (ETag / If-None-Match)"""
+    print_header("Test de la revalidation du catalogue des modèles")
+    
+    url = f"{SERVER_URL}/v1/models"
+    try:
+        response = requests.get(url, timeout=5)
+        etag = response.headers.get("ETag")
+        print(f"Status code reçu: {response.status_code}, ETag: {etag}")
+        
+        assert response.status_code == 200, "La liste des modèles n'a pas été retournée"
+        assert etag, "La réponse ne contient pas d'ETag"
+        
+        # Une seconde requête avec l'ETag doit retourner 304 sans corps
+        response = requests.get(url, headers={"If-None-Match": etag}, timeout=5)
+        print(f"Status code reçu avec If-None-Match: {response.status_code}")
+        
+        if response.status_code == 304 and not response.content:
+            print("✅ RÉUSSI - Revalidation du catalogue")
+            print(f"  → Status code: {response.status_code}, ETag: {etag}")
+            return True
+        else:
+            print("❌ ÉCHEC - Revalidation du catalogue")
+            print(f"  → Status code: {response.status_code}")
+            return False
+            
+    except Exception as e:
+        print(f"Exception détaillée: {e.__class__.__name__}: {str(e)}")
+        print("❌ ÉCHEC - Revalidation du catalogue")
+        print(f"  → Erreur: {str(e)}")
+        return False
+
 def test_diagnostic():
     """Test de l'endpoint de diagnostic"""
     print_header("Test de l'endpoint de diagnostic")
@@ -181,6 +215,56 @@ def test_chat_completions():
         print(f"  → Erreur: {str(e)}")
         return False
 
+def test_chat_websocket():
+    """Test du canal WebSocket : trames binaires, identifiant en double et annulation"""
+    print_header("Test du canal WebSocket de chat")
+    
+    url = SERVER_URL.replace("http", "ws", 1) + "/v1/chat/ws"
+    chat = {"type": "chat", "id": "ws-1", "body": {
+        "model": "mistral-7b-instruct-v0.3",
+        "messages": [{"role": "user", "content": "Raconte une longue histoire."}],
+        "max_tokens": 200,
+    }}
+    
+    async def scenario():
+        async with websockets.connect(url) as ws:
+            # Trame binaire non UTF-8 : erreur 400, le canal reste ouvert
+            await ws.send(b"\xff\xfe")
+            invalid = json.loads(await asyncio.wait_for(ws.recv(), 5))
+            print(f"Trame binaire invalide: {json.dumps(invalid)}")
+            assert invalid["type"] == "error" and invalid["status"] == 400 and invalid["id"] is None, "Trame binaire invalide mal traitée"
+            
+            # Trame binaire contenant du JSON : décodée comme une trame texte
+            await ws.send(json.dumps({"type": "ping", "id": "bin"}).encode("utf-8"))
+            decoded = json.loads(await asyncio.wait_for(ws.recv(), 5))
+            print(f"Trame binaire JSON: {json.dumps(decoded)}")
+            assert decoded["type"] == "error" and decoded["id"] == "bin", "Trame binaire JSON non décodée"
+            
+            # Même identifiant deux fois : la seconde requête est refusée (409), puis annulation de la première
+            await ws.send(json.dumps(chat))
+            await ws.send(json.dumps(chat))
+            await ws.send(json.dumps({"type": "cancel", "id": "ws-1"}))
+            frames = []
+            while True:
+                frame = json.loads(await asyncio.wait_for(ws.recv(), 30))
+                frames.append(frame)
+                if frame["type"] in ("cancelled", "done") or (frame["type"] == "error" and frame["status"] != 409):
+                    break
+            print(f"Trames reçues: {[frame['type'] for frame in frames]}")
+            assert any(frame["type"] == "error" and frame["status"] == 409 for frame in frames), "Pas de refus 409 pour l'identifiant en double"
+            assert frames[-1]["type"] == "cancelled", "La requête n'a pas été annulée"
+    
+    try:
+        asyncio.run(scenario())
+        print("✅ RÉUSSI - Canal WebSocket")
+        print("  → Trames binaires, refus 409 et annulation vérifiés")
+        return True
+    except Exception as e:
+        print(f"Exception détaillée: {e.__class__.__name__}: {str(e)}")
+        print("❌ ÉCHEC - Canal WebSocket")
+        print(f"  → Erreur: {str(e)}")
+        return False
+
 def run_all_tests():
     """
     Exécute tous les tests et affiche un résumé
@@ -201,10 +285,12 @@ def run_all_tests():
     health_check_success = test_health_check()
     api_health_check_success = test_api_health_check()
     list_models_success = test_list_models()
+    models_etag_success = test_models_etag()
     diagnostic_success = test_diagnostic()
     
     # Exécuter les tests d'API
     chat_completions_success = test_chat_completions()
+    chat_websocket_success = test_chat_websocket()
     
     # Résumé des tests
     print("\n" + "=" * 80)
@@ -212,14 +298,14 @@ def run_all_tests():
     print("=" * 80)
     
     # Vérifier les tests de base
-    basic_tests_success = health_check_success and api_health_check_success and list_models_success and diagnostic_success
+    basic_tests_success = health_check_success and api_health_check_success and list_models_success and models_etag_success and diagnostic_success
     if basic_tests_success:
         print("Tests de base: ✅ RÉUSSI")
     else:
         print("Tests de base: ❌ ÉCHEC")
     
     # Vérifier les tests d'API
-    api_tests_success = chat_completions_success
+    api_tests_success = chat_completions_success and chat_websocket_success
     if api_tests_success:
         print("Test de l'API: ✅ RÉUSSI")
     else:
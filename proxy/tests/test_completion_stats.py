@@ -0,0 +1,69 @@
+"""
+Tests unitaires des statistiques de longueur des générations (completion_stats)
+"""
+
+from proxy.completion_stats import CompletionStats, percentile
+
+def test_percentile_nearest_rank():
+    """Percentile par la méthode du rang le plus proche"""
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 100) == 100
+    assert percentile(values, 0) == 1
+    assert percentile([7], 99) == 7
+    assert percentile([], 95) is None
+
+def test_learning_needs_enough_samples():
+    """Aucune valeur apprise tant que les échantillons sont insuffisants"""
+    stats = CompletionStats(min_samples=10, floor=1, ceiling=10000)
+    for _ in range(9):
+        stats.record("m", "/api/chat", "general", 100)
+    assert stats.default_max_tokens("m", "/api/chat", "general") is None
+    stats.record("m", "/api/chat", "general", 100)
+    assert stats.default_max_tokens("m", "/api/chat", "general") == 125
+    # Séries distinctes par modèle, route et classe de requête
+    assert stats.default_max_tokens("m", "/api/chat", "code") is None
+
+def test_learned_value_is_clamped():
+    """La valeur apprise (percentile plus marge) reste entre `floor` et `ceiling`"""
+    stats = CompletionStats(min_samples=1, percentile=95, headroom=0.25, floor=256, ceiling=1000)
+    stats.record("court", "r", "general", 10)
+    stats.record("long", "r", "general", 5000)
+    assert stats.default_max_tokens("court", "r", "general") == 256
+    assert stats.default_max_tokens("long", "r", "general") == 1000
+
+def test_window_keeps_recent_lengths():
+    """La fenêtre glissante ne garde que les dernières générations"""
+    stats = CompletionStats(min_samples=1, window=5, floor=1, headroom=0)
+    for _ in range(5):
+        stats.record("m", "r", "general", 1000)
+    for _ in range(5):
+        stats.record("m", "r", "general", 10)
+    assert stats.default_max_tokens("m", "r", "general") == 10
+    entry = stats.snapshot()[0]
+    assert entry["samples"] == 5 and entry["total"] == 10
+
+def test_invalid_lengths_are_ignored():
+    """Les longueurs absentes ou négatives ne sont pas enregistrées"""
+    stats = CompletionStats(min_samples=1)
+    stats.record("m", "r", "general", None)
+    stats.record("m", "r", "general", -1)
+    assert stats.snapshot() == []
+
+def test_snapshot_and_persistence(tmp_path):
+    """Les séries sont enregistrées puis rechargées à l'identique"""
+    path = tmp_path / "stats.json"
+    stats = CompletionStats(path, min_samples=2, floor=1)
+    stats.record("m", "r", "code", 100)
+    stats.record("m", "r", "code", 300, truncated=True)
+    stats.save()
+    entry = stats.snapshot(static_default=lambda model, request_class: 4000)[0]
+    assert entry["truncated_rate"] == 0.5
+    assert entry["completion_tokens"]["max"] == 300
+    assert entry["static_max_tokens"] == 4000
+
+    reloaded = CompletionStats(path, min_samples=2, floor=1)
+    assert reloaded.load() == 1
+    assert reloaded.snapshot() == stats.snapshot()
+    assert CompletionStats(tmp_path / "absent.json").load() == 0
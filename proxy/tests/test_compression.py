@@ -0,0 +1,103 @@
+"""
+Tests unitaires de la compression des réponses (middleware.CompressionMiddleware)
+"""
+
+import asyncio
+import gzip
+
+from proxy.middleware import CompressionMiddleware, choose_encoding
+
+AVAILABLE = {"zstd": None, "br": None, "gzip": None}
+
+def test_choose_encoding_q_values():
+    """Le choix suit les valeurs q du client, puis l'ordre de préférence du serveur"""
+    assert choose_encoding("", AVAILABLE) is None
+    assert choose_encoding("gzip", AVAILABLE) == "gzip"
+    assert choose_encoding("gzip, br, zstd", AVAILABLE) == "zstd"
+    assert choose_encoding("gzip;q=1.0, br;q=0.5", AVAILABLE) == "gzip"
+    assert choose_encoding("GZIP ; q=0.8, identity", AVAILABLE) == "gzip"
+    assert choose_encoding("*;q=0.1, zstd;q=0", AVAILABLE) == "br"
+    assert choose_encoding("gzip;q=0", AVAILABLE) is None
+    assert choose_encoding("gzip;q=abc, br", AVAILABLE) == "br"
+    assert choose_encoding("deflate", AVAILABLE) is None
+    assert choose_encoding("br, gzip", {"gzip": None}) == "gzip"
+
+def run(headers, chunks, accept_encoding=b"gzip", status=200, minimum_size=1024):
+    """Envoie une réponse à travers le middleware ; retourne les messages ASGI émis"""
+    sent = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        # Les en-têtes doivent être partis avant le premier morceau quand ils suffisent à décider
+        sent.append(("before_body", len(sent)))
+        for index, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": index < len(chunks) - 1})
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept_encoding)] if accept_encoding else []}
+    asyncio.run(CompressionMiddleware(app, minimum_size=minimum_size)(scope, None, send))
+    return sent
+
+def headers_of(sent):
+    return dict(next(m for m in sent if isinstance(m, dict) and m["type"] == "http.response.start")["headers"])
+
+def body_of(sent):
+    return b"".join(m.get("body", b"") for m in sent if isinstance(m, dict) and m["type"] == "http.response.body")
+
+def started_before_body(sent):
+    return sent[0] != ("before_body", 0)
+
+def test_large_json_is_compressed():
+    """Une réponse JSON assez grande est compressée, son ETag devient faible"""
+    body = b'{"data": "' + b"x" * 4000 + b'"}'
+    sent = run([(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"etag", b'"v1"')], [body])
+    headers = headers_of(sent)
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"content-length" not in headers
+    assert headers[b"etag"] == b'W/"v1"'
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert gzip.decompress(body_of(sent)) == body
+    assert started_before_body(sent)
+
+def test_small_response_is_not_compressed_but_varies():
+    """Une petite réponse part telle quelle, avec Vary pour les caches"""
+    sent = run([(b"content-type", b"application/json"), (b"content-length", b"2")], [b"{}"])
+    headers = headers_of(sent)
+    assert b"content-encoding" not in headers
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert body_of(sent) == b"{}"
+    assert started_before_body(sent)
+
+def test_vary_without_accept_encoding():
+    """Une réponse compressible porte Vary même si le client n'accepte pas la compression"""
+    sent = run([(b"content-type", b"application/json"), (b"vary", b"Origin")], [b"x" * 4000], accept_encoding=None)
+    headers = headers_of(sent)
+    assert b"content-encoding" not in headers
+    assert headers[b"vary"] == b"Origin, Accept-Encoding"
+
+def test_stream_headers_are_sent_immediately():
+    """Les en-têtes d'un flux SSE partent sans attendre le premier token, chaque morceau est vidé"""
+    events = [b"data: {\"n\": %d}\n\n" % index for index in range(3)]
+    sent = run([(b"content-type", b"text/event-stream")], events)
+    assert started_before_body(sent)
+    assert headers_of(sent)[b"content-encoding"] == b"gzip"
+    chunks = [m["body"] for m in sent if isinstance(m, dict) and m["type"] == "http.response.body"]
+    assert all(chunks[:-1])
+    assert gzip.decompress(b"".join(chunks)) == b"".join(events)
+
+def test_identity_responses_are_untouched():
+    """Types non compressibles et réponses déjà encodées passent sans délai ni modification"""
+    for headers in ([(b"content-type", b"image/png")], [(b"content-type", b"text/plain"), (b"content-encoding", b"br")]):
+        sent = run(headers, [b"x" * 4000])
+        assert headers_of(sent) == dict(headers)
+        assert body_of(sent) == b"x" * 4000
+        assert started_before_body(sent)
+
+def test_unknown_length_waits_for_first_chunk():
+    """Sans Content-Length ni flux, la décision attend le premier morceau du corps"""
+    sent = run([(b"content-type", b"application/json")], [b"x" * 10], minimum_size=5)
+    assert not started_before_body(sent)
+    assert headers_of(sent)[b"content-encoding"] == b"gzip"
+    assert gzip.decompress(body_of(sent)) == b"x" * 10
@@ -0,0 +1,102 @@
+"""
+Tests unitaires de l'ajustement de l'historique à la fenêtre de contexte (context.ContextWindowManager)
+"""
+
+from proxy.context import ELISION_MARKER, MESSAGE_OVERHEAD_TOKENS, ContextWindowManager, TokenEstimator, estimator_for
+
+def words(count, word="mot"):
+    return " ".join([word] * count)
+
+def test_estimator_takes_the_larger_heuristic():
+    """L'estimation retient le maximum entre l'heuristique octets et l'heuristique mots"""
+    estimator = TokenEstimator(4.0, 1.5)
+    assert estimator.count("") == 0
+    assert estimator.count("a b c d") == 6          # 4 mots x 1.5 > 7 octets / 4
+    assert estimator.count("x" * 400) == 100        # un seul mot, 400 octets / 4
+    assert estimator.count_message({"content": "x" * 400}) == 100 + MESSAGE_OVERHEAD_TOKENS
+    assert estimator.count_message({"content": [{"type": "text", "text": "x" * 400}, {"type": "image_url"}]}) == 104
+
+def test_estimator_family():
+    """L'estimateur dépend de la famille trouvée dans le nom du modèle"""
+    assert estimator_for("mamba-codestral-7b-v0-1").bytes_per_token == 3.0
+    assert estimator_for("llama-3-3-70b-instruct").bytes_per_token == 3.9
+    assert estimator_for("inconnu").bytes_per_token == 3.5
+
+def test_truncate_keeps_head_and_tail():
+    """L'élision garde le début et la fin du texte"""
+    estimator = TokenEstimator(1.0, 1.0)
+    text = "D" + "x" * 1000 + "F"
+    truncated = estimator.truncate(text, 100)
+    assert truncated.startswith("D") and truncated.endswith("F")
+    assert ELISION_MARKER in truncated
+    assert estimator.count(truncated) <= 100
+
+def test_history_within_budget_is_untouched():
+    """Un historique qui tient dans le budget est renvoyé tel quel"""
+    messages = [{"role": "user", "content": "Bonjour"}]
+    result = ContextWindowManager().fit("llama-3-3-70b-instruct", messages)
+    assert result.messages is messages
+    assert not result.trimmed
+
+def test_old_turns_are_dropped_first():
+    """Les messages système et les derniers tours sont gardés, les tours intermédiaires retirés"""
+    manager = ContextWindowManager(keep_last_turns=2, safety_ratio=0)
+    messages = [{"role": "system", "content": "Tu es un assistant."}]
+    for turn in range(10):
+        messages.append({"role": "user", "content": f"question {turn} " + words(100)})
+        messages.append({"role": "assistant", "content": f"réponse {turn} " + words(100)})
+    original = list(messages)
+    result = manager.fit("llama-3-3-70b-instruct", messages, context_length=1000)
+    assert messages == original
+    assert result.messages[0]["role"] == "system"
+    assert result.messages[-1] is messages[-1]
+    assert result.dropped_messages > 0 and result.final_tokens <= 1000
+    assert result.tokens_saved == result.original_tokens - result.final_tokens
+    # Les tours sont retirés en entier : après le message système, l'historique reprend sur une question
+    assert result.messages[1]["role"] == "user"
+
+def test_long_messages_are_elided_but_not_the_last_one():
+    """En dernier recours, les messages trop longs sont élidés, sauf la question en cours"""
+    manager = ContextWindowManager(keep_last_turns=1, safety_ratio=0)
+    question = "Résume ce document."
+    messages = [
+        {"role": "system", "content": words(2000)},
+        {"role": "user", "content": question},
+    ]
+    result = manager.fit("llama-3-3-70b-instruct", messages, context_length=500)
+    assert result.elided_messages == 1
+    assert ELISION_MARKER in result.messages[0]["content"]
+    assert result.messages[1]["content"] == question
+    assert result.final_tokens <= 500
+
+def test_no_orphaned_tool_messages():
+    """
+    Un message `tool` n'est jamais gardé sans le message assistant qui contient
+    son appel d'outil : l'historique n'est coupé qu'au début d'un tour utilisateur
+    """
+    manager = ContextWindowManager(keep_last_turns=1, safety_ratio=0)
+    messages = []
+    for turn in range(6):
+        call_id = f"call_{turn}"
+        messages += [
+            {"role": "user", "content": f"question {turn} " + words(80)},
+            {"role": "assistant", "content": None,
+             "tool_calls": [{"id": call_id, "type": "function", "function": {"name": "cherche", "arguments": "{}"}}]},
+            {"role": "tool", "tool_call_id": call_id, "content": words(80, "résultat")},
+            {"role": "assistant", "content": f"réponse {turn} " + words(80)},
+        ]
+    result = manager.fit("llama-3-3-70b-instruct", messages, context_length=1200)
+    assert result.dropped_messages > 0
+    announced = set()
+    for message in result.messages:
+        for call in message.get("tool_calls") or ():
+            announced.add(call["id"])
+        if message["role"] == "tool":
+            assert message["tool_call_id"] in announced
+
+def test_raw_fits_is_an_upper_bound():
+    """raw_fits n'accepte que les corps dont l'estimation tient forcément dans le budget"""
+    manager = ContextWindowManager(safety_ratio=0)
+    assert manager.raw_fits("llama-3-3-70b-instruct", 1000, context_length=1000)
+    assert not manager.raw_fits("llama-3-3-70b-instruct", 10000, context_length=1000)
+    assert not manager.raw_fits("llama-3-3-70b-instruct", 1000, context_length=1000, max_tokens=900)
@@ -0,0 +1,81 @@
+"""
+Tests unitaires du disjoncteur des modèles (fallback.ModelHealth)
+"""
+
+import pytest
+
+from proxy import fallback
+from proxy.fallback import ModelHealth
+
+class Clock:
+    """Horloge monotone manipulée par les tests"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fallback.time, "monotonic", clock)
+    return clock
+
+def test_breaker_opens_after_threshold(clock):
+    """Le disjoncteur s'ouvre au bout de `failure_threshold` échecs consécutifs"""
+    health = ModelHealth(failure_threshold=2, cooldown=30, queue_slo=0)
+    assert health.record_failure("a") is False
+    assert health.unavailable("a") is None
+    assert health.record_failure("a") is True
+    assert health.unavailable("a") == "breaker_open"
+    assert health.plan(["a", "b"]) == [("b", None), ("a", "breaker_open")]
+
+def test_success_closes_breaker(clock):
+    """Un succès remet le compteur d'échecs à zéro et referme le disjoncteur"""
+    health = ModelHealth(failure_threshold=1, cooldown=30, queue_slo=0)
+    health.record_failure("a")
+    health.record_success("a")
+    assert health.unavailable("a") is None
+    assert health.snapshot()["a"]["breaker"] == "closed"
+
+def test_half_open_allows_a_single_probe(clock):
+    """À la fin du délai, une seule requête de test est autorisée ; son échec rouvre le disjoncteur"""
+    health = ModelHealth(failure_threshold=1, cooldown=30, queue_slo=0)
+    health.record_failure("a")
+    clock.now += 31
+    assert health.snapshot()["a"]["breaker"] == "half_open"
+    assert health.claim_probe("a") is True
+    assert health.claim_probe("a") is False
+    assert health.unavailable("a") == "breaker_open"
+    assert health.record_failure("a") is True
+    assert health.snapshot()["a"]["breaker"] == "open"
+
+def test_half_open_fallback_keeps_its_probe_until_called(clock):
+    """
+    Un modèle de repli à mi-ouverture qui n'est pas appelé (le modèle demandé a répondu)
+    ne doit pas perdre sa requête de test : plan() ne la réserve pas
+    """
+    health = ModelHealth(failure_threshold=1, cooldown=30, queue_slo=0)
+    health.record_failure("fallback")
+    clock.now += 31
+    for _ in range(3):
+        assert health.plan(["requested", "fallback"]) == [("requested", None), ("fallback", None)]
+        health.record_success("requested")
+        clock.now += 1
+    # Premier appel réel du modèle de repli : il obtient la requête de test et peut se refermer
+    assert health.claim_probe("fallback") is True
+    health.record_success("fallback")
+    assert health.snapshot()["fallback"]["breaker"] == "closed"
+
+def test_rate_limit_and_queue_slo(clock):
+    """Un 429 écarte le modèle pendant `rate_limit_cooldown` ; une attente prévue trop longue aussi"""
+    health = ModelHealth(failure_threshold=5, rate_limit_cooldown=10, queue_slo=2, estimate_ttl=60)
+    health.record_failure("a", status=429)
+    assert health.unavailable("a") == "rate_limited"
+    clock.now += 11
+    assert health.unavailable("a") is None
+    health.observe_ttft("a", 5.0)
+    assert health.unavailable("a") == "queue_slo"
+    clock.now += 61
+    assert health.unavailable("a") is None
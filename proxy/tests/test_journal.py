@@ -0,0 +1,87 @@
+"""
+Tests unitaires du journal binaire des requêtes (journal)
+"""
+
+import struct
+
+import pytest
+
+from proxy import journal
+from proxy.journal import RequestJournal, aggregate, decode_record, encode_record, iter_records, parse_time
+
+RECORD = {
+    "timestamp": 1700000000.5, "status": 200, "attempts": 2, "latency_ms": 1234, "upstream_ms": 1100,
+    "prompt_tokens": 500, "completion_tokens": 42, "ttft_ms": 300,
+    "model": "llama-3-3-70b-instruct", "endpoint": "https://ovh.example", "route": "/v1/chat/completions",
+    "client_id": "agent-é",
+}
+
+def test_round_trip():
+    """Un enregistrement encodé puis décodé retrouve tous ses champs"""
+    data = encode_record(RECORD)
+    (length,) = struct.unpack_from("<H", data)
+    assert length == len(data) - 2
+    record = decode_record(data[2:])
+    assert record == dict(RECORD, cache_hit=None)
+
+def test_values_are_clamped_and_strings_truncated():
+    """Les valeurs hors bornes sont ramenées dans leur champ, les textes tronqués à 255 octets"""
+    record = decode_record(encode_record({
+        "timestamp": 1.0, "status": 70000, "attempts": -3, "latency_ms": "abc", "upstream_ms": None,
+        "prompt_tokens": 2 ** 40, "model": "m" * 300,
+    })[2:])
+    assert record["status"] == 0xFFFF
+    assert record["attempts"] == 0
+    assert record["latency_ms"] == 0 and record["upstream_ms"] == 0
+    assert record["prompt_tokens"] == 0xFFFFFFFF
+    assert record["model"] == "m" * 255
+    assert record["endpoint"] == ""
+
+def test_version_1_records_are_decoded():
+    """Les enregistrements de version 1 (sans délai avant le premier token) restent lisibles"""
+    fixed = journal._FIXED_BY_VERSION[1]
+    payload = fixed.pack(1700000000.0, 500, 1, 255, 10, 5, 7, 0) + b"".join(
+        bytes((len(value),)) + value for value in (b"m", b"e", b"/api/chat", b"c"))
+    record = decode_record(payload, fixed)
+    assert record["ttft_ms"] == 0
+    assert record["status"] == 500 and record["model"] == "m" and record["route"] == "/api/chat"
+
+def test_write_and_query_segments(tmp_path):
+    """Les enregistrements écrits par lots se relisent avec les filtres"""
+    writer = RequestJournal(tmp_path)
+    writer.record(**RECORD)
+    writer.record(**dict(RECORD, timestamp=1700000100.0, status=502, model="mistral-7b-instruct-v0.3"))
+    writer.flush()
+    assert [r["model"] for r in iter_records(tmp_path)] == ["llama-3-3-70b-instruct", "mistral-7b-instruct-v0.3"]
+    assert [r["status"] for r in iter_records(tmp_path, status="error")] == [502]
+    assert [r["status"] for r in iter_records(tmp_path, since=1700000050.0)] == [502]
+    assert list(iter_records(tmp_path, model="inconnu")) == []
+
+def test_old_and_truncated_segments(tmp_path):
+    """Un segment de version 1 est relu ; un lot partiellement écrit est ignoré"""
+    fixed = journal._FIXED_BY_VERSION[1]
+    payload = fixed.pack(1700000000.0, 200, 1, 255, 10, 5, 7, 3) + b"\x01m\x00\x00\x00"
+    data = journal.SEGMENT_MAGIC_PREFIX + bytes((1,)) + struct.pack("<H", len(payload)) + payload
+    (tmp_path / "journal-001700000000000.seg").write_bytes(data + struct.pack("<H", 40) + b"tronque")
+    records = list(iter_records(tmp_path))
+    assert len(records) == 1
+    assert records[0]["completion_tokens"] == 3 and records[0]["ttft_ms"] == 0
+
+def test_aggregate():
+    """Agrégats par groupe : erreurs, tokens, percentiles et débit de génération"""
+    records = [decode_record(encode_record(dict(RECORD, status=status))[2:]) for status in (200, 200, 503)]
+    summary = aggregate(records, "model")["llama-3-3-70b-instruct"]
+    assert summary["requests"] == 3 and summary["errors"] == 1
+    assert summary["cache_hits"] == 0
+    assert summary["completion_tokens"] == 126
+    assert summary["latency_ms"]["avg"] == 1234
+    # 41 tokens après le premier en 800 ms
+    assert summary["tokens_per_second"] == round(41 * 3 * 1000 / (800 * 3), 1)
+
+def test_parse_time():
+    """Bornes temporelles relatives, Unix ou ISO"""
+    assert parse_time("30m", now=10000) == 10000 - 1800
+    assert parse_time("1700000000") == 1700000000.0
+    assert parse_time(None) is None
+    with pytest.raises(ValueError):
+        parse_time("hier")
@@ -0,0 +1,67 @@
+"""
+Tests unitaires du relais brut des requêtes OpenAI (passthrough)
+"""
+
+import json
+
+from proxy.passthrough import extract_usage, has_generated_text, inspect_request, patch_model
+
+def body_of(payload):
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+def test_inspect_request():
+    """Le modèle et l'option `stream` sont lus dans les octets"""
+    raw = inspect_request(body_of({"model": "llama-3-3-70b-instruct", "messages": [], "stream": True}))
+    assert raw.model == "llama-3-3-70b-instruct"
+    assert raw.stream is True
+    raw = inspect_request(b'{"model" : "m", "messages": []}')
+    assert raw.model == "m" and raw.stream is False and raw.stream_span is None
+
+def test_inspect_request_ignores_model_inside_content():
+    """Un `"model"` cité dans un message est échappé et ne compte pas comme un champ"""
+    body = body_of({"model": "m", "messages": [{"role": "user", "content": 'Que vaut "model": "x" ?'}]})
+    assert inspect_request(body).model == "m"
+
+def test_inspect_request_bails_out_on_ambiguous_bodies():
+    """Les cas ambigus sont laissés au chemin normal"""
+    # Plusieurs champs `model` (ici dans un outil)
+    assert inspect_request(body_of({"model": "m", "tools": [{"model": "autre"}], "messages": []})) is None
+    # Aucun champ `model`
+    assert inspect_request(body_of({"messages": []})) is None
+    # Nom de modèle contenant un échappement
+    assert inspect_request(b'{"model": "m\\u00e9", "messages": []}') is None
+    # Plusieurs champs `stream`
+    assert inspect_request(body_of({"model": "m", "stream": True, "extra": {"stream": False}})) is None
+    # Mode test, corps vide ou qui n'est pas un objet
+    assert inspect_request(body_of({"model": "m", "test_mode": True})) is None
+    assert inspect_request(b"") is None
+    assert inspect_request(b'["model"]') is None
+
+def test_patch_model_keeps_every_other_byte():
+    """Seule la valeur du champ `model` change ; les autres paramètres sont transmis tels quels"""
+    body = b'{"model": "mistral-7b-instruct-v0.3", "top_p": 0.9, "stop": ["\\n"], "messages": []}'
+    patched = patch_model(body, inspect_request(body), "Mistral-7B-Instruct-v0.3")
+    assert patched == body.replace(b"mistral-7b-instruct-v0.3", b"Mistral-7B-Instruct-v0.3")
+    assert patch_model(body, inspect_request(body), "mistral-7b-instruct-v0.3") is body
+
+def test_patch_model_switches_to_stream():
+    """Avec `stream`, une requête non-streamée devient streamée avec le décompte des tokens"""
+    body = body_of({"model": "m", "messages": []})
+    patched = json.loads(patch_model(body, inspect_request(body), "M", stream=True))
+    assert patched == {"stream": True, "stream_options": {"include_usage": True}, "model": "M", "messages": []}
+
+    body = body_of({"model": "m", "stream": False, "stream_options": {"include_usage": False}, "messages": []})
+    patched = json.loads(patch_model(body, inspect_request(body), "M", stream=True))
+    assert patched["stream"] is True
+    assert patched["stream_options"] == {"include_usage": False}
+
+    body = body_of({"model": "m", "stream": True})
+    assert patch_model(body, inspect_request(body), "m", stream=True) == body
+
+def test_extract_usage_and_generated_text():
+    """Les compteurs de tokens et la présence de texte sont lus sans décoder la réponse"""
+    chunk = b'data: {"choices":[{"delta":{"content":"Bon"}}],"usage":{"prompt_tokens": 12,"completion_tokens":3}}\n\n'
+    assert extract_usage(chunk) == (12, 3)
+    assert has_generated_text(chunk)
+    assert extract_usage(b'{"choices":[]}') == (None, None)
+    assert not has_generated_text(b'data: {"choices":[{"delta":{"content":""}}]}\n\n')
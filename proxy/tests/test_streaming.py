@@ -0,0 +1,103 @@
+"""
+Tests unitaires de l'assemblage des flux OVH (streaming)
+"""
+
+import json
+
+import pytest
+
+from proxy.streaming import CompletionAssembler, EmptyUpstreamResponse, iter_sse_data, read_completion
+
+def chunk(choices, **extra):
+    return dict({"id": "chatcmpl-1", "created": 1, "model": "Meta-Llama-3_3-70B-Instruct", "choices": choices}, **extra)
+
+class FakeResponse:
+    """Réponse OVH minimale : en-têtes et corps découpé en morceaux"""
+
+    def __init__(self, chunks, content_type="text/event-stream"):
+        self.headers = {"Content-Type": content_type}
+        self._chunks = chunks
+
+    def iter_content(self, chunk_size=None):
+        return iter(self._chunks)
+
+    @property
+    def content(self):
+        return b"".join(self._chunks)
+
+def sse(*events):
+    return b"".join(b"data: " + json.dumps(event).encode("utf-8") + b"\n\n" for event in events) + b"data: [DONE]\n\n"
+
+def test_iter_sse_data_handles_arbitrary_splits():
+    """Les lignes `data:` sont reconstituées quel que soit le découpage, jusqu'à [DONE]"""
+    stream = b': keep-alive\n\ndata: {"a":1}\n\ndata: {"b":2}\n\ndata: [DONE]\n\ndata: {"c":3}\n\n'
+    pieces = [stream[i:i + 3] for i in range(0, len(stream), 3)]
+    assert list(iter_sse_data(pieces)) == [b'{"a":1}', b'{"b":2}']
+
+def test_text_is_joined_once():
+    """Les fragments de texte sont joints ; les métadonnées et l'usage sont repris"""
+    assembler = CompletionAssembler("chat")
+    assert not assembler.feed(chunk([{"index": 0, "delta": {"role": "assistant"}}]))
+    assert assembler.feed(chunk([{"index": 0, "delta": {"content": "Bon"}}]))
+    assert assembler.feed(chunk([{"index": 0, "delta": {"content": "jour"}, "finish_reason": "stop"}]))
+    assembler.feed(chunk([], usage={"prompt_tokens": 5, "completion_tokens": 2}))
+    result = assembler.result()
+    assert result["object"] == "chat.completion"
+    assert result["model"] == "Meta-Llama-3_3-70B-Instruct"
+    assert result["choices"] == [{"index": 0, "message": {"role": "assistant", "content": "Bonjour"},
+                                  "logprobs": None, "finish_reason": "stop"}]
+    assert result["usage"]["completion_tokens"] == 2
+    assert assembler.token_events == 2
+
+def test_tool_calls_are_merged():
+    """Les fragments d'appels d'outils sont fusionnés par index, arguments concaténés"""
+    assembler = CompletionAssembler("chat")
+    assembler.feed(chunk([{"index": 0, "delta": {"role": "assistant", "tool_calls": [
+        {"index": 0, "id": "call_a", "type": "function", "function": {"name": "meteo", "arguments": ""}},
+    ]}}]))
+    assembler.feed(chunk([{"index": 0, "delta": {"tool_calls": [
+        {"index": 0, "function": {"arguments": '{"ville":'}},
+        {"index": 1, "id": "call_b", "function": {"name": "heure", "arguments": "{}"}},
+    ]}}]))
+    assembler.feed(chunk([{"index": 0, "delta": {"tool_calls": [{"index": 0, "function": {"arguments": '"Paris"}'}}]},
+                           "finish_reason": "tool_calls"}]))
+    message = assembler.result()["choices"][0]["message"]
+    assert message["content"] is None
+    assert message["tool_calls"] == [
+        {"id": "call_a", "type": "function", "function": {"name": "meteo", "arguments": '{"ville":"Paris"}'}},
+        {"id": "call_b", "type": "function", "function": {"name": "heure", "arguments": "{}"}},
+    ]
+    assert assembler.token_events == 3
+
+def test_text_completions():
+    """Route completions : le texte est lu dans `text`"""
+    assembler = CompletionAssembler("completions")
+    assembler.feed(chunk([{"index": 0, "text": "Il était "}]))
+    assembler.feed(chunk([{"index": 0, "text": "une fois", "finish_reason": "length"}]))
+    result = assembler.result()
+    assert result["object"] == "text_completion"
+    assert result["choices"][0]["text"] == "Il était une fois"
+    assert assembler.completion_tokens() == 2
+
+def test_read_completion_from_stream():
+    """Un flux SSE est assemblé en réponse complète"""
+    response = FakeResponse([sse(chunk([{"index": 0, "delta": {"content": "Salut"}, "finish_reason": "stop"}]))])
+    assembler = read_completion(response, "chat", 0.0, 30, 30)
+    assert assembler.result()["choices"][0]["message"]["content"] == "Salut"
+    assert assembler.first_token_at is not None
+
+def test_read_completion_adopts_a_plain_json_response():
+    """OVH a ignoré `stream` : la réponse JSON complète est reprise telle quelle"""
+    completion = {"id": "x", "object": "chat.completion", "choices": [{"index": 0, "message": {"content": "Salut"}}],
+                  "usage": {"prompt_tokens": 3, "completion_tokens": 1}}
+    assembler = read_completion(FakeResponse([json.dumps(completion).encode()], "application/json"), "chat", 0.0, 30, 30)
+    assert assembler.result() == completion
+    assert assembler.completion_tokens() == 1
+    assert assembler.first_token_at is None
+
+def test_read_completion_rejects_empty_responses():
+    """Un 200 sans événement ni réponse complète n'est pas une génération réussie"""
+    with pytest.raises(EmptyUpstreamResponse):
+        read_completion(FakeResponse([b"<html>proxy</html>"], "text/html"), "chat", 0.0, 30, 30)
+    with pytest.raises(EmptyUpstreamResponse):
+        read_completion(FakeResponse([b"data: [DONE]\n\n"]), "chat", 0.0, 30, 30)
@@ -0,0 +1,193 @@
+"""
+Pools de connexions vers les endpoints OVH
+
+Chaque endpoint dispose d'une session `requests` dédiée, qui garde ses
+connexions HTTP ouvertes d'une requête à l'autre. Quand un endpoint
+disparaît de la configuration, son pool est retiré : les requêtes en cours
+se terminent normalement et la session est fermée après la dernière.
+
+Les connexions se rattachent au jeton d'annulation de la requête en cours
+(voir cancellation.py) : un client qui se déconnecte ferme l'appel OVH.
+"""
+
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from urllib3.util.request import ACCEPT_ENCODING
+
+try:
+    from proxy.cancellation import CancellableAdapter, current_token
+except ImportError:
+    from cancellation import CancellableAdapter, current_token
+
+class _PooledSession:
+    __slots__ = ("session", "in_flight", "retired")
+
+    def __init__(self, session, retired=False):
+        self.session = session
+        self.in_flight = 0
+        self.retired = retired
+
+def _detach_current():
+    token = current_token.get()
+    if token is not None:
+        token.detach_all()
+
+def set_read_timeout(response, seconds):
+    """
+    Change le timeout de lecture d'une réponse ouverte en flux (socket sous-jacent) ;
+    retourne False si le socket n'est pas accessible
+    """
+    connection = getattr(response.raw, "_connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is None:
+        return False
+    sock.settimeout(seconds)
+    return True
+
+class UpstreamPools:
+    """
+    Sessions HTTP par endpoint, avec retrait progressif des endpoints supprimés
+    """
+
+    def __init__(self, pool_maxsize=20):
+        self.pool_maxsize = pool_maxsize
+        self._sessions = {}
+        self._draining = []
+        self._active_urls = None
+        self._lock = threading.Lock()
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = CancellableAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        # Annoncer tous les encodages que urllib3 sait décoder au fil de l'eau (brotli, zstd s'ils sont installés)
+        session.headers["Accept-Encoding"] = ", ".join(ACCEPT_ENCODING.split(","))
+        return session
+
+    @contextmanager
+    def session(self, url):
+        """
+        Fournit la session de l'endpoint `url` pour la durée d'un appel
+        """
+        with self._lock:
+            pooled = self._sessions.get(url)
+            if pooled is None:
+                # Un endpoint déjà retiré (requête en cours sur l'ancienne table) reçoit
+                # une session éphémère, fermée dès la fin de l'appel
+                retired = self._active_urls is not None and url not in self._active_urls
+                pooled = _PooledSession(self._create_session(), retired=retired)
+                if retired:
+                    self._draining.append(pooled)
+                else:
+                    self._sessions[url] = pooled
+            pooled.in_flight += 1
+        try:
+            yield pooled.session
+        finally:
+            with self._lock:
+                pooled.in_flight -= 1
+                close_now = pooled.retired and pooled.in_flight == 0
+                if close_now and pooled in self._draining:
+                    self._draining.remove(pooled)
+            if close_now:
+                pooled.session.close()
+
+    def request(self, endpoint, method, url, **kwargs):
+        """
+        Effectue un appel HTTP via la session de `endpoint` (réponse entièrement lue)
+        """
+        with self.session(endpoint) as session:
+            try:
+                return session.request(method, url, **kwargs)
+            finally:
+                _detach_current()
+
+    def open(self, endpoint, method, url, **kwargs):
+        """
+        Ouvre un appel dont la réponse est lue en flux (`stream=True`). La
+        session reste comptée comme occupée jusqu'à `response.close()`.
+        """
+        # La lecture du flux se fait dans d'autres threads : le jeton est retenu dès l'ouverture
+        token = current_token.get()
+        context = self.session(endpoint)
+        session = context.__enter__()
+        try:
+            response = session.request(method, url, stream=True, **kwargs)
+        except BaseException:
+            if token is not None:
+                token.detach_all()
+            context.__exit__(*sys.exc_info())
+            raise
+        close_response = response.close
+        released = []
+
+        def close():
+            try:
+                close_response()
+            finally:
+                if token is not None:
+                    token.detach_all()
+                if not released:
+                    released.append(True)
+                    context.__exit__(None, None, None)
+
+        response.close = close
+        return response
+
+    def get(self, endpoint, url, **kwargs):
+        return self.request(endpoint, "GET", url, **kwargs)
+
+    def post(self, endpoint, url, **kwargs):
+        return self.request(endpoint, "POST", url, **kwargs)
+
+    def prewarm(self, endpoint, url, connections=1, **kwargs):
+        """
+        Ouvre `connections` connexions (TCP + TLS) vers `endpoint` par des GET simultanés
+        sur `url` ; elles restent ensuite disponibles dans le pool. Retourne les codes HTTP.
+        """
+        def touch(_):
+            return self.get(endpoint, url, **kwargs).status_code
+
+        if connections <= 1:
+            return [touch(0)]
+        with ThreadPoolExecutor(max_workers=min(connections, self.pool_maxsize), thread_name_prefix="prewarm") as executor:
+            return list(executor.map(touch, range(connections)))
+
+    def sync(self, active_urls):
+        """
+        Retire les pools des endpoints qui ne font plus partie de la configuration
+        """
+        to_close = []
+        with self._lock:
+            self._active_urls = frozenset(active_urls)
+            for url in [url for url in self._sessions if url not in self._active_urls]:
+                pooled = self._sessions.pop(url)
+                pooled.retired = True
+                if pooled.in_flight == 0:
+                    to_close.append(pooled)
+                else:
+                    self._draining.append(pooled)
+        for pooled in to_close:
+            pooled.session.close()
+
+    def close_all(self):
+        """Ferme toutes les sessions (arrêt du serveur)"""
+        with self._lock:
+            pools = list(self._sessions.values()) + self._draining
+            self._sessions = {}
+            self._draining = []
+        for pooled in pools:
+            pooled.session.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "draining": len(self._draining),
+                "in_flight": sum(p.in_flight for p in self._sessions.values()) + sum(p.in_flight for p in self._draining),
+            }
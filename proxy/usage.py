@@ -0,0 +1,284 @@
+"""
+Comptabilité de l'usage en tokens et coût estimé
+
+OVH rapporte les tokens consommés (bloc `usage`), mais rien ne les cumulait :
+impossible de dire quel modèle ou quelle équipe a consommé combien cette
+semaine. Chaque requête LLM terminée est ajoutée à un agrégat par tranche de
+temps (`bucket_seconds`, une heure par défaut), modèle servi, endpoint et
+client. Quand OVH ne rapporte pas les tokens, ils sont estimés localement à
+partir de la taille des corps (sans tokenizer) et la requête est comptée
+comme estimée.
+
+Les agrégats sont cumulés en mémoire puis ajoutés, par un thread dédié
+toutes les `flush_interval` secondes, à un fichier JSON compact par jour
+(UTC, une ligne par agrégat) : la requête n'attend jamais le disque et la
+mémoire ne contient que les compteurs des dernières secondes.
+
+Les coûts sont calculés à la lecture avec le barème par modèle (prix par
+million de tokens, fichier JSON relu à chaque interrogation) : une
+modification du barème s'applique aussi à l'historique.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    from proxy.context import estimator_for
+    from proxy.journal import parse_time
+except ImportError:
+    from context import estimator_for
+    from journal import parse_time
+
+SNAPSHOT_VERSION = 1
+DAY_PREFIX = "usage-"
+DAY_SUFFIX = ".json"
+
+# Compteurs d'un agrégat, dans l'ordre des lignes des fichiers journaliers
+COUNTERS = ("requests", "errors", "estimated", "prompt_tokens", "completion_tokens")
+DIMENSIONS = ("model", "endpoint", "client_id")
+GRANULARITIES = ("hour", "day")
+
+def _day(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d")
+
+def estimate_tokens(model_name, size):
+    """Tokens estimés d'un corps de `size` octets"""
+    return int(size / estimator_for(model_name).bytes_per_token)
+
+class PriceTable:
+    """
+    Barème par modèle : prix du million de tokens du prompt (`input`) et générés (`output`)
+    """
+
+    def __init__(self, models=None, default=None, currency="EUR"):
+        self.models = models or {}
+        self.default = default
+        self.currency = currency
+
+    @classmethod
+    def load(cls, path):
+        """Charge le barème ; un fichier absent donne un barème vide (coûts inconnus)"""
+        if not path:
+            return cls()
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        prices = {}
+        for model, price in (data.get("models") or {}).items():
+            prices[model] = cls._price(model, price)
+        default = data.get("default")
+        return cls(prices, cls._price("default", default) if default is not None else None,
+                   data.get("currency", "EUR"))
+
+    @staticmethod
+    def _price(model, price):
+        if not isinstance(price, dict):
+            raise ValueError(f"Prix invalide pour {model}: {price!r}")
+        values = (price.get("input", 0), price.get("output", 0))
+        if any(isinstance(v, bool) or not isinstance(v, (int, float)) or v < 0 for v in values):
+            raise ValueError(f"Prix invalide pour {model}: {price!r}")
+        return values
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        """Coût des tokens sur ce modèle, ou None si le modèle n'a pas de prix"""
+        price = self.models.get(model, self.default)
+        if price is None:
+            return None
+        return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+class UsageLedger:
+    """
+    Agrégats de l'usage par (tranche, modèle, endpoint, client), cumulés en mémoire
+    et ajoutés par lots aux fichiers journaliers de `directory`
+    """
+
+    def __init__(self, directory, bucket_seconds=3600, flush_interval=30.0, prices_path=None):
+        self.directory = Path(directory)
+        self.bucket_seconds = max(60, int(bucket_seconds))
+        self.flush_interval = flush_interval
+        self.prices_path = prices_path
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Sérialise les écritures (thread dédié, arrêt, interrogation)
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, ctx):
+        """Ajoute une requête terminée (contexte du journal) à son agrégat"""
+        model = ctx.get("served_model") or ctx.get("model") or ""
+        prompt_tokens = ctx.get("prompt_tokens")
+        completion_tokens = ctx.get("completion_tokens")
+        estimated = bool(ctx.get("usage_estimated"))
+        if prompt_tokens is None and ctx.get("request_bytes"):
+            prompt_tokens, estimated = estimate_tokens(model, ctx["request_bytes"]), True
+        if completion_tokens is None and ctx.get("response_bytes"):
+            completion_tokens, estimated = estimate_tokens(model, ctx["response_bytes"]), True
+        status = ctx.get("status") or 0
+        timestamp = ctx.get("timestamp") or time.time()
+        bucket = int(timestamp // self.bucket_seconds * self.bucket_seconds)
+        key = (bucket, model, ctx.get("endpoint") or "", ctx.get("client_id") or "")
+        with self._lock:
+            counters = self._pending.get(key)
+            if counters is None:
+                counters = self._pending[key] = [0] * len(COUNTERS)
+            counters[0] += 1
+            counters[1] += 0 if 200 <= status < 400 else 1
+            counters[2] += 1 if estimated else 0
+            counters[3] += prompt_tokens or 0
+            counters[4] += completion_tokens or 0
+        return prompt_tokens, completion_tokens
+
+    def _path(self, day):
+        return self.directory / f"{DAY_PREFIX}{day}{DAY_SUFFIX}"
+
+    def _read_day(self, day):
+        try:
+            with open(self._path(day), "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Fichier d'usage illisible ({self._path(day)}): {str(e)}")
+            return {}
+        if data.get("version") != SNAPSHOT_VERSION:
+            return {}
+        return {tuple(row[:4]): row[4:] for row in data.get("rows", [])}
+
+    def flush(self):
+        """Ajoute les compteurs en attente aux fichiers journaliers"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            by_day = {}
+            for key, counters in batch.items():
+                by_day.setdefault(_day(key[0]), {})[key] = counters
+            error = None
+            for day, rows in by_day.items():
+                try:
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    stored = self._read_day(day)
+                    for key, counters in rows.items():
+                        stored[key] = _add(stored.get(key), counters)
+                    self._write_day(day, stored)
+                except OSError as e:
+                    # Les compteurs non écrits seront repris à la prochaine écriture
+                    error = e
+                    with self._lock:
+                        for key, counters in rows.items():
+                            self._pending[key] = _add(self._pending.get(key), counters)
+            if error is not None:
+                raise error
+
+    def _write_day(self, day, rows):
+        path = self._path(day)
+        tmp_path = path.with_name(path.name + ".tmp")
+        data = {"version": SNAPSHOT_VERSION, "counters": COUNTERS,
+                "rows": [list(key) + list(counters) for key, counters in sorted(rows.items())]}
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def _days(self, since, until):
+        days = sorted(p.name[len(DAY_PREFIX):-len(DAY_SUFFIX)] for p in self.directory.glob(f"{DAY_PREFIX}*{DAY_SUFFIX}"))
+        first = _day(since - self.bucket_seconds) if since is not None else None
+        last = _day(until) if until is not None else None
+        return [d for d in days if (first is None or d >= first) and (last is None or d <= last)]
+
+    def query(self, since=None, until=None, group_by=None, granularity=None, **filters):
+        """
+        Agrège l'usage des tranches commencées entre `since` et `until` : par combinaison
+        des dimensions de `group_by` (liste séparée par des virgules) et, si `granularity`
+        est donnée, par heure ou par jour (UTC). `filters` restreint aux modèles,
+        endpoints ou clients donnés.
+        """
+        dimensions = [d.strip() for d in (group_by or "").split(",") if d.strip()]
+        for dimension in dimensions:
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Regroupement inconnu: {dimension}")
+        if granularity is not None and granularity not in GRANULARITIES:
+            raise ValueError(f"Granularité inconnue: {granularity}")
+        since, until = parse_time(since), parse_time(until)
+        prices = PriceTable.load(self.prices_path)
+        self.flush()
+
+        groups = {}
+        for day in self._days(since, until):
+            for (bucket, model, endpoint, client_id), counters in self._read_day(day).items():
+                if (since is not None and bucket + self.bucket_seconds <= since) or (until is not None and bucket >= until):
+                    continue
+                row = {"model": model, "endpoint": endpoint, "client_id": client_id}
+                if any(value is not None and row[field] != value for field, value in filters.items()):
+                    continue
+                key = tuple(row[d] for d in dimensions)
+                if granularity is not None:
+                    key = (_bucket_label(bucket, granularity),) + key
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = dict.fromkeys(COUNTERS, 0)
+                    group.update(cost=0.0, unpriced_requests=0)
+                for field, value in zip(COUNTERS, counters):
+                    group[field] += value
+                cost = prices.cost(model, counters[3], counters[4])
+                if cost is None:
+                    group["unpriced_requests"] += counters[0]
+                else:
+                    group["cost"] += cost
+
+        rows = []
+        totals = dict.fromkeys(COUNTERS, 0)
+        totals.update(cost=0.0, unpriced_requests=0)
+        for key, group in sorted(groups.items()):
+            row = {}
+            if granularity is not None:
+                row[granularity] = key[0]
+                key = key[1:]
+            row.update(zip(dimensions, key))
+            row.update(group, total_tokens=group["prompt_tokens"] + group["completion_tokens"],
+                       cost=round(group["cost"], 6))
+            for field in totals:
+                totals[field] += group[field]
+            rows.append(row)
+        totals.update(total_tokens=totals["prompt_tokens"] + totals["completion_tokens"], cost=round(totals["cost"], 6))
+        return {
+            "since": since, "until": until, "group_by": dimensions, "granularity": granularity,
+            "bucket_seconds": self.bucket_seconds, "currency": prices.currency,
+            "totals": totals, "rows": rows,
+        }
+
+    def start(self):
+        """Démarre l'écriture périodique des agrégats en arrière-plan"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erreur lors de l'écriture de l'usage: {str(e)}")
+
+def _add(current, counters):
+    return list(counters) if current is None else [a + b for a, b in zip(current, counters)]
+
+def _bucket_label(bucket, granularity):
+    moment = datetime.fromtimestamp(bucket, timezone.utc)
+    return moment.strftime("%Y-%m-%d %H:00") if granularity == "hour" else moment.strftime("%Y-%m-%d")
@@ -0,0 +1,153 @@
+"""
+Canal WebSocket multiplexé pour les clients à haute fréquence
+
+Les agents enchaînent de nombreuses requêtes de chat courtes : chacune paie
+une requête HTTP complète (connexion, en-têtes, middlewares, mise en tampon
+du corps). Sur `/v1/chat/ws`, une seule connexion porte plusieurs requêtes
+simultanées, identifiées par le client :
+
+    → {"type": "chat", "id": "r1", "body": {"model": "...", "messages": [...]}}
+    → {"type": "cancel", "id": "r1"}
+
+Les réponses reviennent en fragments entrelacés, au fil de la génération :
+
+    ← {"type": "delta", "id": "r1", "index": 0, "delta": {"content": "Bon"}}
+    ← {"type": "done", "id": "r1", "model": "...", "finish_reason": "stop", "usage": {...}}
+    ← {"type": "error", "id": "r1", "status": 429, "detail": "...", "retry_after": 1}
+    ← {"type": "cancelled", "id": "r1"}
+
+Contrôle de flux : les trames sortantes passent par une file bornée ; quand
+le client lit moins vite que les générations n'avancent, les requêtes se
+suspendent sur la file et cessent de lire les flux OVH (la contre-pression
+remonte jusqu'à OVH par TCP). Le nombre de requêtes simultanées par
+connexion est limité : au-delà, la requête est refusée (429) sans attendre.
+La fermeture de la connexion annule les requêtes en cours.
+"""
+
+import asyncio
+
+from fastapi import HTTPException
+from starlette.websockets import WebSocketDisconnect
+
+try:
+    from proxy import fastjson
+    from proxy.cancellation import CancelToken
+except ImportError:
+    import fastjson
+    from cancellation import CancelToken
+
+# Code de fermeture WebSocket d'une connexion refusée (clé d'API absente ou invalide)
+POLICY_VIOLATION = 1008
+
+class ChatChannel:
+    """
+    Une connexion WebSocket : lit les trames du client, lance une tâche par requête
+    (`handler(identifiant, corps, jeton d'annulation)`, qui émet ses trames avec
+    `emit`) et écrit les trames sortantes depuis une file bornée
+    """
+
+    def __init__(self, websocket, handler, max_concurrent=8, queue_size=256):
+        self.websocket = websocket
+        self.handler = handler
+        self.max_concurrent = max_concurrent
+        self._outbox = asyncio.Queue(maxsize=queue_size)
+        # identifiant -> (tâche, jeton d'annulation)
+        self._requests = {}
+        self.closed = False
+
+    @property
+    def in_flight(self):
+        return len(self._requests)
+
+    async def emit(self, frame):
+        """Met une trame en file ; attend si le client ne lit pas assez vite"""
+        if not self.closed:
+            await self._outbox.put(fastjson.dumps(frame).decode("utf-8"))
+
+    async def run(self):
+        """Sert la connexion (déjà acceptée) jusqu'à sa fermeture"""
+        writer = asyncio.ensure_future(self._write())
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                # Trames texte ou binaires : les binaires doivent contenir du JSON en UTF-8
+                data = message.get("text")
+                if data is None:
+                    try:
+                        data = (message.get("bytes") or b"").decode("utf-8")
+                    except UnicodeDecodeError:
+                        await self.emit({"type": "error", "id": None, "status": 400, "detail": "Trame binaire non UTF-8."})
+                        continue
+                await self._dispatch(data)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.closed = True
+            pending = list(self._requests.values())
+            for task, token in pending:
+                token.cancel("client_disconnect")
+                task.cancel()
+            if pending:
+                await asyncio.gather(*(task for task, _ in pending), return_exceptions=True)
+            writer.cancel()
+
+    async def _dispatch(self, message):
+        try:
+            frame = fastjson.loads(message)
+        except ValueError:
+            await self.emit({"type": "error", "id": None, "status": 400, "detail": "Trame JSON invalide."})
+            return
+        if not isinstance(frame, dict):
+            await self.emit({"type": "error", "id": None, "status": 400, "detail": "Trame JSON invalide."})
+            return
+        kind, request_id = frame.get("type", "chat"), frame.get("id")
+        if not isinstance(request_id, (str, int)) or isinstance(request_id, bool):
+            await self.emit({"type": "error", "id": None, "status": 400, "detail": "Champ 'id' requis (texte ou entier)."})
+            return
+        if kind == "cancel":
+            current = self._requests.get(request_id)
+            if current is not None:
+                current[1].cancel("client_cancel")
+            return
+        if kind != "chat":
+            await self.emit({"type": "error", "id": request_id, "status": 400, "detail": f"Type de trame inconnu: {kind}"})
+            return
+        if request_id in self._requests:
+            await self.emit({"type": "error", "id": request_id, "status": 409, "detail": "Une requête de même identifiant est en cours."})
+            return
+        if len(self._requests) >= self.max_concurrent:
+            await self.emit({"type": "error", "id": request_id, "status": 429, "retry_after": 1,
+                             "detail": f"Limite de {self.max_concurrent} requêtes simultanées par connexion atteinte."})
+            return
+        token = CancelToken()
+        task = asyncio.ensure_future(self._serve(request_id, frame.get("body"), token))
+        self._requests[request_id] = (task, token)
+
+    async def _serve(self, request_id, body, token):
+        try:
+            await self.handler(request_id, body, token)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            if token.cancelled:
+                await self.emit({"type": "cancelled", "id": request_id})
+            elif isinstance(e, HTTPException):
+                frame = {"type": "error", "id": request_id, "status": e.status_code, "detail": e.detail}
+                retry_after = (e.headers or {}).get("Retry-After")
+                if retry_after is not None:
+                    frame["retry_after"] = int(retry_after)
+                await self.emit(frame)
+            else:
+                await self.emit({"type": "error", "id": request_id, "status": 500, "detail": f"Erreur de traitement: {str(e)}"})
+        finally:
+            self._requests.pop(request_id, None)
+
+    async def _write(self):
+        try:
+            while True:
+                await self.websocket.send_text(await self._outbox.get())
+        except Exception:
+            # Connexion fermée : les trames restantes sont abandonnées
+            self.closed = True